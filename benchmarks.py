@@ -0,0 +1,423 @@
+"""
+Benchmarks for measuring the performance of clay modules
+
+"""
+
+from collections import abc as _abc
+import contextlib as _contextlib
+import io as _io
+import json as _json
+import os as _os
+import tempfile as _tempfile
+import time as _time
+import tracemalloc as _tracemalloc
+
+from clay.linq import extend as _extend, \
+    extend_array as _extend_array, \
+    query as _query
+from clay.models import Model as _Model, \
+    compile_model as _compile_model, \
+    json2model as _json2model, \
+    json2models as _json2models, \
+    models2json as _models2json
+from clay.repos import CrudRepository as _CrudRepository, \
+    ShardedCrudRepository as _ShardedCrudRepository, \
+    UserRepository as _UserRepository, \
+    UserWhitelist as _UserWhitelist, \
+    dump_atomic as _dump_atomic, \
+    load_snapshot as _load_snapshot
+
+def best_of(function: _abc.Callable, repeat: int=3) -> float:
+    """Returns the best time in seconds of calling the function repeat times"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = _time.perf_counter()
+        function()
+        best = min(best, _time.perf_counter() - start)
+    return best
+
+def peak_memory(function: _abc.Callable) -> int:
+    """Returns the peak memory in bytes allocated while calling the function"""
+    _tracemalloc.start()
+    try:
+        function()
+        return _tracemalloc.get_traced_memory()[1]
+    finally:
+        _tracemalloc.stop()
+
+def retained_memory(function: _abc.Callable) -> int:
+    """Returns the memory in bytes still allocated for the result of the function"""
+    _tracemalloc.start()
+    try:
+        result = function()
+        return _tracemalloc.get_traced_memory()[0]
+    finally:
+        _tracemalloc.stop()
+
+def report(name: str, seconds: float, elements: int) -> None:
+    """Prints the total time and the time per element for the benchmark"""
+    print('{:<40} {:>9.4f} s {:>10.1f} ns/element'.format(
+        name, seconds, seconds / max(elements, 1) * 1e9))
+
+def bench_queryable_pipeline(rows: int=1_000_000) -> None:
+    """
+    Compares a five-stage where/select chain evaluated as nested
+    iterators against the fused Queryable plan
+
+    """
+    source = list(range(rows))
+    stages = (
+        ('where', lambda x: x % 2 == 0),
+        ('select', lambda x: x + 1),
+        ('where', lambda x: x % 3 != 0),
+        ('select', lambda x: x * 2),
+        ('where', lambda x: x > 10)
+    )
+
+    def nested() -> list:
+        # one iterator per operator, as Queryable evaluated before fusion
+        expr = iter(source)
+        for kind, function in stages:
+            expr = filter(function, expr) if kind == 'where' else map(function, expr)
+        return list(expr)
+
+    def fused() -> list:
+        queryable = _query(source)
+        for kind, function in stages:
+            getattr(queryable, kind)(function)
+        return queryable.to_list()
+
+    assert nested() == fused()
+
+    print('queryable pipeline ({:,} rows, {} stages)'.format(rows, len(stages)))
+    report('nested iterators', best_of(nested), rows)
+    report('fused plan', best_of(fused), rows)
+
+def bench_select_many(parents: int=10_000, children: int=100) -> None:
+    """
+    Compares flattening with sum(..., []) against the streaming
+    select_many, which grows linearly and holds one child at a time
+
+    """
+    print('select_many ({:,} parents x {} children)'.format(parents, children))
+
+    for count in (parents // 8, parents // 4, parents // 2, parents):
+        source = [list(range(children)) for _ in range(count)]
+        elements = count * children
+
+        def streaming() -> None:
+            for _ in _query(source).select_many(lambda x: x):
+                pass
+
+        report('streaming ({:,} parents)'.format(count), best_of(streaming), elements)
+        print('{:<40} {:>9,} bytes peak'.format('', peak_memory(streaming)))
+
+        # the quadratic flatten is only timed at the smaller sizes
+        if count <= parents // 4:
+            def summed() -> None:
+                for _ in sum(source, []):
+                    pass
+            report('sum(..., []) ({:,} parents)'.format(count), best_of(summed, 1), elements)
+            print('{:<40} {:>9,} bytes peak'.format('', peak_memory(summed)))
+
+def bench_top_k(rows: int=1_000_000, count: int=50) -> None:
+    """Compares a full sort and slice against the heap-based top-k plan"""
+    import random
+    random.seed(0)
+    source = [{'id': str(i), 'score': random.random()} for i in range(rows)]
+
+    def sort_all() -> list:
+        return sorted(source, key=lambda x: x['score'], reverse=True)[:count]
+
+    def top_k() -> list:
+        return _query(source) \
+            .order_by(lambda x: x['score'], reverse=True) \
+            .take(count) \
+            .to_list()
+
+    assert sort_all() == top_k()
+
+    print('top {} of {:,} rows'.format(count, rows))
+    report('sorted()[:k]', best_of(sort_all), rows)
+    report('order_by().take(k)', best_of(top_k), rows)
+
+def bench_array_enumerable(rows: int=1_000_000) -> None:
+    """Compares a list-backed Enumerable of floats against an ArrayEnumerable"""
+    import random
+    random.seed(0)
+    samples = [random.uniform(0, 12) for _ in range(rows)]
+
+    print('float series ({:,} rows)'.format(rows))
+    for name, factory in (('extend', _extend), ('extend_array', _extend_array)):
+        # box fresh floats so the list-backed enumerable is charged for them
+        memory = retained_memory(lambda: factory([x + 0.0 for x in samples]))
+        enumerable = factory(samples)
+        seconds = best_of(lambda: enumerable.where(lambda x: x > 8).sum())
+        report('{} where().sum()'.format(name), seconds, rows)
+        print('{:<40} {:>9,} bytes retained'.format('', memory))
+
+def bench_user_prune(users: int=100_000) -> None:
+    """
+    Prunes half of a user repository, comparing the list removal that
+    deleting used to do against marking the deleted models
+
+    """
+    users_json = [{'id': str(i), 'joined': '2000-01-01' if i % 2 else '2100-01-01'}
+        for i in range(users)]
+
+    with _tempfile.TemporaryDirectory() as directory:
+        name = _os.path.join(directory, 'users.json')
+
+        def prune(count: int) -> float:
+            with open(name, 'w') as fp:
+                _json.dump(users_json[:count], fp)
+            repo = _UserRepository(name)
+            repo.read()
+            start = _time.perf_counter()
+            with _contextlib.redirect_stdout(_io.StringIO()):
+                repo.prune('joined', '%Y-%m-%d')
+            return _time.perf_counter() - start
+
+        def remove_each(count: int) -> float:
+            records = [dict(user) for user in users_json[:count]]
+            start = _time.perf_counter()
+            for record in [x for x in records if x['joined'] < '2050']:
+                records.remove(record)
+            return _time.perf_counter() - start
+
+        print('prune 50% of users')
+        # the quadratic removal is only timed at the smaller sizes
+        for count in (users // 20, users // 10):
+            report('list.remove ({:,} users)'.format(count), remove_each(count), count)
+        for count in (users // 20, users // 10, users):
+            report('prune ({:,} users)'.format(count), prune(count), count)
+
+def bench_insert_range(rows: int=500_000) -> None:
+    """Compares inserting models one at a time against the bulk insert_range"""
+    models = [{'id': str(i), 'name': 'user' + str(i)} for i in range(rows)]
+
+    with _tempfile.TemporaryDirectory() as directory:
+        name = _os.path.join(directory, 'models.json')
+        with open(name, 'w') as fp:
+            _json.dump([], fp)
+
+        def insert_each() -> None:
+            repo = _CrudRepository(name)
+            for model in models:
+                repo.insert(model)
+
+        def insert_range() -> None:
+            _CrudRepository(name).insert_range(models)
+
+        def insert_range_atomic() -> None:
+            _CrudRepository(name).insert_range(models, atomic=True)
+
+        def insert_range_sorted_index() -> None:
+            repo = _CrudRepository(name)
+            repo.create_index('name', 'sorted')
+            repo.insert_range(models)
+
+        print('insert {:,} models'.format(rows))
+        report('insert', best_of(insert_each), rows)
+        report('insert_range', best_of(insert_range), rows)
+        report('insert_range(atomic=True)', best_of(insert_range_atomic), rows)
+        report('insert_range with a sorted index', best_of(insert_range_sorted_index), rows)
+
+class _User(_Model):
+
+    """User model for the repository benchmarks"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.name = ''
+        self.tags = []
+
+def bench_lazy_get(rows: int=200_000) -> None:
+    """Compares a cold get after a full read against a lazy, memory-mapped get"""
+    models = [{'id': str(i), 'name': 'user' + str(i), 'tags': ['a', 'b']} for i in range(rows)]
+
+    with _tempfile.TemporaryDirectory() as directory:
+        name = _os.path.join(directory, 'models.json')
+        with open(name, 'w') as fp:
+            _json.dump(models, fp)
+
+        def cold_get(lazy: bool) -> None:
+            repo = _CrudRepository(name)
+            repo.set_model(_User)
+            repo.set_lazy(lazy)
+            assert repo.get(str(rows // 2))['name'] == 'user' + str(rows // 2)
+
+        print('cold get from {:,} models'.format(rows))
+        report('read then get', best_of(lambda: cold_get(False)), rows)
+        report('lazy get', best_of(lambda: cold_get(True)), rows)
+        print('{:<40} {:>9,} bytes peak'.format('read then get', peak_memory(lambda: cold_get(False))))
+        print('{:<40} {:>9,} bytes peak'.format('lazy get', peak_memory(lambda: cold_get(True))))
+
+def bench_snapshots(sizes: tuple=(10_000, 100_000, 1_000_000)) -> None:
+    """Compares saving and loading JSON snapshots against binary snapshots"""
+    with _tempfile.TemporaryDirectory() as directory:
+        name = _os.path.join(directory, 'models.snapshot')
+        for rows in sizes:
+            models = [{'id': str(i), 'name': 'user' + str(i), 'age': i % 90,
+                'score': i * 0.5, 'active': i % 2 == 0} for i in range(rows)]
+            repeat = 1 if rows >= 1_000_000 else 3
+
+            print('snapshots of {:,} records'.format(rows))
+            for label, binary in (('json', False), ('binary', True)):
+                save = best_of(lambda: _dump_atomic(models, name, binary), repeat)
+                load = best_of(lambda: _load_snapshot(name), repeat)
+                assert _load_snapshot(name) == models
+                report('{} save'.format(label), save, rows)
+                report('{} load'.format(label), load, rows)
+                print('{:<40} {:>9,} bytes'.format('', _os.path.getsize(name)))
+
+def bench_group_commit(rows: int=1_000, updates: int=1_000) -> None:
+    """Compares writing after every update against a batch and a group commit"""
+    with _tempfile.TemporaryDirectory() as directory:
+        name = _os.path.join(directory, 'models.json')
+        with open(name, 'w') as fp:
+            _json.dump([{'id': str(i), 'n': 0} for i in range(rows)], fp)
+
+        def update_all(repo: _CrudRepository) -> None:
+            for i in range(updates):
+                repo.update_prop(str(i % rows), 'n', i)
+                repo.write()
+
+        def write_each() -> None:
+            update_all(_CrudRepository(name))
+
+        def batch() -> None:
+            repo = _CrudRepository(name)
+            with repo.batch():
+                update_all(repo)
+
+        def group_commit() -> None:
+            repo = _CrudRepository(name)
+            repo.start_group_commit(interval=0.01)
+            update_all(repo)
+            repo.stop_group_commit()
+
+        print('{:,} updates and writes of {:,} models'.format(updates, rows))
+        with _contextlib.redirect_stdout(_io.StringIO()):
+            timings = [(label, best_of(function, 1)) for label, function in
+                (('write each', write_each), ('batch', batch), ('group commit', group_commit))]
+        for label, seconds in timings:
+            report(label, seconds, updates)
+
+def bench_sharding(rows: int=200_000, shards: int=16) -> None:
+    """Compares updating one user in a single file against a sharded repository"""
+    users = [{'id': str(i), 'name': 'user' + str(i), 'joined': '2020-01-01'} for i in range(rows)]
+
+    with _tempfile.TemporaryDirectory() as directory:
+        single_name = _os.path.join(directory, 'users.json')
+        sharded_name = _os.path.join(directory, 'sharded.json')
+        with _contextlib.redirect_stdout(_io.StringIO()):
+            with open(single_name, 'w') as fp:
+                _json.dump(users, fp)
+            sharded = _ShardedCrudRepository(sharded_name, shards)
+            for shard in sharded.shards:
+                shard.create(force=True)
+            sharded.insert_range(users)
+            sharded.write()
+
+        def update(factory: _abc.Callable, name: str) -> None:
+            repo = factory(name)
+            with _contextlib.redirect_stdout(_io.StringIO()):
+                repo.update_prop(str(rows // 2), 'name', 'renamed')
+                repo.write()
+
+        print('update one of {:,} users'.format(rows))
+        report('single file', best_of(lambda: update(_CrudRepository, single_name)), 1)
+        report('{} shards'.format(shards), best_of(lambda: update(
+            lambda name: _ShardedCrudRepository(name, shards), sharded_name)), 1)
+        seconds = best_of(lambda: _CrudRepository(single_name).read_queryable().count())
+        report('single file, full scan', seconds, rows)
+        seconds = best_of(lambda: _ShardedCrudRepository(sharded_name, shards).read_queryable().count())
+        report('{} shards, full scan'.format(shards), seconds, rows)
+
+def bench_whitelist(users: int=200_000, lookups: int=1_000) -> None:
+    """Compares whitelist lookups in a list against the set and the bloom filter"""
+    lines = ['user{}\n'.format(i) for i in range(users)]
+    # half of the lookups are for users that are not whitelisted
+    names = ['user{}'.format(i * 2 * users // lookups) for i in range(lookups)]
+
+    stripped = [line.strip() for line in lines]
+
+    def scan() -> None:
+        for name in names:
+            name in stripped
+
+    print('{:,} lookups in a whitelist of {:,} users'.format(lookups, users))
+    report('list', best_of(scan), lookups)
+    for label, bloom in (('set', False), ('bloom filter and set', True)):
+        whitelist = _UserWhitelist(lines, bloom=bloom)
+        whitelist.read()
+        seconds = best_of(lambda: [whitelist.is_authorized(name) for name in names])
+        report(label, seconds, lookups)
+
+def bench_slotted_models(rows: int=200_000) -> None:
+    """Compares the memory and attribute-set cost of models and slotted models"""
+    _SlottedUser = _compile_model('_SlottedUser', {'name': str, 'tags': list},
+        defaults={'name': '', 'tags': []})
+
+    print('{:,} models'.format(rows))
+    for label, model in (('Model', _User), ('compiled model', _SlottedUser)):
+        size = retained_memory(lambda: [model() for _ in range(rows)])
+        print('{:<40} {:>9.1f} MB {:>10.1f} B/model'.format(
+            label + ', retained memory', size / 2**20, size / rows))
+        instance = model()
+        seconds = best_of(lambda: [setattr(instance, 'name', 'user') for _ in range(rows)])
+        report(label + ', attribute set', seconds, rows)
+        seconds = best_of(lambda: [instance.to_json() for _ in range(rows)])
+        report(label + ', to_json', seconds, rows)
+
+def bench_model_conversion(rows: int=200_000) -> None:
+    """
+    Compares converting models one at a time against the bulk
+    conversions, and times a full repository load and save
+
+    """
+    records = [{'id': str(i), 'name': 'user' + str(i), 'tags': ['a', 'b']} for i in range(rows)]
+    _SlottedUser = _compile_model('_SlottedUser', {'name': str, 'tags': list},
+        defaults={'name': '', 'tags': []})
+
+    print('{:,} models'.format(rows))
+    for label, model in (('Model', _User), ('compiled model', _SlottedUser)):
+        seconds = best_of(lambda: [_json2model(record, model) for record in records])
+        report(label + ', json2model', seconds, rows)
+        seconds = best_of(lambda: _json2models(records, model))
+        report(label + ', json2models', seconds, rows)
+        models = _json2models(records, model)
+        seconds = best_of(lambda: [m.to_json() for m in models])
+        report(label + ', to_json', seconds, rows)
+        seconds = best_of(lambda: _models2json(models))
+        report(label + ', models2json', seconds, rows)
+
+    with _tempfile.TemporaryDirectory() as directory:
+        name = _os.path.join(directory, 'users.json')
+        with open(name, 'w') as fp:
+            _json.dump(records, fp)
+
+        for label, model in (('Model', _User), ('compiled model', _SlottedUser)):
+            repo = _CrudRepository(name)
+            repo.set_model(model)
+            report(label + ', repository read', best_of(lambda: repo.read(fetch_if_read=True)), rows)
+            with _contextlib.redirect_stdout(_io.StringIO()):
+                seconds = best_of(lambda: repo.write())
+            report(label + ', repository write', seconds, rows)
+
+if __name__ == '__main__':
+
+    import sys as _sys
+
+    # the benchmarks take minutes, so they only run when named or when
+    # 'all' is given, not as part of the test run
+    names = _sys.argv[1:]
+    if not names:
+        print('Usage: benchmarks.py all | bench_name [bench_name ...]')
+
+    if names == ['all']:
+        names = [name for name in list(globals()) if name.startswith('bench_')]
+
+    for name in names:
+        globals()[name]()
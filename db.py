@@ -44,16 +44,11 @@ class RelationalModel(Model, Abstract):
 
         child_name = self.child_name(repo)
 
-        model = repo.read() \
-            .where(lambda x: x['id'] == self[child_name + 'Id']) \
-            .first_or_default()
-
-        return model
+        return repo.get(self[child_name + 'Id'])
 
     def inverse_prop(self, repo):
 
         child_name = uncapitalize(qualify(self))
 
-        # try and read the entities
-        return repo.read() \
-            .where(lambda x: x[child_name + 'Id'] == self['id'])
+        # try and find the entities, using an index on the key if there is one
+        return repo.find_by(child_name + 'Id', self['id'])
@@ -6,7 +6,7 @@ TODO: support salary calculations
 
 """
 
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 import datetime as dt
 import math
 import os
@@ -14,6 +14,7 @@ import pprint
 from statistics import median, mean as average
 
 from clay.graphing import Histogram
+from clay.linq import extend
 from clay.settings import JOBS_BREAK_SCHEDULES, JOBS_OVERTIME_RATES
 
 DAYS_OF_THE_WEEK = (
@@ -142,6 +143,7 @@ class Attendance(object):
     def print_report(self):
         """Prints the attendance report to stdout"""
         hours = self.get_hours()
+        stats = extend(hours).aggregate_many(sum=None, average=None)
         print()
         self.setup_pt() # set up both pt's
         print()
@@ -151,13 +153,13 @@ class Attendance(object):
         print('by month')
         pprint.pprint(self.pt['month'])
         print()
-        print('total hours: ', round(self.get_total_hours(), 4))
+        print('total hours: ', round(stats['sum'], 4))
         self.print_money('week')
         self.print_money_all()
         print()
-        print('average:', round(self.get_average_hours(), 4))
+        print('average:', round(stats['average'], 4))
         print('median :', round(median(hours), 4))
-        print('mode   :', round(max(hours, key=hours.count), 4))
+        print('mode   :', round(Counter(hours).most_common(1)[0][0], 4))
         print()
         self.print_punchcard()
         print()
@@ -4,11 +4,29 @@ Classes and extensions to make iterables more fluent.
 
 """
 
-from collections import abc, OrderedDict
-
-from clay.models import Interface as _Interface
+import array as _array
+from collections import abc, deque as _deque, OrderedDict
+from concurrent import futures as _futures
+import functools as _functools
+import heapq as _heapq
+import itertools as _itertools
+import os as _os
+import pickle as _pickle
+import statistics as _statistics
+import time as _time
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+from clay.models import Interface as _Interface, \
+    Serializable as _Serializable
 from clay.utils import qualify as _qualify
 
+# default seed for aggregate, which starts from the first item instead
+_NO_SEED = object()
+
 class IEnumerable(_Interface):
 
     """Interface for enumerable objects"""
@@ -23,75 +41,551 @@ class IEnumerable(_Interface):
     def any(self, predicate: abc.Callable=lambda x: True) -> bool:
         raise NotImplementedError(_qualify(self.any))
 
+    def count(self, predicate: abc.Callable=None) -> int:
+        raise NotImplementedError(_qualify(self.count))
+
+    def sum(self, selector: abc.Callable=None) -> object:
+        raise NotImplementedError(_qualify(self.sum))
+
+    def min(self, selector: abc.Callable=None) -> object:
+        raise NotImplementedError(_qualify(self.min))
+
+    def max(self, selector: abc.Callable=None) -> object:
+        raise NotImplementedError(_qualify(self.max))
+
+    def average(self, selector: abc.Callable=None) -> float:
+        raise NotImplementedError(_qualify(self.average))
+
+    def aggregate(self,
+            func: abc.Callable,
+            seed: object=_NO_SEED,
+            result_selector: abc.Callable=lambda x: x) -> object:
+        raise NotImplementedError(_qualify(self.aggregate))
+
+    def aggregate_many(self, **selectors) -> dict:
+        raise NotImplementedError(_qualify(self.aggregate_many))
+
     def first_or_default(self, default: object=None) -> object:
         raise NotImplementedError(_qualify(self.first_or_default))
 
     def last_or_default(self, default: object=None) -> object:
         raise NotImplementedError(_qualify(self.last_or_default))
 
-    def group_by(self, property: str) -> abc.Hashable:
+    def group_by(self, property: str, on_error: abc.Callable=None) -> 'Grouping':
         raise NotImplementedError(_qualify(self.group_by))
 
     def group_by_key(self,
             key_selector: abc.Callable,
-            element_selector: abc.Callable=lambda x: x) -> abc.Hashable:
+            element_selector: abc.Callable=lambda x: x,
+            on_error: abc.Callable=None) -> 'Grouping':
         raise NotImplementedError(_qualify(self.group_by_key))
 
+    def join(self,
+            inner: abc.Iterable,
+            outer_key_selector: abc.Callable,
+            inner_key_selector: abc.Callable,
+            result_selector: abc.Callable=lambda outer, inner: (outer, inner)) -> 'IEnumerable':
+        raise NotImplementedError(_qualify(self.join))
+
+    def group_join(self,
+            inner: abc.Iterable,
+            outer_key_selector: abc.Callable,
+            inner_key_selector: abc.Callable,
+            result_selector: abc.Callable=lambda outer, inners: (outer, inners)) -> 'IEnumerable':
+        raise NotImplementedError(_qualify(self.group_join))
+
     def order_by(self, key: abc.Callable=None, reverse: bool=False) -> 'IEnumerable':
         raise NotImplementedError(_qualify(self.order_by))
 
     def select(self, selector: abc.Callable) -> 'IEnumerable':
         raise NotImplementedError(_qualify(self.select))
 
-    def select_many(self, selector: abc.Callable) -> 'IEnumerable':
+    def select_many(self,
+            selector: abc.Callable,
+            result_selector: abc.Callable=None) -> 'IEnumerable':
         raise NotImplementedError(_qualify(self.select_many))
 
     def skip(self, count: int) -> 'IEnumerable':
         raise NotImplementedError(_qualify(self.skip))
 
+    def skip_while(self, predicate: abc.Callable) -> 'IEnumerable':
+        raise NotImplementedError(_qualify(self.skip_while))
+
+    def take(self, count: int) -> 'IEnumerable':
+        raise NotImplementedError(_qualify(self.take))
+
+    def take_while(self, predicate: abc.Callable) -> 'IEnumerable':
+        raise NotImplementedError(_qualify(self.take_while))
+
     def diff(self, other: 'IEnumerable') -> 'IEnumerable':
         raise NotImplementedError(_qualify(self.diff))
 
     def intersect(self, other: 'IEnumerable') -> 'IEnumerable':
         raise NotImplementedError(_qualify(self.intersect))
 
+    def union(self, other: 'IEnumerable') -> 'IEnumerable':
+        raise NotImplementedError(_qualify(self.union))
+
     def distinct(self) -> 'IEnumerable':
         raise NotImplementedError(_qualify(self.distinct))
 
+    def distinct_by(self, key_selector: abc.Callable) -> 'IEnumerable':
+        raise NotImplementedError(_qualify(self.distinct_by))
+
     def where(self, predicate: abc.Callable) -> 'IEnumerable':
         raise NotImplementedError(_qualify(self.where))
 
     def whereif(self, condition: bool, predicate: abc.Callable) -> 'IEnumerable':
         raise NotImplementedError(_qualify(self.whereif))
 
+    def to_lookup(self,
+            key_selector: abc.Callable,
+            element_selector: abc.Callable=lambda x: x) -> dict:
+        raise NotImplementedError(_qualify(self.to_lookup))
+
+    def to_dict(self,
+            key_selector: abc.Callable,
+            element_selector: abc.Callable=lambda x: x) -> dict:
+        raise NotImplementedError(_qualify(self.to_dict))
+
     @property
     def base(self) -> abc.Iterable:
         raise NotImplementedError('IEnumerable.base')
 
-def group_items(iterable: abc.Iterable, property: str) -> abc.Hashable:
-    grouped = OrderedDict()
+# markers that keep canonical keys of containers apart from other keys
+_DICT_KEY = object()
+_LIST_KEY = object()
+_MODEL_KEY = object()
+_TUPLE_KEY = object()
+
+def canonical_key(item: object) -> abc.Hashable:
+    """
+    Returns a hashable key that is equal for equal items. Hashable items
+    are their own key, while dicts, lists, sets, tuples and serializable
+    models are converted recursively. Raises TypeError for other types.
+
+    """
+    try:
+        hash(item)
+        return item
+    except TypeError:
+        pass
+
+    if isinstance(item, dict):
+        return (_DICT_KEY, frozenset((key, canonical_key(value)) for key, value in item.items()))
+    elif isinstance(item, list):
+        return (_LIST_KEY, tuple(map(canonical_key, item)))
+    elif isinstance(item, tuple):
+        return (_TUPLE_KEY, tuple(map(canonical_key, item)))
+    elif isinstance(item, (set, frozenset)):
+        return frozenset(item)
+    elif isinstance(item, _Serializable):
+        return (_MODEL_KEY, canonical_key(item.to_json()))
+
+    raise TypeError('unhashable type: {}'.format(type(item).__name__))
+
+def distinct_items(iterable: abc.Iterable, key_selector: abc.Callable=None) -> abc.Iterator:
+    """
+    Lazily yields the first item for each distinct key in order.
+    The canonical key is computed once per item.
+
+    """
+    seen = set()
     for each in iterable:
-        if property in each:
-            if each[property] not in grouped:
-                grouped[each[property]] = []
-            grouped[each[property]].append(each)
-        else:
-            print('Could not group by {}: {}'.format(property, each))
+        key = canonical_key(each if key_selector is None else key_selector(each))
+        if key not in seen:
+            seen.add(key)
+            yield each
+
+def diff_items(iterable: abc.Iterable, other: abc.Iterable) -> abc.Iterator:
+    """Lazily yields the distinct items that are not in other in order"""
+    seen = set(map(canonical_key, other))
+    for each in iterable:
+        key = canonical_key(each)
+        if key not in seen:
+            seen.add(key)
+            yield each
+
+def intersect_items(iterable: abc.Iterable, other: abc.Iterable) -> abc.Iterator:
+    """Lazily yields the items that are also in other in order"""
+    keys = set(map(canonical_key, other))
+    return (each for each in iterable if canonical_key(each) in keys)
+
+def union_items(iterable: abc.Iterable, other: abc.Iterable) -> abc.Iterator:
+    """Lazily yields the distinct items of both iterables in order"""
+    return distinct_items(_itertools.chain(iterable, other))
+
+class _Accumulator:
+
+    """Accumulates an aggregate one item at a time in constant memory"""
+
+    def __init__(self, selector: abc.Callable=None) -> None:
+        """Initializes this accumulator with the given selector"""
+        self.selector = selector
+        self.count = 0
+        self.value = None
+
+    def add(self, item: object) -> None:
+        """Adds the item to this accumulator"""
+        self.count += 1
+        self.combine(item if self.selector is None else self.selector(item))
+
+    def combine(self, value: object) -> None:
+        """Combines the value with the accumulated value"""
+        self.value = value
+
+    @property
+    def result(self) -> object:
+        """The aggregate of the items added, None if there are none"""
+        return self.value
+
+class _CountAccumulator(_Accumulator):
+
+    def add(self, item: object) -> None:
+        if self.selector is None or self.selector(item):
+            self.count += 1
+
+    @property
+    def result(self) -> int:
+        return self.count
+
+class _SumAccumulator(_Accumulator):
+
+    def combine(self, value: object) -> None:
+        self.value = value if self.count == 1 else self.value + value
+
+    @property
+    def result(self) -> object:
+        return 0 if self.count == 0 else self.value
+
+class _MinAccumulator(_Accumulator):
+
+    def combine(self, value: object) -> None:
+        if self.count == 1 or value < self.value:
+            self.value = value
+
+class _MaxAccumulator(_Accumulator):
+
+    def combine(self, value: object) -> None:
+        if self.count == 1 or value > self.value:
+            self.value = value
+
+class _AverageAccumulator(_SumAccumulator):
+
+    @property
+    def result(self) -> float:
+        return None if self.count == 0 else self.value / self.count
+
+_ACCUMULATORS = {
+    'average': _AverageAccumulator,
+    'count': _CountAccumulator,
+    'max': _MaxAccumulator,
+    'min': _MinAccumulator,
+    'sum': _SumAccumulator
+}
+
+def aggregate_items(iterable: abc.Iterable, **selectors) -> dict:
+    """
+    Computes the aggregates named by the keywords in a single pass with
+    constant memory per aggregate. Aggregates of no items are None,
+    except for count and sum, which are 0.
+
+    """
+    accumulators = {}
+    for name, selector in selectors.items():
+        if name not in _ACCUMULATORS:
+            raise ValueError('aggregate must be one of [{}]'.format(', '.join(_ACCUMULATORS)))
+        accumulators[name] = _ACCUMULATORS[name](selector)
+
+    adders = [accumulator.add for accumulator in accumulators.values()]
+    for each in iterable:
+        for add in adders:
+            add(each)
+
+    return {name: accumulator.result for name, accumulator in accumulators.items()}
+
+def average_items(iterable: abc.Iterable, selector: abc.Callable=None) -> float:
+    """Returns the mean of the items in a single pass. Raises ValueError if empty"""
+    accumulator = _AverageAccumulator(selector)
+    for each in iterable:
+        accumulator.add(each)
+    if accumulator.count == 0:
+        raise ValueError('average of empty sequence')
+    return accumulator.result
+
+def count_items(iterable: abc.Iterable, predicate: abc.Callable=None) -> int:
+    """Returns the number of items matching the predicate, or all items"""
+    if predicate is None and isinstance(iterable, abc.Sized):
+        return len(iterable)
+    if predicate is not None:
+        iterable = filter(predicate, iterable)
+    return sum(1 for _ in iterable)
+
+def fold_items(iterable: abc.Iterable, func: abc.Callable, seed: object=_NO_SEED) -> object:
+    """
+    Applies the accumulator function over the items, starting from the
+    seed or the first item. Raises ValueError if empty without a seed
+
+    """
+    if seed is not _NO_SEED:
+        return _functools.reduce(func, iterable, seed)
+    iterator = iter(iterable)
+    first = next(iterator, _NO_SEED)
+    if first is _NO_SEED:
+        raise ValueError('aggregate of empty sequence with no seed')
+    return _functools.reduce(func, iterator, first)
+
+# functions that select can compute while grouping
+_GROUP_AGGREGATES = {
+    len: 'count',
+    max: 'max',
+    min: 'min',
+    _statistics.mean: 'average',
+    sum: 'sum'
+}
+
+def _select_property(property: str) -> abc.Callable:
+    """Returns a key selector for the given property"""
+    return lambda each: each[property]
+
+class Grouping(OrderedDict):
+
+    """
+    Lazily groups items by key. It is an OrderedDict of keys to groups
+    that stores the members of each group on first access, while select
+    and aggregate_many compute each group's result during the grouping
+    pass instead. Items that cannot be grouped are counted in errors and
+    passed with the exception to on_error if given.
+
+    """
+
+    def __init__(self,
+            iterable: abc.Iterable,
+            key_selector: abc.Callable,
+            element_selector: abc.Callable=None,
+            on_error: abc.Callable=None,
+            group_type: type=list) -> None:
+        """Initializes this grouping over the given iterable"""
+        super().__init__()
+        self._iterable = iterable
+        self._key_selector = key_selector
+        self._element_selector = element_selector
+        self._on_error = on_error
+        self._group_type = group_type
+        self._grouped = False
+        self.errors = 0
+
+    def _group(self) -> None:
+        """Stores the members of each group on first access"""
+        if not self._grouped:
+            self._grouped = True
+            for key, members in self.to_lists().items():
+                OrderedDict.__setitem__(self, key, self._group_type(members))
+
+    def __repr__(self) -> str:
+        """Returns the string representation of this grouping"""
+        return '{}({})'.format(self.__class__.__name__, dict(self))
+
+    def __reduce__(self) -> tuple:
+        """Pickles and copies the groups as an OrderedDict"""
+        return OrderedDict, (list(self.items()),)
+
+    def copy(self) -> OrderedDict:
+        """Returns a shallow copy of the groups as an OrderedDict"""
+        return OrderedDict(self)
+
+    def __or__(self, other: abc.Mapping) -> OrderedDict:
+        """Returns the groups merged with other as an OrderedDict"""
+        return self.copy() | other
+
+    def __ror__(self, other: abc.Mapping) -> OrderedDict:
+        """Returns other merged with the groups as an OrderedDict"""
+        return OrderedDict(other) | self
+
+    def _pairs(self) -> abc.Iterator:
+        """Yields the key and element of each item that can be grouped"""
+        self.errors = 0
+        key_selector = self._key_selector
+        element_selector = self._element_selector
+        for each in self._iterable:
+            try:
+                key = key_selector(each)
+                element = each if element_selector is None else element_selector(each)
+            except (AttributeError, KeyError, TypeError) as ex:
+                self.errors += 1
+                if self._on_error is not None:
+                    self._on_error(each, ex)
+                continue
+            yield key, element
+
+    def to_lists(self) -> OrderedDict:
+        """Groups the items into lists of members by key"""
+        grouped = OrderedDict()
+        for key, element in self._pairs():
+            if key in grouped:
+                grouped[key].append(element)
+            else:
+                grouped[key] = [element]
+        return grouped
+
+    def aggregate_many(self, **selectors) -> OrderedDict:
+        """
+        Computes the aggregates named by the keywords for each group in
+        the grouping pass without storing the members. See aggregate_items.
+
+        """
+        for name in selectors:
+            if name not in _ACCUMULATORS:
+                raise ValueError('aggregate must be one of [{}]'.format(', '.join(_ACCUMULATORS)))
+
+        grouped = OrderedDict()
+        for key, element in self._pairs():
+            accumulators = grouped.get(key)
+            if accumulators is None:
+                accumulators = grouped[key] = [_ACCUMULATORS[name](selector)
+                    for name, selector in selectors.items()]
+            for accumulator in accumulators:
+                accumulator.add(element)
+
+        for key, accumulators in grouped.items():
+            grouped[key] = {name: accumulator.result
+                for name, accumulator in zip(selectors, accumulators)}
+        return grouped
+
+    def select(self, selector: abc.Callable) -> OrderedDict:
+        """
+        Returns the result of the selector for each group by key.
+        The builtins len, max, min and sum and statistics.mean are
+        computed while grouping without storing the members.
+
+        """
+        name = _GROUP_AGGREGATES.get(selector)
+        if name is None:
+            return OrderedDict((key, selector(group)) for key, group in self.items())
+        aggregates = self.aggregate_many(**{name: None})
+        for key in aggregates:
+            aggregates[key] = aggregates[key][name]
+        return aggregates
+
+    @property
+    def groups(self) -> OrderedDict:
+        """The groups of members by key, grouped on first access"""
+        self._group()
+        return self
+
+def _grouped(name: str) -> abc.Callable:
+    """Returns the named OrderedDict method of Grouping, which groups the items first"""
+    method = getattr(OrderedDict, name)
+    def grouped(self, *args, **kwargs) -> object:
+        self._group()
+        return method(self, *args, **kwargs)
+    grouped.__name__ = name
+    grouped.__doc__ = method.__doc__
     return grouped
 
+# dict access from C bypasses overridden methods unless __iter__ is overridden,
+# so every read and write of the mapping groups the items first
+for _name in ('__getitem__', '__setitem__', '__delitem__', '__iter__', '__reversed__',
+        '__len__', '__contains__', '__eq__', '__ne__', '__ior__', 'get', 'keys', 'values',
+        'items', 'pop', 'popitem', 'setdefault', 'update', 'clear', 'move_to_end'):
+    setattr(Grouping, _name, _grouped(_name))
+del _name
+
+def group_items(iterable: abc.Iterable,
+        property: str,
+        on_error: abc.Callable=None) -> OrderedDict:
+    """Groups items into lists by the given property"""
+    return Grouping(iterable, _select_property(property), on_error=on_error).to_lists()
+
 def group_items_by_key(iterable: abc.Iterable,
         key_selector: abc.Callable,
-        element_selector: abc.Callable=lambda x: x) -> abc.Hashable:
-    grouped = OrderedDict()
+        element_selector: abc.Callable=lambda x: x,
+        on_error: abc.Callable=None) -> OrderedDict:
+    """Groups items into lists by the given key and element selectors"""
+    return Grouping(iterable, key_selector, element_selector, on_error).to_lists()
+
+def lookup_items(iterable: abc.Iterable,
+        key_selector: abc.Callable,
+        element_selector: abc.Callable=lambda x: x) -> dict:
+    """Returns a hash table of keys to the lists of elements sharing them"""
+    lookup = {}
     for each in iterable:
-        try:
-            key = key_selector(each)
-            if key not in grouped:
-                grouped[key] = []
-            grouped[key].append(element_selector(each))
-        except AttributeError:
-            print('Could not group by key or element selector: {}'.format(each))
-    return grouped
+        key = key_selector(each)
+        if key in lookup:
+            lookup[key].append(element_selector(each))
+        else:
+            lookup[key] = [element_selector(each)]
+    return lookup
+
+def dict_items(iterable: abc.Iterable,
+        key_selector: abc.Callable,
+        element_selector: abc.Callable=lambda x: x) -> dict:
+    """Returns a dictionary of keys to elements. Raises ValueError for duplicate keys"""
+    result = {}
+    for each in iterable:
+        key = key_selector(each)
+        if key in result:
+            raise ValueError('duplicate key "{}"'.format(key))
+        result[key] = element_selector(each)
+    return result
+
+def select_many_items(iterable: abc.Iterable,
+        selector: abc.Callable,
+        result_selector: abc.Callable=None) -> abc.Iterator:
+    """Lazily flattens the children selected from each item"""
+    if result_selector is None:
+        return _itertools.chain.from_iterable(map(selector, iterable))
+    return (result_selector(each, child)
+        for each in iterable
+            for child in selector(each))
+
+def join_items(outer: abc.Iterable,
+        inner: abc.Iterable,
+        outer_key_selector: abc.Callable,
+        inner_key_selector: abc.Callable,
+        result_selector: abc.Callable=lambda outer, inner: (outer, inner)) -> abc.Iterator:
+    """
+    Correlates outer and inner items with equal keys in linear time.
+    The hash table is built once over the smaller side when both sides
+    are sized, otherwise over the inner side. Results are ordered by
+    the outer items, then the inner items.
+
+    """
+    if isinstance(outer, abc.Sized) and isinstance(inner, abc.Sized) \
+            and len(outer) < len(inner):
+        # hash the outer positions and bucket the inner matches by position
+        positions = lookup_items(enumerate(outer),
+            lambda pair: outer_key_selector(pair[1]),
+            lambda pair: pair[0])
+        matches = {}
+        for each in inner:
+            for position in positions.get(inner_key_selector(each), ()):
+                if position in matches:
+                    matches[position].append(each)
+                else:
+                    matches[position] = [each]
+        for position, each in enumerate(outer):
+            for match in matches.get(position, ()):
+                yield result_selector(each, match)
+    else:
+        lookup = lookup_items(inner, inner_key_selector)
+        for each in outer:
+            for match in lookup.get(outer_key_selector(each), ()):
+                yield result_selector(each, match)
+
+def group_join_items(outer: abc.Iterable,
+        inner: abc.Iterable,
+        outer_key_selector: abc.Callable,
+        inner_key_selector: abc.Callable,
+        result_selector: abc.Callable=lambda outer, inners: (outer, inners)) -> abc.Iterator:
+    """
+    Correlates each outer item with the enumerable of inner items
+    with an equal key, which is empty if there are none
+
+    """
+    lookup = lookup_items(inner, inner_key_selector)
+    for each in outer:
+        yield result_selector(each, extend(lookup.get(outer_key_selector(each), [])))
 
 def extend(iterable: abc.Iterable=()):
     """Returns an instance of Enumerable using the given iterable"""
@@ -126,6 +620,70 @@ def extend(iterable: abc.Iterable=()):
             """Returns True if there are any items matching the predicate, False otherwise"""
             return any(map(predicate, self))
 
+        def count(self, *value, predicate: abc.Callable=None) -> int:
+            """
+            Returns the number of items matching the predicate, given
+            positionally like the other aggregates or by keyword, or all
+            items. A value that is not callable is counted like the base count
+
+            """
+            if value and not callable(value[0]):
+                if hasattr(base, 'count'):
+                    return base.count(self, *value)
+                value, = value
+                return count_items(self, lambda x: x is value or x == value)
+            if value:
+                predicate, = value
+            return count_items(self, predicate)
+
+        def sum(self, selector: abc.Callable=None) -> object:
+            """Returns the sum of the items or the values selected from them"""
+            return sum(self if selector is None else map(selector, self))
+
+        def min(self, selector: abc.Callable=None) -> object:
+            """
+            Returns the minimum of the items or the values selected from them.
+            Raises ValueError if there are no items
+
+            """
+            return min(self if selector is None else map(selector, self))
+
+        def max(self, selector: abc.Callable=None) -> object:
+            """
+            Returns the maximum of the items or the values selected from them.
+            Raises ValueError if there are no items
+
+            """
+            return max(self if selector is None else map(selector, self))
+
+        def average(self, selector: abc.Callable=None) -> float:
+            """
+            Returns the mean of the items or the values selected from them.
+            Raises ValueError if there are no items
+
+            """
+            return average_items(self, selector)
+
+        def aggregate(self,
+                func: abc.Callable,
+                seed: object=_NO_SEED,
+                result_selector: abc.Callable=lambda x: x) -> object:
+            """
+            Applies the accumulator function over the items, starting from the
+            seed or the first item, and returns the selected result
+
+            """
+            return result_selector(fold_items(self, func, seed))
+
+        def aggregate_many(self, **selectors) -> dict:
+            """
+            Computes the aggregates named by the keywords (average, count, max,
+            min, sum) in a single pass. Each keyword takes a selector, or a
+            predicate for count, or None for the items themselves.
+
+            """
+            return aggregate_items(self, **selectors)
+
         def first_or_default(self, default: object=None) -> object:
             """
             Returns the first item in this Enumerable or
@@ -142,21 +700,42 @@ def extend(iterable: abc.Iterable=()):
             """
             return self[-1] if self else default
 
-        def group_by(self, property: str) -> abc.Hashable:
-            """Groups items by the given property"""
-            return group_items(self, property)
+        def group_by(self, property: str, on_error: abc.Callable=None) -> Grouping:
+            """Lazily groups items into enumerables by the given property"""
+            return Grouping(self, _select_property(property),
+                on_error=on_error,
+                group_type=extend)
 
         def group_by_key(self,
                 key_selector: abc.Callable,
-                element_selector: abc.Callable=lambda x: x) -> abc.Hashable:
-            """Groups items by the given key and element selectors"""
-            grouped = group_items_by_key(self, key_selector, element_selector)
-
-            # convert the groups to enumerables
-            for group in grouped:
-                grouped[group] = extend(grouped[group])
-
-            return grouped
+                element_selector: abc.Callable=lambda x: x,
+                on_error: abc.Callable=None) -> Grouping:
+            """Lazily groups items into enumerables by the given key and element selectors"""
+            return Grouping(self, key_selector, element_selector, on_error, extend)
+
+        def join(self,
+                inner: abc.Iterable,
+                outer_key_selector: abc.Callable,
+                inner_key_selector: abc.Callable,
+                result_selector: abc.Callable=lambda outer, inner: (outer, inner)) -> IEnumerable:
+            """Correlates items with the inner items based on matching keys"""
+            return Enumerable(base(join_items(self,
+                inner,
+                outer_key_selector,
+                inner_key_selector,
+                result_selector)))
+
+        def group_join(self,
+                inner: abc.Iterable,
+                outer_key_selector: abc.Callable,
+                inner_key_selector: abc.Callable,
+                result_selector: abc.Callable=lambda outer, inners: (outer, inners)) -> IEnumerable:
+            """Correlates items with groups of inner items based on matching keys"""
+            return Enumerable(base(group_join_items(self,
+                inner,
+                outer_key_selector,
+                inner_key_selector,
+                result_selector)))
 
         def order_by(self, key: abc.Callable=None, reverse: bool=False) -> IEnumerable:
             """Returns items ordered by the given key selector"""
@@ -170,41 +749,61 @@ def extend(iterable: abc.Iterable=()):
             """
             return Enumerable(base(map(selector, self)))
 
-        def select_many(self, selector: abc.Callable) -> IEnumerable:
+        def select_many(self,
+                selector: abc.Callable,
+                result_selector: abc.Callable=None) -> IEnumerable:
             """
             Projects items into a new form using the selector function
-            and flattens the results into one list
+            and flattens the results into one list. If given, the result
+            selector is applied to each item and child.
 
             """
-            return Enumerable(base(sum(self.select(selector), [])))
+            return Enumerable(base(select_many_items(self, selector, result_selector)))
 
         def skip(self, count: int) -> IEnumerable:
             """Skips count number of items and returns the result"""
             return Enumerable(base(list(self)[count:]))
 
+        def skip_while(self, predicate: abc.Callable) -> IEnumerable:
+            """Skips items while the predicate is True and returns the result"""
+            return Enumerable(base(_itertools.dropwhile(predicate, self)))
+
+        def take(self, count: int) -> IEnumerable:
+            """Takes count number of items and returns the result"""
+            return Enumerable(base(list(self)[:count]))
+
+        def take_while(self, predicate: abc.Callable) -> IEnumerable:
+            """Takes items while the predicate is True and returns the result"""
+            return Enumerable(base(_itertools.takewhile(predicate, self)))
+
         def diff(self, other: 'IEnumerable') -> IEnumerable:
             """
             Returns the set difference of this enumerable and another enumerable
 
             """
-            return Enumerable(base(set(self).difference(other)))
+            return Enumerable(base(diff_items(self, other)))
 
         def intersect(self, other: 'IEnumerable') -> IEnumerable:
             """
             Returns the intersection of this enumerable and another enumerable
 
             """
-            return self.where(lambda item: item in other)
+            return Enumerable(base(intersect_items(self, other)))
+
+        def union(self, other: 'IEnumerable') -> IEnumerable:
+            """
+            Returns the set union of this enumerable and another enumerable
+
+            """
+            return Enumerable(base(union_items(self, other)))
 
         def distinct(self) -> IEnumerable:
             """Filters items down to distinct ones"""
-            try:
-                return Enumerable(base(set(self)))
-            except TypeError:
-                for i, item in enumerate(self):
-                    while self.count(item) > 1:
-                        self.pop(i)
-                return self
+            return Enumerable(base(distinct_items(self)))
+
+        def distinct_by(self, key_selector: abc.Callable) -> IEnumerable:
+            """Filters items down to ones with distinct keys"""
+            return Enumerable(base(distinct_items(self, key_selector)))
 
         def where(self, predicate: abc.Callable) -> IEnumerable:
             """Filters items based on the given predicate"""
@@ -217,6 +816,21 @@ def extend(iterable: abc.Iterable=()):
             else:
                 return self
 
+        def to_lookup(self,
+                key_selector: abc.Callable,
+                element_selector: abc.Callable=lambda x: x) -> dict:
+            """Returns a hash table of keys to enumerables of the elements sharing them"""
+            lookup = lookup_items(self, key_selector, element_selector)
+            for key in lookup:
+                lookup[key] = extend(lookup[key])
+            return lookup
+
+        def to_dict(self,
+                key_selector: abc.Callable,
+                element_selector: abc.Callable=lambda x: x) -> dict:
+            """Returns a dictionary of keys to elements. Raises ValueError for duplicate keys"""
+            return dict_items(self, key_selector, element_selector)
+
         @property
         def base(self) -> abc.Iterable:
             """Base class for this Enumerable"""
@@ -224,27 +838,754 @@ def extend(iterable: abc.Iterable=()):
 
     return Enumerable(iterable)
 
+def _delegate(name: str) -> abc.Callable:
+    """Returns a method that runs the named operator on a list-backed Enumerable"""
+    def method(self, *args, **kwargs) -> object:
+        return getattr(self.to_enum(), name)(*args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = 'Runs {} over the items as a list-backed Enumerable'.format(name)
+    return method
+
+class ArrayEnumerable(IEnumerable):
+
+    """
+    Enumerable of numbers stored unboxed in a NumPy array when NumPy is
+    installed, otherwise in an array.array. Predicates and selectors are
+    first applied to the whole buffer, so arithmetic and comparison
+    lambdas run vectorized under NumPy, and are applied per item when
+    that fails. Selectors should therefore be free of side effects.
+
+    """
+
+    def __init__(self, iterable: abc.Iterable=(), typecode: str='d') -> None:
+        """Initializes this enumerable with the given items and array typecode"""
+        if _np is not None and isinstance(iterable, _np.ndarray):
+            self._data = iterable.astype(typecode, copy=False)
+        else:
+            # array.array validates the items without boxing them
+            self._data = _array.array(typecode, iterable)
+            if _np is not None:
+                self._data = _np.frombuffer(self._data, dtype=typecode)
+        self._typecode = typecode
+
+    def __eq__(self, other: abc.Iterable) -> bool:
+        """Returns True if other has equal items in the same order, False otherwise"""
+        return isinstance(other, abc.Iterable) and list(self) == list(other)
+
+    def __getitem__(self, index: object) -> object:
+        """Returns the item at the index, or an enumerable for a slice"""
+        if isinstance(index, slice):
+            return self._new(self._data[index])
+        item = self._data[index]
+        return item if _np is None else item.item()
+
+    def __iter__(self) -> abc.Iterator:
+        """Returns an iterator over the items as Python numbers"""
+        if _np is None:
+            return iter(self._data)
+        # convert a block at a time to keep the boxed items bounded
+        return _itertools.chain.from_iterable(self._data[i:i + 4096].tolist()
+            for i in range(0, len(self._data), 4096))
+
+    def __len__(self) -> int:
+        """Returns the number of items"""
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        """Returns the string representation of this enumerable"""
+        return '{}({})'.format(self.__class__.__name__, list(self))
+
+    def _new(self, data: abc.Iterable) -> 'ArrayEnumerable':
+        """Returns an enumerable of the same typecode over the given items"""
+        return ArrayEnumerable(data, self._typecode)
+
+    def _vectorize(self, function: abc.Callable) -> object:
+        """
+        Returns the result of the function applied to the whole buffer,
+        or None if it cannot be applied that way. Floating point errors
+        fall back to the per-item path so they raise like Python numbers,
+        and integer results other than masks are not trusted because
+        NumPy integer arithmetic wraps around silently
+
+        """
+        if _np is None or not len(self._data):
+            return None
+        try:
+            with _np.errstate(all='raise'):
+                result = function(self._data)
+        except Exception:
+            return None
+        if not isinstance(result, _np.ndarray) or result.shape != self._data.shape:
+            return None
+        if self._data.dtype.kind in 'iu' and result.dtype != bool:
+            return None
+        return result
+
+    def _values(self, selector: abc.Callable=None) -> 'ArrayEnumerable':
+        """Returns the items or the values selected from them"""
+        return self if selector is None else self.select(selector)
+
+    def copy(self) -> 'ArrayEnumerable':
+        """Returns a copy of this enumerable"""
+        if _np is not None:
+            return self._new(self._data.copy())
+        return self._new(self._data[:])
+
+    def any(self, predicate: abc.Callable=lambda x: True) -> bool:
+        """Returns True if there are any items matching the predicate, False otherwise"""
+        mask = self._vectorize(predicate)
+        if mask is not None and mask.dtype == bool:
+            return bool(mask.any())
+        return any(map(predicate, self))
+
+    def count(self, predicate: abc.Callable=None) -> int:
+        """Returns the number of items matching the predicate, or all items"""
+        if predicate is None:
+            return len(self)
+        mask = self._vectorize(predicate)
+        if mask is not None and mask.dtype == bool:
+            return int(mask.sum())
+        return count_items(self, predicate)
+
+    def sum(self, selector: abc.Callable=None) -> object:
+        """Returns the sum of the items or the values selected from them"""
+        values = self._values(selector)
+        if isinstance(values, ArrayEnumerable) and _np is not None:
+            return values._data.sum().item()
+        return sum(values)
+
+    def min(self, selector: abc.Callable=None) -> object:
+        """
+        Returns the minimum of the items or the values selected from them.
+        Raises ValueError if there are no items
+
+        """
+        values = self._values(selector)
+        if isinstance(values, ArrayEnumerable) and _np is not None:
+            return values._data.min().item()
+        return min(values)
+
+    def max(self, selector: abc.Callable=None) -> object:
+        """
+        Returns the maximum of the items or the values selected from them.
+        Raises ValueError if there are no items
+
+        """
+        values = self._values(selector)
+        if isinstance(values, ArrayEnumerable) and _np is not None:
+            return values._data.max().item()
+        return max(values)
+
+    def average(self, selector: abc.Callable=None) -> float:
+        """
+        Returns the mean of the items or the values selected from them.
+        Raises ValueError if there are no items
+
+        """
+        values = self._values(selector)
+        if not len(values):
+            raise ValueError('average of empty sequence')
+        return values.sum() / len(values)
+
+    def aggregate(self,
+            func: abc.Callable,
+            seed: object=_NO_SEED,
+            result_selector: abc.Callable=lambda x: x) -> object:
+        """
+        Applies the accumulator function over the items, starting from the
+        seed or the first item, and returns the selected result
+
+        """
+        return result_selector(fold_items(self, func, seed))
+
+    def aggregate_many(self, **selectors) -> dict:
+        """
+        Computes the aggregates named by the keywords (average, count, max,
+        min, sum) over the buffer. See aggregate_items.
+
+        """
+        result = {}
+        for name, selector in selectors.items():
+            if name not in _ACCUMULATORS:
+                raise ValueError('aggregate must be one of [{}]'.format(', '.join(_ACCUMULATORS)))
+            if name in ('count', 'sum') or len(self):
+                result[name] = getattr(self, name)(selector)
+            else:
+                result[name] = None
+        return result
+
+    def first_or_default(self, default: object=None) -> object:
+        """
+        Returns the first item in this enumerable or
+        the default if this enumerable is empty
+
+        """
+        return self[0] if len(self) else default
+
+    def last_or_default(self, default: object=None) -> object:
+        """
+        Returns the last item in this enumerable or
+        the default if this enumerable is empty
+
+        """
+        return self[-1] if len(self) else default
+
+    def order_by(self, key: abc.Callable=None, reverse: bool=False) -> 'ArrayEnumerable':
+        """Returns items ordered by the given key selector"""
+        if key is None and _np is not None:
+            ordered = _np.sort(self._data, kind='stable')
+            return self._new(ordered[::-1] if reverse else ordered)
+        return self._new(sorted(self, key=key, reverse=reverse))
+
+    def select(self, selector: abc.Callable) -> IEnumerable:
+        """
+        Returns the items projected into a new form using the selector
+        function. Results that are not numbers are returned as a
+        list-backed Enumerable.
+
+        """
+        result = self._vectorize(selector)
+        if result is not None and result.dtype.kind in 'iuf':
+            return ArrayEnumerable(result, result.dtype.char)
+        values = list(map(selector, self))
+        try:
+            return self._new(values)
+        except (OverflowError, TypeError, ValueError):
+            return extend(values)
+
+    def skip(self, count: int) -> 'ArrayEnumerable':
+        """Skips count number of items and returns the result"""
+        return self[count:]
+
+    def take(self, count: int) -> 'ArrayEnumerable':
+        """Takes count number of items and returns the result"""
+        return self[:count]
+
+    def skip_while(self, predicate: abc.Callable) -> 'ArrayEnumerable':
+        """Skips items while the predicate is True and returns the result"""
+        return self._new(_itertools.dropwhile(predicate, self))
+
+    def take_while(self, predicate: abc.Callable) -> 'ArrayEnumerable':
+        """Takes items while the predicate is True and returns the result"""
+        return self._new(_itertools.takewhile(predicate, self))
+
+    def diff(self, other: abc.Iterable) -> 'ArrayEnumerable':
+        """Returns the set difference of this enumerable and another enumerable"""
+        return self._new(diff_items(self, other))
+
+    def intersect(self, other: abc.Iterable) -> 'ArrayEnumerable':
+        """Returns the intersection of this enumerable and another enumerable"""
+        return self._new(intersect_items(self, other))
+
+    def union(self, other: abc.Iterable) -> 'ArrayEnumerable':
+        """Returns the set union of this enumerable and another enumerable"""
+        return self._new(union_items(self, other))
+
+    def distinct(self) -> 'ArrayEnumerable':
+        """Filters items down to distinct ones in order"""
+        if _np is not None:
+            _, first = _np.unique(self._data, return_index=True)
+            return self._new(self._data[_np.sort(first)])
+        return self._new(dict.fromkeys(self))
+
+    def distinct_by(self, key_selector: abc.Callable) -> 'ArrayEnumerable':
+        """Filters items down to ones with distinct keys in order"""
+        return self._new(distinct_items(self, key_selector))
+
+    def where(self, predicate: abc.Callable) -> 'ArrayEnumerable':
+        """Filters items based on the given predicate"""
+        mask = self._vectorize(predicate)
+        if mask is not None and mask.dtype == bool:
+            return self._new(self._data[mask])
+        return self._new(filter(predicate, self))
+
+    def whereif(self, condition: bool, predicate: abc.Callable) -> 'ArrayEnumerable':
+        """Filters items based on the given condition and predicate"""
+        if condition:
+            return self.where(predicate)
+        else:
+            return self
+
+    def to_enum(self) -> IEnumerable:
+        """Returns the items as a list-backed Enumerable"""
+        return extend(self.to_list())
+
+    def to_list(self) -> list:
+        """Returns the items as a list of Python numbers"""
+        return self._data.tolist()
+
+    # operators without a columnar implementation
+    group_by = _delegate('group_by')
+    group_by_key = _delegate('group_by_key')
+    join = _delegate('join')
+    group_join = _delegate('group_join')
+    select_many = _delegate('select_many')
+    to_lookup = _delegate('to_lookup')
+    to_dict = _delegate('to_dict')
+
+    @property
+    def base(self) -> abc.Iterable:
+        """Type of the buffer for this enumerable"""
+        return type(self._data)
+
+    @property
+    def typecode(self) -> str:
+        """Array typecode of the items"""
+        return self._typecode
+
+def extend_array(iterable: abc.Iterable=(), typecode: str='d') -> ArrayEnumerable:
+    """
+    Returns an instance of ArrayEnumerable storing the given numbers
+    unboxed with the given array typecode
+
+    """
+    return ArrayEnumerable(iterable, typecode)
+
+# operators that are fused into a single per-element function
+_FUSABLE = ('where', 'select')
+
+_fused_cache = {}
+
+def _compile_stages(kinds: tuple) -> tuple:
+    """
+    Compiles the given where/select stage kinds into a fused loop
+    and a fused generator, each evaluating all stages per element
+
+    """
+    if kinds in _fused_cache:
+        return _fused_cache[kinds]
+
+    params = ', '.join('f{}'.format(i) for i in range(len(kinds)))
+    body = []
+    for i, kind in enumerate(kinds):
+        if kind == 'where':
+            body.append('        if not f{}(x): continue'.format(i))
+        else: # kind == 'select'
+            body.append('        x = f{}(x)'.format(i))
+    source = '\n'.join([
+        'def _loop(source, emit, {}):'.format(params),
+        '    for x in source:',
+        *body,
+        '        emit(x)',
+        'def _iter(source, {}):'.format(params),
+        '    for x in source:',
+        *body,
+        '        yield x'])
+
+    namespace = {}
+    exec(source, namespace)
+    _fused_cache[kinds] = (namespace['_loop'], namespace['_iter'])
+    return _fused_cache[kinds]
+
+def _fuse(stream: abc.Iterator, stages: list) -> abc.Iterator:
+    """Returns the stream with the given where/select stages applied lazily"""
+    if not stages:
+        return stream
+    _, fused = _compile_stages(tuple(kind for kind, _ in stages))
+    return fused(stream, *(function for _, function in stages))
+
+def _drain(stream: abc.Iterator, stages: list, emit: abc.Callable) -> None:
+    """Passes each item of the stream through the given stages to emit"""
+    if not stages:
+        for item in stream:
+            emit(item)
+        return
+    fused, _ = _compile_stages(tuple(kind for kind, _ in stages))
+    fused(stream, emit, *(function for _, function in stages))
+
+def _run_chunk(kinds: tuple, functions: tuple, chunk: list) -> list:
+    """Passes the chunk through the fused stages. Runs in a worker"""
+    result = []
+    fused, _ = _compile_stages(kinds)
+    fused(chunk, result.append, *functions)
+    return result
+
+def _fuse_parallel(stream: abc.Iterator,
+        stages: list,
+        workers: int,
+        chunk_size: int,
+        ordered: bool) -> abc.Iterator:
+    """
+    Returns the stream with the given where/select stages applied to
+    chunks in a process pool. Falls back to a thread pool when the
+    stage functions cannot be pickled.
+
+    """
+    if not stages:
+        return stream
+
+    kinds = tuple(kind for kind, _ in stages)
+    functions = tuple(function for _, function in stages)
+    try:
+        _pickle.dumps(functions)
+        executor = _futures.ProcessPoolExecutor(max_workers=workers)
+    except (_pickle.PicklingError, AttributeError, TypeError):
+        executor = _futures.ThreadPoolExecutor(max_workers=workers)
+
+    def merge() -> abc.Iterator:
+        # keep a bounded number of chunks in flight
+        chunks = iter(lambda: list(_itertools.islice(stream, chunk_size)), [])
+        pending = _deque()
+        try:
+            for chunk in chunks:
+                pending.append(executor.submit(_run_chunk, kinds, functions, chunk))
+                while len(pending) >= workers * 2:
+                    if ordered:
+                        yield from pending.popleft().result()
+                    else:
+                        done, _ = _futures.wait(pending, return_when=_futures.FIRST_COMPLETED)
+                        for future in done:
+                            pending.remove(future)
+                            yield from future.result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    return merge()
+
+def _run_diff(stream: abc.Iterator, other: abc.Iterable) -> abc.Iterator:
+    return diff_items(stream, other)
+
+def _run_distinct(stream: abc.Iterator, key_selector: abc.Callable) -> abc.Iterator:
+    return distinct_items(stream, key_selector)
+
+def _run_group_join(stream: abc.Iterator, *args) -> abc.Iterator:
+    return group_join_items(stream, *args)
+
+def _run_intersect(stream: abc.Iterator, other: abc.Iterable) -> abc.Iterator:
+    return intersect_items(stream, other)
+
+def _run_join(stream: abc.Iterator, *args) -> abc.Iterator:
+    return join_items(stream, *args)
+
+def _run_order_by(stream: abc.Iterator, key: abc.Callable, reverse: bool) -> abc.Iterator:
+    return iter(sorted(stream, key=key, reverse=reverse))
+
+def _run_select_many(stream: abc.Iterator, *args) -> abc.Iterator:
+    return select_many_items(stream, *args)
+
+def _run_skip(stream: abc.Iterator, count: int) -> abc.Iterator:
+    return _itertools.islice(stream, count, None)
+
+def _run_skip_while(stream: abc.Iterator, predicate: abc.Callable) -> abc.Iterator:
+    return _itertools.dropwhile(predicate, stream)
+
+def _run_take(stream: abc.Iterator, count: int) -> abc.Iterator:
+    return _itertools.islice(stream, count)
+
+def _run_take_while(stream: abc.Iterator, predicate: abc.Callable) -> abc.Iterator:
+    return _itertools.takewhile(predicate, stream)
+
+def _run_top(stream: abc.Iterator,
+        count: int,
+        key: abc.Callable,
+        reverse: bool) -> abc.Iterator:
+    # equivalent to a stable sort followed by a slice in O(n log k) time
+    if reverse:
+        return iter(_heapq.nlargest(count, stream, key=key))
+    return iter(_heapq.nsmallest(count, stream, key=key))
+
+def _run_union(stream: abc.Iterator, other: abc.Iterable) -> abc.Iterator:
+    return union_items(stream, other)
+
+# runners for operators that cannot be fused, called with the
+# upstream iterator followed by the operator arguments
+_RUNNERS = {
+    'diff': _run_diff,
+    'distinct': _run_distinct,
+    'group_join': _run_group_join,
+    'intersect': _run_intersect,
+    'join': _run_join,
+    'order_by': _run_order_by,
+    'select_many': _run_select_many,
+    'skip': _run_skip,
+    'skip_while': _run_skip_while,
+    'take': _run_take,
+    'take_while': _run_take_while,
+    'top': _run_top,
+    'union': _run_union
+}
+
+def _optimize(plan: list) -> list:
+    """
+    Rewrites an order_by followed by a take into a heap-based top-k.
+    Filters between the two are moved ahead of the order_by because
+    filtering commutes with a stable sort.
+
+    """
+    optimized = []
+    for operator, args in plan:
+        if operator == 'take':
+            i = len(optimized) - 1
+            while i >= 0 and optimized[i][0] == 'where':
+                i -= 1
+            if i >= 0 and optimized[i][0] == 'order_by':
+                key, reverse = optimized[i][1]
+                optimized[i:] = optimized[i + 1:] + [('top', (args[0], key, reverse))]
+                continue
+        optimized.append((operator, args))
+    return optimized
+
+def _describe(operator: str, args: tuple) -> str:
+    """Returns a readable description of the operator and its arguments"""
+    described = []
+    for arg in args:
+        if callable(arg):
+            described.append(_qualify(arg))
+        elif arg is None or isinstance(arg, (bool, int, float, str)):
+            described.append(repr(arg))
+        else:
+            described.append(type(arg).__name__)
+    return '{}({})'.format(operator, ', '.join(described))
+
+class _OperatorStats:
+
+    """Rows produced and inclusive time spent by one operator"""
+
+    def __init__(self, description: str) -> None:
+        """Initializes these stats for the described operator"""
+        self.description = description
+        self.rows = 0
+        self.seconds = 0.0
+
+    def record(self, stream: abc.Iterator) -> abc.Iterator:
+        """Yields the items of the stream while counting and timing them"""
+        clock = _time.perf_counter
+        while True:
+            start = clock()
+            try:
+                item = next(stream)
+            except StopIteration:
+                self.seconds += clock() - start
+                return
+            self.seconds += clock() - start
+            self.rows += 1
+            yield item
+
 class Queryable:
 
-    """Used to delay iterable evaluation to improve performance"""
+    """
+    Used to delay iterable evaluation to improve performance.
+    Operators are recorded as a logical plan and adjacent where/select
+    operators are fused into a single function when the plan is evaluated.
+    Single-use sources such as generators are streamed without buffering,
+    so they can only be evaluated once; copy materializes them.
 
-    def __init__(self, iterable: abc.Iterable) -> None:
-        """Initializes this queryable using the given iterable"""
-        self._expr = iter(iterable)
-        self._type = type(iterable)
+    """
+
+    def __init__(self, iterable: abc.Iterable, iterable_type: type=None) -> None:
+        """
+        Initializes this queryable using the given iterable, reduced by
+        to_type to iterable_type, or the type of the iterable if None
+
+        """
+        self._source = iterable
+        self._type = type(iterable) if iterable_type is None else iterable_type
+        self._plan = []
+        self._parallel = None
+        self._profile = None
+
+    def __iter__(self) -> abc.Iterator:
+        """Evaluates the plan of this queryable and returns an iterator"""
+        stream, stages = self._evaluate()
+        return _fuse(stream, stages)
+
+    def _push(self, operator: str, *args) -> 'Queryable':
+        """Appends the given operator and arguments to the plan"""
+        self._plan.append((operator, args))
+        return self
+
+    def _evaluate(self, plan: list=None) -> tuple:
+        """
+        Evaluates the plan up to the trailing where/select stages
+        and returns the resulting stream and those stages
+
+        """
+        if self._profile is not None:
+            return self._evaluate_profiled(plan), []
+
+        if self._parallel is None:
+            fuse = _fuse
+        else:
+            fuse = _functools.partial(_fuse_parallel, **self._parallel)
+
+        stream = iter(self._source)
+        stages = []
+        for operator, args in _optimize(self._plan if plan is None else plan):
+            if operator in _FUSABLE:
+                stages.append((operator, args[0]))
+            else:
+                stream = _RUNNERS[operator](fuse(stream, stages), *args)
+                stages = []
+
+        if self._parallel is not None:
+            stream, stages = fuse(stream, stages), []
+
+        return stream, stages
+
+    def _evaluate_profiled(self, plan: list=None) -> abc.Iterator:
+        """
+        Evaluates the plan one operator at a time, without fusion or
+        parallelism, recording the rows and time of each operator
+
+        """
+        self._profile = [_OperatorStats('source({})'.format(self._type.__name__))]
+        stream = self._profile[0].record(iter(self._source))
+        for operator, args in _optimize(self._plan if plan is None else plan):
+            if operator == 'where':
+                stream = filter(args[0], stream)
+            elif operator == 'select':
+                stream = map(args[0], stream)
+            else:
+                stream = _RUNNERS[operator](stream, *args)
+            self._profile.append(_OperatorStats(_describe(operator, args)))
+            stream = self._profile[-1].record(iter(stream))
+        return stream
+
+    def _collect(self, emit: abc.Callable) -> None:
+        """Evaluates the plan and passes each resulting item to emit"""
+        stream, stages = self._evaluate()
+        _drain(stream, stages, emit)
 
     def copy(self) -> 'Queryable':
         """Returns a shallow copy of this queryable"""
-        # create a copy of the source
-        to_copy = list(self._expr).copy()
-        # reset the source expression to not affect the source
-        self._expr = iter(self._type(to_copy))
-        # return the copied queryable
-        return Queryable(to_copy)
+        # materialize single-use sources so both queryables can evaluate them
+        if iter(self._source) is self._source:
+            self._source = list(self._source)
+        copied = Queryable(self._source, self._type)
+        copied._plan = self._plan.copy()
+        copied._parallel = self._parallel
+        copied._profile = None if self._profile is None else []
+        return copied
+
+    def as_profiled(self) -> 'Queryable':
+        """
+        Records the rows, selectivity and inclusive time of each operator
+        whenever this queryable is evaluated. Operators run one at a time
+        without fusion or parallelism while profiling.
+
+        """
+        self._profile = []
+        return self
+
+    def explain(self, file: object=None) -> None:
+        """
+        Prints the plan of this queryable as it will be evaluated, with
+        fused where/select stages grouped together. If profiling recorded
+        an evaluation, prints the rows, selectivity and inclusive time of
+        each operator instead.
+
+        """
+        if self._profile:
+            print('{:<48} {:>10} {:>12} {:>10}'.format(
+                'operator', 'rows', 'selectivity', 'time (s)'), file=file)
+            for row in self.profile:
+                selectivity = '' if row['selectivity'] is None \
+                    else '{:.1%}'.format(row['selectivity'])
+                print('{:<48} {:>10,} {:>12} {:>10.4f}'.format(
+                    row['operator'], row['rows'], selectivity, row['seconds']), file=file)
+            return
+
+        print('source({})'.format(self._type.__name__), file=file)
+        if self._parallel is not None:
+            print('  parallel(workers={workers}, chunk_size={chunk_size}, ordered={ordered})' \
+                .format(**self._parallel), file=file)
+        stages = []
+        for operator, args in _optimize(self._plan) + [(None, ())]:
+            if operator in _FUSABLE:
+                stages.append(_describe(operator, args))
+                continue
+            if len(stages) == 1:
+                print('  ' + stages[0], file=file)
+            elif stages:
+                print('  fused', file=file)
+                for stage in stages:
+                    print('    ' + stage, file=file)
+            stages = []
+            if operator is not None:
+                print('  ' + _describe(operator, args), file=file)
+
+    def as_parallel(self,
+            workers: int=None,
+            chunk_size: int=1000,
+            ordered: bool=True) -> 'Queryable':
+        """
+        Evaluates the where/select stages of this queryable over chunks
+        of chunk_size items in a pool of worker processes. Stages that
+        cannot be pickled, such as lambdas, run in a thread pool instead.
+        Results keep their order unless ordered is False.
+
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be positive')
+        self._parallel = {
+            'workers': workers or _os.cpu_count() or 1,
+            'chunk_size': chunk_size,
+            'ordered': ordered
+        }
+        return self
+
+    def as_sequential(self) -> 'Queryable':
+        """Evaluates this queryable in the calling thread"""
+        self._parallel = None
+        return self
 
     def any(self, predicate: abc.Callable=lambda x: True) -> bool:
         """Returns True if there are any items matching the predicate, False otherwise"""
-        return any(map(predicate, self._expr))
+        return any(map(predicate, self))
+
+    def count(self, predicate: abc.Callable=None) -> int:
+        """Returns the number of items matching the predicate, or all items"""
+        return count_items(self, predicate)
+
+    def sum(self, selector: abc.Callable=None) -> object:
+        """Returns the sum of the items or the values selected from them"""
+        return sum(self if selector is None else map(selector, self))
+
+    def min(self, selector: abc.Callable=None) -> object:
+        """
+        Returns the minimum of the items or the values selected from them.
+        Raises ValueError if there are no items
+
+        """
+        return min(self if selector is None else map(selector, self))
+
+    def max(self, selector: abc.Callable=None) -> object:
+        """
+        Returns the maximum of the items or the values selected from them.
+        Raises ValueError if there are no items
+
+        """
+        return max(self if selector is None else map(selector, self))
+
+    def average(self, selector: abc.Callable=None) -> float:
+        """
+        Returns the mean of the items or the values selected from them.
+        Raises ValueError if there are no items
+
+        """
+        return average_items(self, selector)
+
+    def aggregate(self,
+            func: abc.Callable,
+            seed: object=_NO_SEED,
+            result_selector: abc.Callable=lambda x: x) -> object:
+        """
+        Applies the accumulator function over the items, starting from the
+        seed or the first item, and returns the selected result
+
+        """
+        return result_selector(fold_items(self, func, seed))
+
+    def aggregate_many(self, **selectors) -> dict:
+        """
+        Computes the aggregates named by the keywords (average, count, max,
+        min, sum) in a single pass. Each keyword takes a selector, or a
+        predicate for count, or None for the items themselves.
+
+        """
+        return aggregate_items(self, **selectors)
 
     def first_or_default(self, default: object=None) -> object:
         """
@@ -252,7 +1593,9 @@ class Queryable:
         the default if this queryable is empty
 
         """
-        return next(self._expr, default)
+        # evaluate as a take so an ordered plan only keeps the top item
+        stream, _ = self._evaluate(self._plan + [('take', (1,))])
+        return next(stream, default)
 
     def last_or_default(self, default: object=None) -> object:
         """
@@ -263,79 +1606,118 @@ class Queryable:
         data = self.to_list()
         return data[-1] if data else default
 
-    def group_by(self, property: str) -> abc.Hashable:
-        """Groups items by the given property"""
-        grouped = group_items(self, property)
-
-        # convert the groups to queryables
-        for group in grouped:
-            grouped[group] = Queryable(grouped[group])
-
-        return grouped
+    def group_by(self, property: str, on_error: abc.Callable=None) -> Grouping:
+        """Lazily groups items into queryables by the given property"""
+        return Grouping(self, _select_property(property),
+            on_error=on_error,
+            group_type=Queryable)
 
     def group_by_key(self,
             key_selector: abc.Callable,
-            element_selector: abc.Callable=lambda x: x) -> abc.Hashable:
-        """Groups items by the given key and element selectors"""
-        grouped = group_items_by_key(self, key_selector, element_selector)
-
-        # convert the groups to queryables
-        for group in grouped:
-            grouped[group] = Queryable(grouped[group])
+            element_selector: abc.Callable=lambda x: x,
+            on_error: abc.Callable=None) -> Grouping:
+        """Lazily groups items into queryables by the given key and element selectors"""
+        return Grouping(self, key_selector, element_selector, on_error, Queryable)
+
+    def join(self,
+            inner: abc.Iterable,
+            outer_key_selector: abc.Callable,
+            inner_key_selector: abc.Callable,
+            result_selector: abc.Callable=lambda outer, inner: (outer, inner)) -> 'Queryable':
+        """
+        Correlates items with the inner items based on matching keys.
+        The inner items are hashed once when the plan is evaluated.
 
-        return grouped
+        """
+        return self._push('join',
+            inner,
+            outer_key_selector,
+            inner_key_selector,
+            result_selector)
+
+    def group_join(self,
+            inner: abc.Iterable,
+            outer_key_selector: abc.Callable,
+            inner_key_selector: abc.Callable,
+            result_selector: abc.Callable=lambda outer, inners: (outer, inners)) -> 'Queryable':
+        """Correlates items with groups of inner items based on matching keys"""
+        return self._push('group_join',
+            inner,
+            outer_key_selector,
+            inner_key_selector,
+            result_selector)
 
     def order_by(self, key: abc.Callable=None, reverse: bool=False) -> 'Queryable':
         """Orders items by the given key selector"""
-        self._expr = iter(sorted(self._expr, key=key, reverse=reverse))
-        return self
+        return self._push('order_by', key, reverse)
 
     def select(self, selector: abc.Callable) -> 'Queryable':
         """Projects items into a new form using the selector function"""
-        self._expr = map(selector, self._expr)
-        return self
+        return self._push('select', selector)
 
-    def select_many(self, selector: abc.Callable) -> 'Queryable':
+    def select_many(self,
+            selector: abc.Callable,
+            result_selector: abc.Callable=None) -> 'Queryable':
         """
         Projects items into a new form using the selector function
-        and flattens the results into one list
+        and flattens the results one child at a time. If given, the
+        result selector is applied to each item and child.
 
         """
-        self._expr = iter(sum(self.select(selector)._expr, []))
-        return self
+        return self._push('select_many', selector, result_selector)
 
     def skip(self, count: int) -> 'Queryable':
         """Skips count number of items and returns the queryable"""
-        for i in range(count):
-            try:
-                next(self._expr)
-            except StopIteration:
-                break
-        return self
+        return self._push('skip', count)
+
+    def skip_while(self, predicate: abc.Callable) -> 'Queryable':
+        """Skips items while the predicate is True and returns the queryable"""
+        return self._push('skip_while', predicate)
+
+    def take(self, count: int) -> 'Queryable':
+        """
+        Takes count number of items and returns the queryable. Directly
+        after order_by, only the top count items are kept while ordering.
+
+        """
+        return self._push('take', count)
+
+    def take_while(self, predicate: abc.Callable) -> 'Queryable':
+        """Takes items while the predicate is True and returns the queryable"""
+        return self._push('take_while', predicate)
 
     def diff(self, other: 'Queryable') -> 'Queryable':
         """
         Returns the set difference of this queryable and another queryable
 
         """
-        return self.where(lambda item: item not in other)
+        return self._push('diff', other)
 
     def intersect(self, other: 'Queryable') -> 'Queryable':
         """
         Returns the intersection of this queryable and another queryable
 
         """
-        return self.where(lambda item: item in other)
+        return self._push('intersect', other)
+
+    def union(self, other: 'Queryable') -> 'Queryable':
+        """
+        Returns the set union of this queryable and another queryable
+
+        """
+        return self._push('union', other)
 
     def distinct(self) -> 'Queryable':
-        """Filters items down to distinct ones"""
-        self._expr = iter(self._type(set(self._expr)))
-        return self
+        """Filters items down to distinct ones in order"""
+        return self._push('distinct', None)
+
+    def distinct_by(self, key_selector: abc.Callable) -> 'Queryable':
+        """Filters items down to ones with distinct keys in order"""
+        return self._push('distinct', key_selector)
 
     def where(self, predicate: abc.Callable) -> 'Queryable':
         """Filters items based on the given predicate"""
-        self._expr = filter(predicate, self._expr)
-        return self
+        return self._push('where', predicate)
 
     def whereif(self, condition: bool, predicate: abc.Callable) -> 'Queryable':
         """Filters items based on the given condition and predicate"""
@@ -346,32 +1728,71 @@ class Queryable:
 
     def to_list(self) -> list:
         """Reduces the queryable expression to a list"""
-        return list(self._expr)
+        result = []
+        self._collect(result.append)
+        return result
 
     def to_set(self) -> set:
         """Reduces the queryable expression to a set"""
-        return set(self._expr)
+        result = set()
+        self._collect(result.add)
+        return result
 
     def to_tuple(self) -> tuple:
         """Reduces the queryable expression to a tuple"""
-        return tuple(self._expr)
+        return tuple(self.to_list())
 
     def to_type(self) -> abc.Iterable:
         """Reduces the queryable expression to its type"""
-        return self.type(self._expr)
+        return self.type(self.to_list())
 
     def to_enum(self) -> IEnumerable:
         """Reduces the queryable expression to an enumerable"""
         return extend(self.to_list())
 
+    def to_lookup(self,
+            key_selector: abc.Callable,
+            element_selector: abc.Callable=lambda x: x) -> dict:
+        """Reduces the queryable expression to a hash table of keys to enumerables"""
+        return self.to_enum().to_lookup(key_selector, element_selector)
+
+    def to_dict(self,
+            key_selector: abc.Callable,
+            element_selector: abc.Callable=lambda x: x) -> dict:
+        """
+        Reduces the queryable expression to a dictionary of keys to
+        elements. Raises ValueError for duplicate keys
+
+        """
+        return dict_items(self, key_selector, element_selector)
+
+    @property
+    def profile(self) -> list:
+        """
+        Rows, selectivity and inclusive time in seconds of each operator
+        from the last profiled evaluation, starting with the source
+
+        """
+        rows = []
+        previous = None
+        for stats in self._profile or ():
+            rows.append({
+                'operator': stats.description,
+                'rows': stats.rows,
+                'selectivity': stats.rows / previous if previous else None,
+                'seconds': stats.seconds
+            })
+            previous = stats.rows
+        return rows
+
     @property
     def type(self) -> abc.Iterable:
         """Iterable type for this queryable"""
         return self._type
 
-def query(iterable: abc.Iterable=()) -> Queryable:
-    """Returns an instance of Queryable using the given iterable"""
-    return Queryable(iterable)
+def query(iterable: abc.Iterable=(), iterable_type: type=None) -> Queryable:
+    """Returns an instance of Queryable using the given iterable and type"""
+    return Queryable(iterable, iterable_type)
 
 if __name__ == '__main__':
 
@@ -533,6 +1954,16 @@ if __name__ == '__main__':
         lambda: query([[0]]).select(lambda x: x['key']).to_list(),
         TypeError,
         name=_qualify(Queryable.select))
+    generated = query(x for x in range(4)).where(lambda x: x % 2 == 0)
+    testif('streams a generator source once',
+        (generated.to_list(), generated.to_list()),
+        ([0, 2], []),
+        name=_qualify(Queryable.to_list))
+    copied = query(x for x in range(4)).where(lambda x: x % 2 == 0).copy()
+    testif('materializes a generator source to copy it',
+        (copied.to_list(), copied.to_list()),
+        ([0, 2], [0, 2]),
+        name=_qualify(Queryable.copy))
     testif('selects data from indices',
         query([['John', 'Smith', '1/1/2000']]) \
             .select(lambda x: [x[0], x[2]]) \
@@ -632,3 +2063,509 @@ if __name__ == '__main__':
         extend((1, 2, 3)).where(lambda x: x == 2).first_or_default(),
         2,
         name=_qualify(IEnumerable.first_or_default))
+
+    testif('fuses where-select-where stages correctly',
+        query(range(10)) \
+            .where(lambda x: x % 2 == 0) \
+            .select(lambda x: x * 3) \
+            .where(lambda x: x > 6) \
+            .to_list(),
+        [12, 18, 24],
+        name=_qualify(Queryable.to_list))
+    testif('fuses stages around non-fusable operators correctly',
+        query([5, 1, 4, 2, 3]) \
+            .select(lambda x: x * 10) \
+            .order_by() \
+            .where(lambda x: x > 10) \
+            .skip(1) \
+            .select(lambda x: x + 1) \
+            .to_list(),
+        [31, 41, 51],
+        name=_qualify(Queryable.to_list))
+    testif('reduces fused stages to a set',
+        query([1, 2, 3, 4]).select(lambda x: x % 2).to_set(),
+        {0, 1},
+        name=_qualify(Queryable.to_set))
+    testif('evaluates lazily until the first match',
+        query(_itertools.count()) \
+            .select(lambda x: x * x) \
+            .where(lambda x: x > 50) \
+            .first_or_default(),
+        64,
+        name=_qualify(Queryable.first_or_default))
+
+    test_queryable = query([1, 2, 3]).where(lambda x: x > 1)
+    test_queryable_copy = test_queryable.copy().select(lambda x: -x)
+
+    testif('copies plan without affecting the source',
+        (test_queryable.to_list(), test_queryable_copy.to_list()),
+        ([2, 3], [-2, -3]),
+        name=_qualify(Queryable.copy))
+    testif('copies single-use sources',
+        query(iter([1, 2])).copy().to_list(),
+        [1, 2],
+        name=_qualify(Queryable.copy))
+
+    test_users = [{'id': 1, 'name': 'abe'}, {'id': 2, 'name': 'bob'}, {'id': 3, 'name': 'caty'}]
+    test_posts = [
+        {'userId': 2, 'title': 'b1'},
+        {'userId': 1, 'title': 'a1'},
+        {'userId': 2, 'title': 'b2'},
+        {'userId': 4, 'title': 'orphan'}
+    ]
+
+    for outer, inner, label in [(test_users, test_posts, 'smaller outer'),
+                                (test_users * 2, test_posts, 'smaller inner')]:
+        testif('correlates items in outer order ({})'.format(label),
+            extend(outer) \
+                .join(inner,
+                    lambda user: user['id'],
+                    lambda post: post['userId'],
+                    lambda user, post: (user['name'], post['title'])),
+            [('abe', 'a1'), ('bob', 'b1'), ('bob', 'b2')] * (len(outer) // 3),
+            name=_qualify(IEnumerable.join))
+
+    testif('correlates streamed items',
+        query(iter(test_users)) \
+            .join(test_posts,
+                lambda user: user['id'],
+                lambda post: post['userId'],
+                lambda user, post: post['title']) \
+            .to_list(),
+        ['a1', 'b1', 'b2'],
+        name=_qualify(Queryable.join))
+    testif('correlates items with groups',
+        extend(test_users) \
+            .group_join(test_posts,
+                lambda user: user['id'],
+                lambda post: post['userId'],
+                lambda user, posts: (user['name'], len(posts))),
+        [('abe', 1), ('bob', 2), ('caty', 0)],
+        name=_qualify(IEnumerable.group_join))
+    testif('correlates items with groups',
+        query(test_users) \
+            .group_join(test_posts,
+                lambda user: user['id'],
+                lambda post: post['userId'],
+                lambda user, posts: posts.select(lambda post: post['title'])) \
+            .to_list(),
+        [['a1'], ['b1', 'b2'], []],
+        name=_qualify(Queryable.group_join))
+    testif('groups elements by key',
+        extend(test_posts).to_lookup(lambda post: post['userId'], lambda post: post['title']),
+        {2: ['b1', 'b2'], 1: ['a1'], 4: ['orphan']},
+        name=_qualify(IEnumerable.to_lookup))
+    testif('groups elements by key',
+        query(test_posts).to_lookup(lambda post: post['userId'])[1],
+        [test_posts[1]],
+        name=_qualify(Queryable.to_lookup))
+    testif('maps keys to elements',
+        extend(test_users).to_dict(lambda user: user['id'], lambda user: user['name']),
+        {1: 'abe', 2: 'bob', 3: 'caty'},
+        name=_qualify(IEnumerable.to_dict))
+    testraises('keys are duplicated',
+        lambda: query(test_posts).to_dict(lambda post: post['userId']),
+        ValueError,
+        name=_qualify(Queryable.to_dict))
+
+    testif('flattens results with the result selector',
+        extend(test_iterable_select_many) \
+            .select_many(lambda x: x['students'], lambda x, student: x['teacher'] + student),
+        ['Teacher1Student1', 'Teacher1Student2', 'Teacher2Student2', 'Teacher2Student3'],
+        name=_qualify(IEnumerable.select_many))
+    testif('flattens non-list children',
+        extend([(1, 2), (3,)]).select_many(lambda x: x),
+        [1, 2, 3],
+        name=_qualify(IEnumerable.select_many))
+    testif('flattens lazily one child at a time',
+        query(_itertools.count()) \
+            .select_many(lambda x: range(x)) \
+            .where(lambda x: x > 2) \
+            .first_or_default(),
+        3,
+        name=_qualify(Queryable.select_many))
+
+    test_unordered = [3, 1, 3, 2, 1]
+
+    testif('keeps the order of first occurrences',
+        extend(test_unordered).distinct(),
+        [3, 1, 2],
+        name=_qualify(IEnumerable.distinct))
+    testif('does not modify the source',
+        (extend(test_unordered).distinct(), test_unordered),
+        ([3, 1, 2], [3, 1, 3, 2, 1]),
+        name=_qualify(IEnumerable.distinct))
+    testif('returns correct results (model items)',
+        extend([Anonymous(a=1), Anonymous(a=2), Anonymous(a=1)]).distinct(),
+        [Anonymous(a=1), Anonymous(a=2)],
+        name=_qualify(IEnumerable.distinct))
+    testif('returns correct results (nested items)',
+        extend([{'a': [1, {'b': 2}]}, {'a': [1, {'b': 2}]}, {'a': [1, {'b': 3}]}]).distinct(),
+        [{'a': [1, {'b': 2}]}, {'a': [1, {'b': 3}]}],
+        name=_qualify(IEnumerable.distinct))
+    testif('keeps the order of first occurrences',
+        query(test_unordered).distinct().to_list(),
+        [3, 1, 2],
+        name=_qualify(Queryable.distinct))
+    testif('returns the first item for each key',
+        extend(test_iterable).distinct_by(lambda x: x['num'] % 2),
+        [{'num': 1}, {'num': 2}],
+        name=_qualify(IEnumerable.distinct_by))
+    testif('returns the first item for each key',
+        query(objs).distinct_by(lambda x: x.a).to_list(),
+        [objs[0], objs[1]],
+        name=_qualify(Queryable.distinct_by))
+    testif('returns distinct results in order',
+        extend(test_unordered).diff([2]),
+        [3, 1],
+        name=_qualify(IEnumerable.diff))
+    testif('returns correct results (dict items)',
+        query(test_iterable).diff([{'num': 2}]).to_list(),
+        [{'num': 1}, {'num': 3}],
+        name=_qualify(Queryable.diff))
+    testif('returns correct results (dict items)',
+        extend(test_iterable).intersect([{'num': 2}]),
+        [{'num': 2}, {'num': 2}],
+        name=_qualify(IEnumerable.intersect))
+    testif('returns distinct results in order',
+        extend(test_unordered).union([4, 2, 5]),
+        [3, 1, 2, 4, 5],
+        name=_qualify(IEnumerable.union))
+    testif('returns distinct results in order',
+        query([{'num': 1}]).union(test_iterable).to_list(),
+        [{'num': 1}, {'num': 2}, {'num': 3}],
+        name=_qualify(Queryable.union))
+    testraises('item type has no canonical key',
+        lambda: canonical_key(bytearray()),
+        TypeError,
+        name=_qualify(canonical_key))
+
+    test_scores = [('abe', 3), ('bob', 9), ('caty', 5), ('dan', 9), ('eve', 1)]
+
+    testif('takes items correctly',
+        extend([0, 2, 4, 6]).take(2),
+        [0, 2],
+        name=_qualify(IEnumerable.take))
+    testif('takes items while the predicate is True',
+        extend([1, 2, 5, 1]).take_while(lambda x: x < 3),
+        [1, 2],
+        name=_qualify(IEnumerable.take_while))
+    testif('skips items while the predicate is True',
+        extend([1, 2, 5, 1]).skip_while(lambda x: x < 3),
+        [5, 1],
+        name=_qualify(IEnumerable.skip_while))
+    testif('takes items lazily',
+        query(_itertools.count()).skip(2).take(3).to_list(),
+        [2, 3, 4],
+        name=_qualify(Queryable.take))
+    testif('takes the top items of an ordered plan stably',
+        query(test_scores) \
+            .order_by(lambda x: x[1], reverse=True) \
+            .take(3) \
+            .to_list(),
+        [('bob', 9), ('dan', 9), ('caty', 5)],
+        name=_qualify(Queryable.take))
+    testif('takes the top items of an ordered plan after filtering',
+        query(test_scores) \
+            .order_by(lambda x: x[1]) \
+            .where(lambda x: x[0] != 'eve') \
+            .take(2) \
+            .select(lambda x: x[0]) \
+            .to_list(),
+        ['abe', 'caty'],
+        name=_qualify(Queryable.take))
+    testif('selects the top item of an ordered plan',
+        query(iter(test_scores)).order_by(lambda x: -x[1]).first_or_default(),
+        ('bob', 9),
+        name=_qualify(Queryable.first_or_default))
+    testif('takes items while the predicate is True',
+        query(_itertools.count()).take_while(lambda x: x < 3).to_list(),
+        [0, 1, 2],
+        name=_qualify(Queryable.take_while))
+    testif('skips items while the predicate is True',
+        query([1, 2, 5, 1]).skip_while(lambda x: x < 3).to_list(),
+        [5, 1],
+        name=_qualify(Queryable.skip_while))
+
+    testif('evaluates picklable stages in order across processes',
+        query(range(-50, 50)) \
+            .as_parallel(workers=2, chunk_size=7) \
+            .select(abs) \
+            .where(bool) \
+            .to_list(),
+        [abs(x) for x in range(-50, 50) if x],
+        name=_qualify(Queryable.as_parallel))
+    testif('falls back to threads for lambdas',
+        query(range(100)) \
+            .as_parallel(workers=3, chunk_size=10) \
+            .where(lambda x: x % 3 == 0) \
+            .order_by(lambda x: -x) \
+            .select(lambda x: x * 2) \
+            .take(3) \
+            .to_list(),
+        [198, 192, 186],
+        name=_qualify(Queryable.as_parallel))
+    testif('merges unordered results completely',
+        sorted(query(range(100)) \
+            .as_parallel(workers=4, chunk_size=3, ordered=False) \
+            .select(lambda x: x + 1) \
+            .to_list()),
+        list(range(1, 101)),
+        name=_qualify(Queryable.as_parallel))
+    testraises('chunk size is not positive',
+        lambda: query([]).as_parallel(chunk_size=0),
+        ValueError,
+        name=_qualify(Queryable.as_parallel))
+
+    test_hours = [4.0, 8.5, 6.0, 8.5]
+
+    testif('counts all items',
+        extend(test_hours).count(),
+        4,
+        name=_qualify(IEnumerable.count))
+    testif('counts items matching the predicate',
+        extend(test_hours).count(predicate=lambda x: x > 5),
+        3,
+        name=_qualify(IEnumerable.count))
+    testif('counts values like the base count',
+        extend(test_hours).count(8.5),
+        2,
+        name=_qualify(IEnumerable.count))
+    testif('counts items matching a positional predicate',
+        extend([1, 2, 3]).count(lambda x: x > 1),
+        2,
+        name=_qualify(IEnumerable.count))
+    testif('counts values of bases without a count',
+        (extend({'a', 'b'}).count('a'), extend({'a'}).count('b')),
+        (1, 0),
+        name=_qualify(IEnumerable.count))
+    testif('counts items matching the predicate',
+        query(test_hours).count(lambda x: x > 5),
+        3,
+        name=_qualify(Queryable.count))
+    testif('sums selected values',
+        extend(objs).sum(lambda x: x.a),
+        5,
+        name=_qualify(IEnumerable.sum))
+    testif('sums items',
+        query(test_hours).where(lambda x: x < 8).sum(),
+        10.0,
+        name=_qualify(Queryable.sum))
+    testif('returns the minimum selected value',
+        extend(objs).min(lambda x: x.a),
+        1,
+        name=_qualify(IEnumerable.min))
+    testif('returns the maximum item',
+        query(test_hours).max(),
+        8.5,
+        name=_qualify(Queryable.max))
+    testraises('there are no items',
+        lambda: query([]).max(),
+        ValueError,
+        name=_qualify(Queryable.max))
+    testif('returns the mean',
+        extend(test_hours).average(),
+        6.75,
+        name=_qualify(IEnumerable.average))
+    testraises('there are no items',
+        lambda: query([]).average(),
+        ValueError,
+        name=_qualify(Queryable.average))
+    testif('folds items from the first item',
+        extend([1, 2, 3, 4]).aggregate(lambda acc, x: acc * x),
+        24,
+        name=_qualify(IEnumerable.aggregate))
+    testif('folds items from the seed and selects the result',
+        query(['a', 'b']).aggregate(lambda acc, x: acc + x, 'z', str.upper),
+        'ZAB',
+        name=_qualify(Queryable.aggregate))
+    testraises('there are no items or seed',
+        lambda: extend([]).aggregate(lambda acc, x: acc + x),
+        ValueError,
+        name=_qualify(IEnumerable.aggregate))
+    testif('reduces to the given iterable type',
+        query(iter([2, 1]), tuple).where(lambda x: x > 1).copy().to_type(),
+        (2,),
+        name=_qualify(Queryable.to_type))
+    testif('computes all aggregates in one pass',
+        query(iter(test_hours)).aggregate_many(
+            count=None, sum=None, min=None, max=lambda x: -x, average=None),
+        {'count': 4, 'sum': 27.0, 'min': 4.0, 'max': -4.0, 'average': 6.75},
+        name=_qualify(Queryable.aggregate_many))
+    testif('computes empty aggregates',
+        extend([]).aggregate_many(count=None, sum=None, min=None, average=None),
+        {'count': 0, 'sum': 0, 'min': None, 'average': None},
+        name=_qualify(IEnumerable.aggregate_many))
+    testraises('aggregate is unknown',
+        lambda: extend([]).aggregate_many(median=None),
+        ValueError,
+        name=_qualify(IEnumerable.aggregate_many))
+
+    test_rows = [
+        {'team': 'a', 'points': 3},
+        {'team': 'b', 'points': 4},
+        {'points': 9},
+        {'team': 'a', 'points': 5},
+        None
+    ]
+    test_errors = []
+
+    testif('groups items by property',
+        extend(test_rows).group_by('team'),
+        {'a': [test_rows[0], test_rows[3]], 'b': [test_rows[1]]},
+        name=_qualify(IEnumerable.group_by))
+    testif('counts items that cannot be grouped',
+        (lambda grouping: (grouping.select(len), grouping.errors))(query(test_rows).group_by('team')),
+        ({'a': 2, 'b': 1}, 2),
+        name=_qualify(Grouping.select))
+    testif('aggregates groups without storing members',
+        query(test_rows) \
+            .group_by_key(lambda x: x['team'], lambda x: x['points'], lambda item, ex: test_errors.append(ex)) \
+            .select(sum),
+        {'a': 8, 'b': 4},
+        name=_qualify(Grouping.select))
+    testif('passes items that cannot be grouped to on_error',
+        len(test_errors),
+        2,
+        name=_qualify(Grouping))
+    testif('applies other selectors to stored groups',
+        extend(test_rows[:2]).group_by('team').select(lambda group: group.count()),
+        {'a': 1, 'b': 1},
+        name=_qualify(Grouping.select))
+    testif('computes every aggregate per group in one pass',
+        query(test_rows[:4]) \
+            .group_by_key(lambda x: x.get('team', '?')) \
+            .aggregate_many(count=None, max=lambda x: x['points']),
+        {'a': {'count': 2, 'max': 5}, 'b': {'count': 1, 'max': 4}, '?': {'count': 1, 'max': 9}},
+        name=_qualify(Grouping.aggregate_many))
+    def grouping_dict_test():
+        import json
+        grouping = extend(test_rows[:4]).group_by_key(lambda x: x.get('team', '?'), lambda x: x['points'])
+        grouping['c'] = [0]
+        popped = grouping.pop('?')
+        return json.dumps(grouping), popped, dict(grouping) == grouping, isinstance(grouping, dict)
+
+    testif('works as a mutable dict of groups',
+        grouping_dict_test(),
+        ('{"a": [3, 5], "b": [4], "c": [0]}', [9], True, True),
+        name=_qualify(Grouping))
+    testif('groups items into lists',
+        group_items_by_key(test_rows[:4], lambda x: x['team']),
+        OrderedDict([('a', [test_rows[0], test_rows[3]]), ('b', [test_rows[1]])]),
+        name=_qualify(group_items_by_key))
+
+    test_samples = extend_array([2.5, -1.0, 4.0, 2.5, 8.0])
+
+    testif('stores items with the given typecode',
+        (extend_array(range(3), 'q').typecode, list(extend_array(range(3), 'q'))),
+        ('q', [0, 1, 2]),
+        name=_qualify(extend_array))
+    testraises('items are not numbers',
+        lambda: extend_array(['a']),
+        TypeError,
+        name=_qualify(extend_array))
+    testif('filters items based on the given predicate',
+        test_samples.where(lambda x: x > 2),
+        [2.5, 4.0, 2.5, 8.0],
+        name=_qualify(ArrayEnumerable.where))
+    testif('keeps numeric projections unboxed',
+        type(test_samples.select(lambda x: x * 2)),
+        ArrayEnumerable,
+        name=_qualify(ArrayEnumerable.select))
+    def array_enumerable_select_calls_test():
+        calls = []
+        result = test_samples.select(lambda x: calls.append(x) or x * 2)
+        return len(calls), list(result)
+
+    testif('applies selectors to the whole buffer under NumPy',
+        array_enumerable_select_calls_test(),
+        (1 if _np is not None else 5, [5.0, -2.0, 8.0, 5.0, 16.0]),
+        name=_qualify(ArrayEnumerable.select))
+    testraises('division by zero raises like Python numbers',
+        lambda: extend_array([1.0, 0.0]).select(lambda x: 1 / x),
+        ZeroDivisionError,
+        name=_qualify(ArrayEnumerable.select))
+    testif('integer overflow does not wrap around',
+        list(extend_array([2 ** 62], 'q').select(lambda x: x * 4)),
+        [2 ** 64],
+        name=_qualify(ArrayEnumerable.select))
+    testif('integer comparisons still run on the whole buffer',
+        extend_array([1, 5, 3], 'q').count(lambda x: x > 2),
+        2,
+        name=_qualify(ArrayEnumerable.count))
+    testif('returns other projections as a list-backed enumerable',
+        test_samples.take(2).select(str),
+        ['2.5', '-1.0'],
+        name=_qualify(ArrayEnumerable.select))
+    testif('computes aggregates',
+        test_samples.aggregate_many(count=None, sum=None, min=None, max=None, average=None),
+        {'count': 5, 'sum': 16.0, 'min': -1.0, 'max': 8.0, 'average': 3.2},
+        name=_qualify(ArrayEnumerable.aggregate_many))
+    testif('counts items matching the predicate',
+        test_samples.count(lambda x: x == 2.5),
+        2,
+        name=_qualify(ArrayEnumerable.count))
+    testif('filters items down to distinct ones in order',
+        test_samples.distinct(),
+        [2.5, -1.0, 4.0, 8.0],
+        name=_qualify(ArrayEnumerable.distinct))
+    testif('orders items',
+        test_samples.order_by(reverse=True).take(2),
+        [8.0, 4.0],
+        name=_qualify(ArrayEnumerable.order_by))
+    testif('delegates grouping to a list-backed enumerable',
+        test_samples.group_by_key(lambda x: x > 0).select(len),
+        {True: 4, False: 1},
+        name=_qualify(ArrayEnumerable.group_by_key))
+    testif('returns the default when empty',
+        extend_array().first_or_default(-1),
+        -1,
+        name=_qualify(ArrayEnumerable.first_or_default))
+
+    import io
+
+    def is_even(x: int) -> bool:
+        return x % 2 == 0
+
+    test_plan = io.StringIO()
+    query(range(10)) \
+        .where(is_even) \
+        .select(str) \
+        .order_by(len, reverse=True) \
+        .take(2) \
+        .skip(1) \
+        .explain(file=test_plan)
+
+    testif('prints the optimized plan with fused stages',
+        test_plan.getvalue().splitlines(),
+        ['source(range)',
+         '  fused',
+         '    where(is_even)',
+         '    select(str)',
+         '  top(2, len, True)',
+         '  skip(1)'],
+        name=_qualify(Queryable.explain))
+
+    test_profiled = query(range(10)).as_profiled().where(is_even).select(str).take(3)
+
+    testif('evaluates correctly while profiling',
+        test_profiled.to_list(),
+        ['0', '2', '4'],
+        name=_qualify(Queryable.as_profiled))
+    testif('records rows and selectivity per operator',
+        [(row['operator'], row['rows'], row['selectivity']) for row in test_profiled.profile],
+        [('source(range)', 5, None),
+         ('where(is_even)', 3, 0.6),
+         ('select(str)', 3, 1.0),
+         ('take(3)', 3, 1.0)],
+        name='Queryable.profile')
+
+    test_plan = io.StringIO()
+    test_profiled.explain(file=test_plan)
+
+    testif('prints the profile after a profiled evaluation',
+        [line.split()[:3] for line in test_plan.getvalue().splitlines()[2:]],
+        [['where(is_even)', '3', '60.0%'],
+         ['select(str)', '3', '100.0%'],
+         ['take(3)', '3', '100.0%']],
+        name=_qualify(Queryable.explain))
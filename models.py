@@ -7,14 +7,44 @@ Models for working with objects.
 import abc as _abc
 from collections import abc as _cabc
 import collections as _collections
+import copy as _copy
+import datetime as _dt
+import keyword as _keyword
+import sys as _sys
+import types as _types
 import uuid as _uuid
 
 from clay.time.dates import YMD_FMT
 
+_IMMUTABLE_TYPES = frozenset((str, int, float, complex, bool, bytes, type(None),
+    _dt.date, _dt.datetime, _dt.time, _dt.timedelta, _uuid.UUID))
+
+def _is_immutable(value: object) -> bool:
+    """Returns True if the value and everything it holds is immutable"""
+    if type(value) in (tuple, frozenset):
+        return all(map(_is_immutable, value))
+    return type(value) in _IMMUTABLE_TYPES
+
+def _copier(value: object) -> _cabc.Callable:
+    """
+    Returns the function that copies the value for each new object, None
+    if it is immutable, a shallow copy for lists, dicts and sets of
+    immutable values and a deep copy for anything else
+
+    """
+    if _is_immutable(value):
+        return None
+    if type(value) in (list, set, bytearray) and all(map(_is_immutable, value)) \
+            or type(value) is dict and all(map(_is_immutable, value.values())):
+        return _copy.copy
+    return _copy.deepcopy
+
 class Abstract:
 
     """Used to disable instantiation of this type"""
 
+    __slots__ = ()
+
     @_abc.abstractmethod
     def __init__(self) -> None:
         """Initializes this object"""
@@ -33,6 +63,8 @@ class Serializable(Abstract):
 
     """Abstract class used to convert between Python and JSON types"""
 
+    __slots__ = ()
+
     def __init__(self) -> None:
         """Always throws NotImplementedError because this class is abstract"""
         self.raise_if_base(Serializable)
@@ -131,7 +163,16 @@ class Anonymous(Serializable):
             self[key] = value
 
 def json2model(data: dict, model: type) -> Anonymous:
-    """Deserializes the given data to an object of type model"""
+    """
+    Deserializes the given data to an object of type model. Slotted
+    models skip the properties not listed in props
+
+    """
+    if isinstance(model, type) and issubclass(model, SlottedModel):
+        for key in sorted(data.keys() - model.props.keys()):
+            print('Warning: Property {} is skipped because '.format(key) +
+                'it is not listed in props')
+        return model.from_json(data)
 
     obj = model()
 
@@ -184,8 +225,292 @@ class Model(Anonymous):
 
         self.__id = value
 
+class SlottedModel(Serializable):
+
+    """
+    Base class for models compiled by compile_model. Fields live in
+    slots and share one immutable field table per class
+
+    """
+
+    __slots__ = ('_id',)
+
+    props = _types.MappingProxyType({'id': str})
+
+    def __init__(self, *initial_data, **kwargs) -> None:
+        """Always throws NotImplementedError because this class is abstract"""
+        self.raise_if_base(SlottedModel)
+
+    def __contains__(self, key: str) -> bool:
+        """Returns True if key is a field of this model, False otherwise"""
+        return key in self.props
+
+    def __getitem__(self, name: str) -> object:
+        """Gets the field with the given name"""
+        return getattr(self, name)
+
+    def __setitem__(self, name: str, value: object) -> None:
+        """Sets the field with the given name to value"""
+        setattr(self, name, value)
+
+    def __eq__(self, other: 'SlottedModel') -> bool:
+        """Returns True if this model is equal to other, False otherwise"""
+        assert self.props is other.props
+        for prop in self.props:
+            if getattr(self, prop) != getattr(other, prop):
+                return False
+        return True
+
+    def __repr__(self) -> str:
+        """Returns the string representation of this model"""
+        return r'{}({})'.format(
+            self.__class__.__name__,
+            ', '.join(prop + '=' + repr(getattr(self, prop))
+                for prop in sorted(self.props, key=lambda x: (x != 'id', x))))
+
+    @property
+    def id(self) -> str:
+        """Gets the ID of this model"""
+        return self._id
+
+    @id.setter
+    def id(self, value: str) -> str:
+        """Sets the ID of this model"""
+        if not isinstance(value, str):
+            raise TypeError('value must be of type str')
+
+        self._id = value
+
+    def get(self, name: str, default: object=None) -> object:
+        """Gets the field with the given name. Defaults to None"""
+        return getattr(self, name, default)
+
+    def to_json(self) -> dict:
+        """Serializes this model to JSON"""
+        return {prop: getattr(self, prop) for prop in self.props}
+
+    def update(self, *initial_data, **kwargs) -> None:
+        """Updates fields using dictionaries and keyword arguments"""
+        for param in initial_data:
+            if not isinstance(param, dict):
+                raise TypeError('initial_data must be of type dict')
+            self.__convert_data(param)
+        self.__convert_data(kwargs)
+
+    def __convert_data(self, lookup: dict) -> None:
+        """Assigns the lookup keys and values to this model"""
+        props = self.props
+        for key, value in lookup.items():
+            if props.get(key) is _dt.datetime and isinstance(value, str):
+                try:
+                    # attempt to read as date value
+                    value = _dt.datetime.strptime(value, YMD_FMT)
+                except ValueError:
+                    pass
+            setattr(self, key, value)
+
+def compile_model(name: str, fields: dict, defaults: dict=None,
+        module: str=None) -> type:
+    """
+    Compiles a slotted model class with the given name. fields maps
+    each field name to its type and defaults maps field names to their
+    initial values (None if omitted). Mutable defaults are copied per
+    instance, deeply if they hold mutable values. The ID field is always included. The class gets a from_json
+    class method that skips the initializer and ignores unknown keys
+
+    """
+    fields = dict(fields)
+    fields.pop('id', None)
+    defaults = dict(defaults or {})
+
+    for field in fields:
+        if not field.isidentifier() or _keyword.iskeyword(field) \
+                or field.startswith('_'):
+            raise ValueError('invalid field name: {}'.format(field))
+    for field in defaults:
+        if field not in fields:
+            raise ValueError('default given for unknown field: {}'.format(field))
+
+    def default(field: str) -> str:
+        """Returns the source of the default value of the field"""
+        if field not in defaults:
+            return 'None'
+        copier = _copier(defaults[field])
+        if copier is _copy.copy:
+            return '_copy(_defaults[{!r}])'.format(field)
+        elif copier is _copy.deepcopy:
+            return '_deepcopy(_defaults[{!r}])'.format(field)
+        return '_defaults[{!r}]'.format(field)
+
+    lines = ['def __init__(self, *initial_data, **kwargs):',
+             '    self._id = None']
+    lines += ['    self.{} = {}'.format(field, default(field)) for field in fields]
+    lines += ['    if initial_data or kwargs:',
+              '        self.update(*initial_data, **kwargs)',
+              '    if self._id is None:',
+              '        self._id = str(_uuid4())',
+              'def to_json(self):',
+              '    return {{{}}}'.format(', '.join(["'id': self._id"] +
+                  ['{0!r}: self.{0}'.format(field) for field in fields])),
+              'def from_json(cls, data):',
+              '    self = _new(cls)',
+              "    id = data.get('id')",
+              '    if id is None:',
+              '        id = str(_uuid4())',
+              '    elif not isinstance(id, str):',
+              "        raise TypeError('value must be of type str')",
+              '    self._id = id']
+    lines += ['    self.{0} = data[{0!r}] if {0!r} in data else {1}'.format(field, default(field))
+        for field in fields]
+    lines += ['    return self']
+    namespace = {'_copy': _copy.copy, '_deepcopy': _copy.deepcopy, '_defaults': defaults,
+        '_new': object.__new__,
+        '_uuid4': _uuid.uuid4}
+    exec('\n'.join(lines), namespace)
+
+    if module is None:
+        # use the module of the caller, as namedtuple does
+        try:
+            module = _sys._getframe(1).f_globals.get('__name__', '__main__')
+        except (AttributeError, ValueError):
+            module = __name__
+
+    return type(name, (SlottedModel,), {
+        '__slots__': tuple(fields),
+        '__init__': namespace['__init__'],
+        'to_json': namespace['to_json'],
+        'from_json': classmethod(namespace['from_json']),
+        '__module__': module,
+        'props': _types.MappingProxyType({'id': str, **fields})
+    })
+
+def _setters(model: type) -> set:
+    """Returns the names of the data descriptors of the model type"""
+    return {name for base in model.__mro__ for name, attr in vars(base).items()
+        if hasattr(type(attr), '__set__')}
+
+def _compile_decoder(model: type) -> _cabc.Callable:
+    """
+    Returns a function that deserializes one record to an object of type
+    model and adds the keys not listed in props to a set
+
+    """
+    if isinstance(model, type) and issubclass(model, SlottedModel):
+        from_json, props = model.from_json, model.props.keys()
+
+        def decode(record: dict, unknown: set) -> SlottedModel:
+            if not record.keys() <= props:
+                unknown.update(record.keys() - props)
+            return from_json(record)
+
+        return decode
+
+    prototype = model()
+
+    if not isinstance(prototype, Serializable):
+        raise TypeError('model must be of base type Serializable')
+
+    prototype.verify_props()
+
+    state = dict(vars(prototype)) if isinstance(prototype, Anonymous) else {}
+    props = state.pop('_props', None)
+    copiers = {key: _copier(value) for key, value in state.items()}
+
+    if not isinstance(prototype, Anonymous) or model.__setattr__ is not Anonymous.__setattr__ \
+            or _copy.deepcopy in copiers.values():
+        # attributes may have side effects or hold nested mutable values,
+        # so initialize every object
+        def decode(record: dict, unknown: set) -> Serializable:
+            obj = model()
+            props = obj.props
+            for key, value in record.items():
+                if key not in props:
+                    unknown.add(key)
+                setattr(obj, key, value)
+            return obj
+
+        return decode
+
+    # copy the attributes of the initialized prototype into each object
+    copies = [key for key, copier in copiers.items() if copier is not None]
+    setters = _setters(model)
+    # set the ID directly when the model keeps the ID property of Model
+    model_id = isinstance(prototype, Model) and model.id is Model.id
+    new, copy, uuid4 = object.__new__, _copy.copy, _uuid.uuid4
+
+    def decode(record: dict, unknown: set) -> Anonymous:
+        obj = new(model)
+        attrs = obj.__dict__
+        attrs.update(state)
+        for key in copies:
+            attrs[key] = copy(state[key])
+        attrs['_props'] = obj_props = props.copy()
+        if model_id:
+            if 'id' not in record:
+                attrs['_Model__id'] = str(uuid4())
+            elif isinstance(record['id'], str):
+                attrs['_Model__id'] = record['id']
+            else:
+                raise TypeError('value must be of type str')
+        for key, value in record.items():
+            if key not in props:
+                unknown.add(key)
+            if key not in setters:
+                attrs[key] = value
+                obj_props[key] = type(value)
+            elif key != 'id' or not model_id:
+                setattr(obj, key, value)
+        return obj
+
+    return decode
+
+def json2models(records: _cabc.Iterable, model: type) -> list:
+    """
+    Deserializes the given records to a list of objects of type model.
+    Models are initialized once and copied instead of generating an ID
+    per record. Properties not listed in props are warned about once
+
+    """
+    decode = _compile_decoder(model)
+    unknown = set()
+    models = [decode(record, unknown) for record in records]
+    if unknown:
+        print('Warning: Properties {} of {} may not serialize because '.format(
+            ', '.join(sorted(unknown)), model.__name__) +
+            'they are not listed in props')
+    return models
+
+def _compile_encoder(model: type) -> _cabc.Callable:
+    """Returns a function that serializes one object of type model to JSON"""
+    if model.to_json is not Serializable.to_json \
+            or not issubclass(model, Anonymous) \
+            or model.props is not Anonymous.props \
+            or model.__getattribute__ is not object.__getattribute__:
+        return model.to_json
+
+    def encode(obj: Anonymous) -> dict:
+        attrs = obj.__dict__
+        return {prop: attrs[prop] if prop in attrs else getattr(obj, prop, None)
+            for prop in obj._props}
+
+    return encode
+
+def models2json(models: _cabc.Iterable) -> list:
+    """Serializes the given models to a list of JSON objects"""
+    encoders = {}
+    records = []
+    for model in models:
+        encode = encoders.get(type(model))
+        if encode is None:
+            encode = encoders[type(model)] = _compile_encoder(type(model))
+        records.append(encode(model))
+    return records
+
 if __name__ == '__main__':
 
+    import contextlib as _contextlib
+    import io as _io
+
     from clay.tests import testif, testraises
     from clay.utils import qualify
 
@@ -336,3 +661,167 @@ if __name__ == '__main__':
         repr(Model({'nj': 'no-joke', 'jk': 'joke', 'id': '0000'})),
         "Model(id='0000', jk='joke', nj='no-joke')",
         qualify(Model.__repr__))
+
+    Person = compile_model('Person', {'name': str, 'born': _dt.datetime, 'tags': list},
+        defaults={'name': '', 'tags': []})
+    person = Person({'id': '0000', 'born': '2000/01/31'}, name='Ada')
+    testif('sets fields from dictionaries and keyword arguments',
+        (person.id, person.name, person.born, person.tags),
+        ('0000', 'Ada', _dt.datetime(2000, 1, 31), []),
+        name=qualify(compile_model))
+    testif('uses UUID if no ID specified',
+        type(_uuid.UUID(Person().id)),
+        _uuid.UUID,
+        name=qualify(compile_model))
+    testif('copies mutable defaults per instance',
+        Person().tags is not Person().tags,
+        True,
+        name=qualify(compile_model))
+    Team = compile_model('Team', {'roles': dict}, defaults={'roles': {'admins': []}})
+    testif('copies nested mutable defaults per instance',
+        (Team().roles['admins'] is not Team().roles['admins'],
+            Team.from_json({})['roles']['admins'] is not Team.from_json({})['roles']['admins']),
+        (True, True),
+        name=qualify(compile_model))
+    testif('instances have no __dict__',
+        hasattr(person, '__dict__'),
+        False,
+        name=qualify(compile_model))
+    testif('shares one field table per class',
+        Person().props is person.props,
+        True,
+        name=qualify(compile_model))
+    testraises('field table is immutable',
+        lambda: exec("person.props['age'] = int"),
+        TypeError,
+        name=qualify(compile_model))
+    testraises('undeclared fields cannot be set',
+        lambda: setattr(person, 'age', 42),
+        AttributeError,
+        name=qualify(compile_model))
+    testraises('invalid field name',
+        lambda: compile_model('Bad', {'_hidden': str}),
+        ValueError,
+        name=qualify(compile_model))
+    testraises('default for unknown field',
+        lambda: compile_model('Bad', {'name': str}, defaults={'age': 0}),
+        ValueError,
+        name=qualify(compile_model))
+    testraises('base class is abstract',
+        lambda: SlottedModel(),
+        NotImplementedError,
+        name=qualify(SlottedModel.__init__))
+    testraises('raises TypeError for invalid ID type',
+        lambda: Person(id=0),
+        TypeError,
+        name='SlottedModel.id')
+    testif('contains declared fields only',
+        ('name' in person, 'age' in person),
+        (True, False),
+        name=qualify(SlottedModel.__contains__))
+    testif('compares fields',
+        (person == Person(person.to_json()), person == Person(id='0000')),
+        (True, False),
+        name=qualify(SlottedModel.__eq__))
+    testif('returns the fields',
+        Person(id='0000', name='Ada', born=1).to_json(),
+        {'id': '0000', 'name': 'Ada', 'born': 1, 'tags': []},
+        name=qualify(SlottedModel.to_json))
+    testif('returns correct string representation with ID first',
+        repr(Person(id='0000', name='Ada')),
+        "Person(id='0000', born=None, name='Ada', tags=[])",
+        name=qualify(SlottedModel.__repr__))
+    testif('returns correct default if not a field',
+        (person.get('name'), person.get('age', -1)),
+        ('Ada', -1),
+        name=qualify(SlottedModel.get))
+    testif('deserializes to a slotted model',
+        json2model({'id': '0001', 'name': 'Bo'}, Person).to_json(),
+        {'id': '0001', 'name': 'Bo', 'born': None, 'tags': []},
+        name=qualify(json2model))
+    def json2model_slotted_test():
+        output = _io.StringIO()
+        with _contextlib.redirect_stdout(output):
+            person = json2model({'id': '0003', 'name': 'Cy', 'age': 3}, Person)
+        return person.to_json(), output.getvalue().count('Property age is skipped')
+
+    testif('skips properties not listed in slotted props',
+        json2model_slotted_test(),
+        ({'id': '0003', 'name': 'Cy', 'born': None, 'tags': []}, 1),
+        name=qualify(json2model))
+    testif('creates slotted models without the initializer',
+        (Person.from_json({'id': '0002', 'extra': 0}).to_json(), Person.from_json({}).tags is not Person.from_json({}).tags),
+        ({'id': '0002', 'name': '', 'born': None, 'tags': []}, True),
+        name='SlottedModel.from_json')
+    testraises('raises TypeError for invalid ID type',
+        lambda: Person.from_json({'id': 0}),
+        TypeError,
+        name='SlottedModel.from_json')
+
+    class Account(Model):
+        def __init__(self):
+            super().__init__()
+            self.name = ''
+            self.tags = []
+
+    def json2models_test(model):
+        output = _io.StringIO()
+        with _contextlib.redirect_stdout(output):
+            models = json2models([{'id': '0', 'name': 'a', 'x': 1}, {'name': 'b', 'x': 2, 'y': 3}], model)
+        return models, output.getvalue()
+
+    accounts, warnings = json2models_test(Account)
+    with _contextlib.redirect_stdout(_io.StringIO()):
+        account = json2model({'id': '0', 'name': 'a', 'x': 1}, Account)
+    testif('decodes the same as json2model',
+        (accounts[0].to_json(), accounts[0].props),
+        (account.to_json(), account.props),
+        name=qualify(json2models))
+    testif('generates IDs only for records without one',
+        (accounts[0].id, type(_uuid.UUID(accounts[1].id))),
+        ('0', _uuid.UUID),
+        name=qualify(json2models))
+    testif('copies mutable attributes per model',
+        accounts[0].tags is not accounts[1].tags,
+        True,
+        name=qualify(json2models))
+    class Ledger(Model):
+        def __init__(self):
+            super().__init__()
+            self.recent = _collections.deque(maxlen=2)
+            self.totals = {'debits': []}
+
+    def json2models_nested_test():
+        ledgers = json2models([{'id': '0'}, {'id': '1'}], Ledger)
+        ledgers[0].recent.append(1)
+        ledgers[0].totals['debits'].append(1)
+        return [(list(ledger.recent), ledger.totals) for ledger in ledgers]
+
+    testif('initializes models with nested mutable attributes per model',
+        json2models_nested_test(),
+        [([1], {'debits': [1]}), ([], {'debits': []})],
+        name=qualify(json2models))
+    testif('warns once per type',
+        warnings,
+        'Warning: Properties x, y of Account may not serialize because they are not listed in props\n',
+        name=qualify(json2models))
+    testif('decodes slotted models',
+        [model.to_json() for model in json2models_test(Person)[0]][:1],
+        [{'id': '0', 'name': 'a', 'born': None, 'tags': []}],
+        name=qualify(json2models))
+    testif('decodes models with custom props',
+        [model.implicit for model in json2models([{'implicit': 1}], Serious)],
+        [1],
+        name=qualify(json2models))
+    testraises('raises TypeError for incorrect subtype',
+        lambda: json2models([], object),
+        TypeError,
+        name=qualify(json2models))
+    testif('encodes the same as to_json',
+        models2json([accounts[1], Person(id='0'), Serious()]),
+        [accounts[1].to_json(), Person(id='0').to_json(), Serious().to_json()],
+        name=qualify(models2json))
+    testraises('raises TypeError for invalid ID type',
+        lambda: json2models([{'id': 0}], Account),
+        TypeError,
+        name=qualify(json2models))
@@ -4,10 +4,31 @@ Custom repositories
 
 """
 
+import asyncio as _asyncio
+import bisect as _bisect
 from collections import abc as _abc
+import contextlib as _contextlib
 import datetime as _dt
+import functools as _functools
+import gc as _gc
+import itertools as _itertools
 import json as _json
+import marshal as _marshal
+import math as _math
+import mmap as _mmap
+import operator as _operator
 import os as _os
+import re as _re
+import sqlite3 as _sqlite3
+import stat as _stat
+import tempfile as _tempfile
+import threading as _threading
+import zlib as _zlib
+
+try:
+    import fcntl as _fcntl
+except ImportError: # not available on Windows
+    _fcntl = None
 
 from clay.decors import obsolete
 from clay.linq import IEnumerable, \
@@ -16,13 +37,383 @@ from clay.linq import IEnumerable, \
     query as _query
 from clay.lists import rmdup as _rmdup
 from clay.models import Model as _Model, \
+    SlottedModel as _SlottedModel, \
     json2model as _json2model, \
+    json2models as _json2models, \
+    models2json as _models2json, \
     Abstract as _Abstract
 
 class RecordNotFoundError(Exception):
     """Error type for when a record is not found"""
     pass
 
+class ConcurrencyError(Exception):
+    """Error type for when a database was written by another process since it was read"""
+    pass
+
+# binary snapshots start with the magic, the format version and the marshal version
+_SNAPSHOT_MAGIC = b'CLAYSNAP'
+# the format version is checked on load, the marshal version is only recorded
+# because marshal reads the data of its older versions
+_SNAPSHOT_FORMAT = _SNAPSHOT_MAGIC + bytes([1])
+_SNAPSHOT_HEADER = _SNAPSHOT_FORMAT + bytes([_marshal.version])
+_JSON_SCALARS = frozenset((str, int, float, bool, type(None)))
+
+def _check_json_types(values: tuple) -> None:
+    """
+    Raises ValueError for values that JSON would convert or reject, such as
+    tuples, sets, bytes and dicts with keys that are not strings, so a
+    snapshot reads back the same values as JSON. The types are collected
+    a column at a time and only containers are walked into
+
+    """
+    if set(map(type, values)) <= _JSON_SCALARS:
+        return
+    lists = []
+    dicts = []
+    for value in values:
+        if type(value) in _JSON_SCALARS:
+            continue
+        if isinstance(value, list):
+            lists.append(value)
+        elif isinstance(value, dict):
+            dicts.append(value)
+        elif not isinstance(value, (str, int, float)):
+            # subclasses of JSON types are left for marshal to reject
+            raise ValueError('{} is not a JSON type'.format(type(value).__name__))
+    if lists:
+        _check_json_types(tuple(_itertools.chain.from_iterable(lists)))
+    if dicts:
+        if not set(map(type, _itertools.chain.from_iterable(dicts))) <= {str}:
+            raise ValueError('dict keys must be of type str')
+        _check_json_types(tuple(_itertools.chain.from_iterable(map(dict.values, dicts))))
+
+def encode_snapshot(obj: object) -> bytes:
+    """
+    Encodes the database as a binary snapshot. A list of records is stored
+    as a header schema of the fields of the first record followed by rows
+    of values in that order, so field names are stored once. Records with
+    other fields are stored whole by position. Values are typed and
+    length-prefixed by marshal. Raises ValueError for values that are not
+    JSON types.
+
+    """
+    if not (isinstance(obj, list) and obj and type(obj[0]) is dict):
+        _check_json_types((obj,))
+        return _SNAPSHOT_HEADER + _marshal.dumps((None, obj, None))
+
+    fields = tuple(obj[0])
+    rows = []
+    others = {}
+    for i, record in enumerate(obj):
+        if type(record) is dict and tuple(record) == fields:
+            rows.append(tuple(record.values()))
+        else:
+            rows.append(())
+            others[i] = record
+
+    _check_json_types((obj[0],))
+    for column in zip(*filter(None, rows)):
+        _check_json_types(column)
+    _check_json_types(tuple(others.values()))
+    return _SNAPSHOT_HEADER + _marshal.dumps((fields, rows, others))
+
+def decode_snapshot(data: bytes) -> object:
+    """Decodes a binary snapshot created by encode_snapshot"""
+    if data[:len(_SNAPSHOT_FORMAT)] != _SNAPSHOT_FORMAT:
+        raise ValueError('not a binary snapshot of this version')
+    fields, rows, others = _marshal.loads(data[len(_SNAPSHOT_HEADER):])
+    if fields is None:
+        return rows
+    records = list(map(dict, map(zip, _itertools.repeat(fields), rows)))
+    for i, record in others.items():
+        records[i] = record
+    return records
+
+@_contextlib.contextmanager
+def _gc_paused() -> _abc.Iterator:
+    """Pauses the cyclic garbage collector, which would rescan every record while loading"""
+    enabled = _gc.isenabled()
+    _gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            _gc.enable()
+
+def _changes(method: _abc.Callable) -> _abc.Callable:
+    """
+    Runs the repository method under the change lock of the repository,
+    which a write holds while it captures the database, so a write on
+    the group commit thread never sees a change half made
+
+    """
+    @_functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._change_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def load_snapshot(filename: str) -> object:
+    """Loads the database from a binary snapshot, or from JSON if it is not one"""
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+    with _gc_paused():
+        if data.startswith(_SNAPSHOT_MAGIC):
+            return decode_snapshot(data)
+        return _json.loads(data)
+
+# the umask can only be read by setting it, so read it once on import
+_UMASK = _os.umask(0)
+_os.umask(_UMASK)
+
+def encode_database(obj: object, binary: bool=False) -> bytes:
+    """
+    Encodes the object as JSON, or as a binary snapshot if binary is True
+    and its values allow it
+
+    """
+    with _gc_paused():
+        if binary:
+            try:
+                return encode_snapshot(obj)
+            except ValueError:
+                # fall back to JSON, which reports the values it cannot encode
+                pass
+        return _json.dumps(obj).encode()
+
+def dump_atomic(obj: object, filename: str, binary: bool=False) -> None:
+    """
+    Dumps the object as JSON, or as a binary snapshot if binary is True
+    and its values allow it, to a temporary file and renames it over the
+    given file, so readers and crashes never see a partial file
+
+    """
+    write_atomic(encode_database(obj, binary), filename)
+
+def write_atomic(data: bytes, filename: str) -> None:
+    """Writes the encoded database to the given file like dump_atomic"""
+    try:
+        # keep the permissions of the file being replaced
+        mode = _stat.S_IMODE(_os.stat(filename).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+
+    directory, base = _os.path.split(filename)
+    fd, temp = _tempfile.mkstemp(prefix=base + '.', suffix='.tmp', dir=directory or '.')
+    try:
+        with _os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+            fp.flush()
+            _os.fsync(fp.fileno())
+        # mkstemp creates the file readable by its owner only
+        _os.chmod(temp, mode)
+        _os.replace(temp, filename)
+    except BaseException:
+        _os.remove(temp)
+        raise
+
+class BaseIndex(_Abstract):
+
+    """Base index of models by the value of one field"""
+
+    def __init__(self, field: str) -> None:
+        """Initializes this index for the given field"""
+        self.raise_if_base(BaseIndex)
+        self.field = field
+        self.clear()
+
+    def value(self, model: _abc.Hashable) -> object:
+        """Returns the value of the indexed field for the model"""
+        return model.get(self.field)
+
+    def add(self, model: _abc.Hashable) -> None:
+        raise NotImplementedError('add')
+
+    def add_range(self, models: _abc.Iterable) -> None:
+        """Adds the models to this index"""
+        for model in models:
+            self.add(model)
+
+    def remove(self, model: _abc.Hashable) -> None:
+        raise NotImplementedError('remove')
+
+    def find(self, value: object) -> list:
+        raise NotImplementedError('find')
+
+    def clear(self) -> None:
+        raise NotImplementedError('clear')
+
+class HashIndex(BaseIndex):
+
+    """Index for finding models by equal field values in constant time"""
+
+    def add(self, model: _abc.Hashable) -> None:
+        """Adds the model to this index"""
+        value = self.value(model)
+        if value not in self.__models:
+            self.__models[value] = {}
+        self.__models[value][id(model)] = model
+
+    def remove(self, model: _abc.Hashable) -> None:
+        """Removes the model from this index"""
+        value = self.value(model)
+        models = self.__models.get(value, {})
+        models.pop(id(model), None)
+        if not models:
+            self.__models.pop(value, None)
+
+    def find(self, value: object) -> list:
+        """Returns the models with the given field value"""
+        return list(self.__models.get(value, {}).values())
+
+    def clear(self) -> None:
+        """Removes all models from this index"""
+        self.__models = {}
+
+class SortedIndex(BaseIndex):
+
+    """
+    Index for finding models by field values within a range in
+    logarithmic time. Models without a value for the field are skipped.
+
+    """
+
+    def add(self, model: _abc.Hashable) -> None:
+        """Adds the model to this index"""
+        value = self.value(model)
+        if value is None:
+            return
+        i = _bisect.bisect_right(self.__values, value)
+        self.__values.insert(i, value)
+        self.__models.insert(i, model)
+
+    def add_range(self, models: _abc.Iterable) -> None:
+        """
+        Adds the models to this index in one pass. The batch is sorted and
+        merged after the existing entries, so equal values keep the order
+        they were added in
+
+        """
+        batch = [(value, model) for value, model in ((self.value(model), model) for model in models)
+            if value is not None]
+        if len(batch) < 2:
+            for value, model in batch:
+                self.add(model)
+            return
+        # the stable sort detects the two sorted runs and merges them
+        batch.sort(key=_operator.itemgetter(0))
+        entries = list(zip(self.__values, self.__models))
+        entries.extend(batch)
+        entries.sort(key=_operator.itemgetter(0))
+        self.__values = [value for value, model in entries]
+        self.__models = [model for value, model in entries]
+
+    def remove(self, model: _abc.Hashable) -> None:
+        """Removes the model from this index"""
+        value = self.value(model)
+        if value is None:
+            return
+        start = _bisect.bisect_left(self.__values, value)
+        stop = _bisect.bisect_right(self.__values, value)
+        for i in range(start, stop):
+            if self.__models[i] is model:
+                del self.__values[i]
+                del self.__models[i]
+                return
+
+    def find(self, value: object) -> list:
+        """Returns the models with the given field value"""
+        return self.range(value, value)
+
+    def range(self, low: object=None, high: object=None) -> list:
+        """
+        Returns the models with field values between low and high
+        inclusive in ascending order. None leaves that side open
+
+        """
+        start = 0 if low is None else _bisect.bisect_left(self.__values, low)
+        stop = len(self.__values) if high is None else _bisect.bisect_right(self.__values, high)
+        return self.__models[start:stop]
+
+    def clear(self) -> None:
+        """Removes all models from this index"""
+        self.__values = []
+        self.__models = []
+
+INDEX_KINDS = {
+    'hash': HashIndex,
+    'sorted': SortedIndex
+}
+
+_WHITESPACE = rb'[ \t\n\r]*'
+# characters outside of strings, objects and arrays
+_PLAIN = rb'[^{}\[\]"]*'
+# the patterns are unrolled so every character has only one way to match,
+# which keeps failed matches from backtracking without atomic groups
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+# an object or array without nested objects or arrays
+_NESTED = rb'(?:\[' + _PLAIN + rb'(?:' + _STRING + _PLAIN + rb')*\]|\{' \
+    + _PLAIN + rb'(?:' + _STRING + _PLAIN + rb')*\})'
+# a record entry in the array, capturing the record and the value of its id key.
+# Strings are matched whole, so a key is never matched inside one
+_ENTRY = _re.compile(rb'[\[,]' + _WHITESPACE + rb'(\{' + _PLAIN + rb'(?:(?:"id"' + _WHITESPACE \
+    + rb':' + _WHITESPACE + rb'(' + _STRING + rb'|[-+.\w]+(?![-+.\w]))|' + _STRING + rb'|' \
+    + _NESTED + rb')' + _PLAIN + rb')*\})' + _WHITESPACE)
+_SPACE = _re.compile(_WHITESPACE)
+_TOKEN = _re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+
+def _record_end(buffer: bytes, pos: int) -> int:
+    """Returns the end of the record starting at the position"""
+    depth = 0
+    for token in _TOKEN.finditer(buffer, pos):
+        char = token.group()[:1]
+        if char in b'{[':
+            depth += 1
+        elif char in b'}]':
+            depth -= 1
+            if depth == 0:
+                return token.end()
+    raise ValueError('unterminated record at byte {}'.format(pos))
+
+def scan_records(buffer: bytes) -> dict:
+    """
+    Returns a dict of primary keys to the (start, end) byte offsets of the
+    records in the JSON array in the buffer, decoding only records nested
+    more than two levels deep. Records without an id are skipped and the
+    first of duplicate ids is kept.
+
+    """
+    offsets = {}
+
+    pos = _SPACE.match(buffer).end()
+    while buffer[pos:pos + 1] in (b'[', b','):
+        for entry in _ENTRY.finditer(buffer, pos):
+            if entry.start() != pos:
+                break
+            pk = entry.group(2)
+            if pk is not None:
+                pk = pk[1:-1].decode() if pk[:1] == b'"' and b'\\' not in pk else _json.loads(pk)
+            if pk is not None and pk not in offsets:
+                offsets[pk] = entry.span(1)
+            pos = entry.end()
+
+        if buffer[pos:pos + 1] in (b'[', b','):
+            # the record is nested too deeply for the pattern
+            start = _SPACE.match(buffer, pos + 1).end()
+            if buffer[start:start + 1] == b']':
+                pos = start
+                break
+            end = _record_end(buffer, start)
+            pk = _json.loads(buffer[start:end]).get('id')
+            if pk is not None and pk not in offsets:
+                offsets[pk] = (start, end)
+            pos = _SPACE.match(buffer, end).end()
+
+    if buffer[pos:pos + 1] != b']':
+        raise ValueError('expected a JSON array of records at byte {}'.format(pos))
+    return offsets
+
 class IRepository(_Abstract):
 
     def read(self) -> object:
@@ -44,6 +435,17 @@ class BaseRepository(_Abstract):
         self.__name = name
         self.__empty = empty
         self.__has_read = False
+        self.__binary = False
+        # the version is bumped by each change and saved as the context on read/write
+        self.__version = 0
+        self.__context_version = 0
+        # writes are deferred inside batches and while group commit runs
+        self.__batch_depth = 0
+        self.__write_pending = False
+        self.__write_lock = _threading.RLock()
+        self._change_lock = _threading.RLock()
+        self.__group_commit = None
+        self.__group_commit_error = None
         self.clear()
         self._update_context()
 
@@ -52,10 +454,36 @@ class BaseRepository(_Abstract):
         if not self.has_read:
             _ = self.read()
 
-    def _update_context(self) -> None:
-        """Updates the context to be the current database snapshot"""
-        self.__context = self._db.copy()
+    def _mark_changed(self) -> None:
+        """Marks the database as changed since the last read/write"""
+        self.__version += 1
+
+    def _capture_context(self) -> tuple:
+        """Returns the version and structure of the database as it is now"""
+        return self.__version, self._save_structure()
+
+    def _update_context(self, context: tuple=None) -> None:
+        """
+        Marks the database as unchanged since the last read/write, or
+        since the given context was captured for a write
+
+        """
+        self.__context_version, self.__structure = context or self._capture_context()
+
+    def _save_structure(self) -> object:
+        """
+        Returns the identity and length of the database. Changes made through
+        this repository are versioned, so only items added or removed
+        directly need to be caught, without copying the database
+
+        """
+        return id(self._db), len(self._db)
+
+    def _has_structure_changed(self, structure: object) -> bool:
+        """Returns True if the database was replaced or resized directly"""
+        return structure != (id(self._db), len(self._db))
 
+    @_changes
     def clear(self) -> None:
         """Sets the database to the empty structure"""
         self._db = self.__empty
@@ -87,15 +515,104 @@ class BaseRepository(_Abstract):
         Creates the database if it doesn't already exist.
 
         """
-        if self.exists():
-            with open(self.name) as fp:
-                self._db = _json.load(fp)
-            self._update_context()
+        self._set_read(load_snapshot(self.name) if self.exists() else None)
+
+    @_changes
+    def _set_read(self, db: object, write: bool=True) -> None:
+        """Sets the database read from the disk, or creates it if db is None"""
+        if db is None:
+            self.create(write=write)
         else:
-            self.create()
+            self._db = db
+            self._update_context()
 
         self.__has_read = True
 
+    def _defer_write(self) -> bool:
+        """Returns True and marks a write as pending if writes are deferred"""
+        if self.__group_commit_error is not None:
+            error, self.__group_commit_error = self.__group_commit_error, None
+            raise error
+        if self.__batch_depth or self.__group_commit is not None:
+            self.__write_pending = True
+            return True
+        return False
+
+    def _write_now(self) -> None:
+        raise NotImplementedError('_write_now')
+
+    def flush(self) -> None:
+        """Performs the deferred write if there is one"""
+        with self.__write_lock:
+            if self.__write_pending:
+                self.__write_pending = False
+                self._write_now()
+
+    @_contextlib.contextmanager
+    def batch(self) -> _abc.Iterator:
+        """
+        Returns a unit of work for this repository. Writes inside it are
+        deferred, and one write is made on exit if any were requested.
+        Nothing is written on exit if the block raises, but the changes
+        made before the error stay in the database and the next write or
+        flush persists them.
+
+        """
+        self.__batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.__batch_depth -= 1
+        if not self.__batch_depth:
+            self.flush()
+
+    def start_group_commit(self, interval: float=0.1) -> None:
+        """
+        Starts a background thread that makes the deferred write at most
+        every interval seconds. Writes are deferred until stop_group_commit.
+        An error from a background write is raised by the next write.
+
+        """
+        if self.__group_commit is not None:
+            raise RuntimeError('group commit has already started')
+        stop = _threading.Event()
+        thread = _threading.Thread(target=self._group_commit, args=(interval, stop),
+            name='group-commit:' + self.name, daemon=True)
+        self.__group_commit = (thread, stop)
+        thread.start()
+
+    def _group_commit(self, interval: float, stop: _threading.Event) -> None:
+        """Flushes every interval seconds until stopped"""
+        while not stop.wait(interval):
+            try:
+                self.flush()
+            except Exception as ex:
+                self.__group_commit_error = ex
+
+    def stop_group_commit(self) -> None:
+        """Stops the group commit thread and makes the deferred write"""
+        if self.__group_commit is None:
+            return
+        thread, stop = self.__group_commit
+        stop.set()
+        thread.join()
+        self.__group_commit = None
+        self.flush()
+
+    def set_binary(self, enabled: bool=True) -> None:
+        """
+        Enables or disables writing this database as a binary snapshot,
+        which is smaller and faster to load than JSON. Either format is
+        read regardless, and JSON is written for values that are not JSON types.
+
+        """
+        self.__binary = enabled
+
+    @property
+    def binary(self) -> bool:
+        """Returns True if this database is written as a binary snapshot"""
+        return self.__binary
+
     @property
     def name(self) -> str:
         """The name of this repository"""
@@ -119,14 +636,19 @@ class BaseRepository(_Abstract):
     def has_context_changed(self) -> bool:
         """
         Returns True if the database context has changed since last
-        read/write, False otherwise
+        read/write, False otherwise. Changes made through this repository
+        are versioned in O(1), and items added or removed through db
+        directly are caught as well. Items edited in place are not, so
+        mark them with mark_dirty on a CrudRepository or set db again.
 
         """
-        return self.__context != self._db
+        return self.__version != self.__context_version \
+            or self._has_structure_changed(self.__structure)
 
 class JsonRepository(BaseRepository, IRepository):
     """Wrapper for working with JSON databases"""
 
+    @_changes
     def prune(self, predicate: _abc.Callable) -> None:
         """
         Prunes entities from the database based on the given predicate
@@ -145,13 +667,21 @@ class JsonRepository(BaseRepository, IRepository):
                 modified = True
         self._db = temp
         if modified:
+            self._mark_changed()
             self.write()
 
     def write(self) -> None:
+        """Writes this database to the disk, or defers it inside a batch or group commit"""
+        if not self._defer_write():
+            self._write_now()
+
+    def _write_now(self) -> None:
         """Writes this database to the disk"""
-        with open(self.name, 'w') as fd:
-            _json.dump(self.db, fd)
-        self._update_context()
+        with self._change_lock:
+            data = encode_database(self.db, self.binary)
+            context = self._capture_context()
+        write_atomic(data, self.name)
+        self._update_context(context)
 
     @property
     def db(self) -> object:
@@ -159,11 +689,13 @@ class JsonRepository(BaseRepository, IRepository):
         return self._db
 
     @db.setter
+    @_changes
     def db(self, value: object) -> None:
         """Sets this database to the given value"""
         if not isinstance(value, (dict, list)):
             raise TypeError('db must be a JSON serializable of base type dict or list')
         self._db = value
+        self._mark_changed()
 
 class ListRepository(JsonRepository):
     """Wrapper for working with list databases"""
@@ -181,34 +713,242 @@ class CrudRepository(ListRepository):
 
     def __init__(self, name: str) -> None:
         """Initializes this CRUD repository under the given file name"""
+        # the write-ahead log is off until set_wal is called
+        self.__wal = False
+        self.__wal_pending = []
+        self.__wal_records = 0
+        self.__wal_threshold = 0
+        self.__indexes = {}
+        # primary keys inserted, updated or deleted since the last read/write
+        self.__dirty = set()
+        # deleted models are skipped until the next compaction, keyed by identity
+        self.__deleted = {}
+        # advisory locking and the stamp of the files when last read or written
+        self.__locked = False
+        self.__stamp = None
+        # the pending coalesced write and the event loop and lock ordering async reads and writes
+        self.__flush = None
+        self.__async_lock = None
+        # lazy reads map the file and decode records on access until read
+        self.__lazy = False
+        self.__mapped = None
+        self.__offsets = {}
         super().__init__(name)
         self.__model = object
         self.clear_index()
 
+    @_changes
     def clear(self) -> None:
         """Sets the database to the empty structure and clears the index"""
         self._db = _extend(self.empty)
+        self.__deleted = {}
+        self._unmap()
         self.clear_index()
+        self._journal({'op': 'clear'})
+
+    @_changes
+    def _compact_deleted(self) -> None:
+        """Drops the models marked as deleted from the database in one pass"""
+        if self.__deleted:
+            deleted = self.__deleted
+            self._db = _extend([model for model in self._db if id(model) not in deleted])
+            self.__deleted = {}
+
+    def _live(self) -> IEnumerable:
+        """Returns the models not marked as deleted without compacting the database"""
+        if not self.__deleted:
+            return self._db
+        deleted = self.__deleted
+        return self._db.where(lambda model: id(model) not in deleted)
+
+    def _update_context(self, context: tuple=None) -> None:
+        """Marks the database and its models as unchanged since the last read/write"""
+        super()._update_context(context)
+        if context is None:
+            # a captured write has already taken the primary keys it covers
+            self.__dirty = set()
+
+    def _journal(self, record: dict) -> None:
+        """
+        Marks the change as dirty and queues the change record for the
+        write-ahead log if it is enabled
+
+        """
+        self._mark_changed()
+        if 'id' in record:
+            self.__dirty.add(record['id'])
+        if self.__wal:
+            self.__wal_pending.append(_json.dumps(record))
+
+    def _journal_insert(self, model: _abc.Hashable) -> None:
+        """Journals the insert of the model, serializing it only for the write-ahead log"""
+        if self.__wal:
+            self._journal({'op': 'insert', 'id': model['id'], 'model': self._serialize(model)})
+        else:
+            self._journal({'op': 'insert', 'id': model['id']})
+
+    def _serialize(self, model: _abc.Hashable) -> dict:
+        """Returns the JSON representation of the model"""
+        return model.to_json() if hasattr(model, 'to_json') else dict(model)
+
+    def _read_wal(self) -> list:
+        """
+        Returns the change records in the write-ahead log, if it is enabled.
+        A torn append at the end of the log is truncated, so the next
+        append starts on a line of its own.
+
+        """
+        entries = []
+        if not self.__wal or not _os.path.exists(self.wal_name):
+            return entries
+
+        with open(self.wal_name, 'rb+') as fp:
+            end = 0
+            for line in fp:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('torn append')
+                    entries.append(_json.loads(line))
+                except ValueError:
+                    # a torn append at the end of the log
+                    fp.truncate(end)
+                    break
+                end += len(line)
+        return entries
+
+    def _replay(self, records: list, entries: list) -> list:
+        """
+        Applies the change records of the write-ahead log to the records
+        read from the snapshot and returns them. Replaying is idempotent, so
+        records already folded into the snapshot by an interrupted
+        compaction are harmless.
+
+        """
+        self.__wal_records = len(entries)
+        if not entries:
+            return records
+
+        records = list(records)
+        positions = {record['id']: i for i, record in enumerate(records)}
+
+        for entry in entries:
+            op = entry['op']
+            if op == 'insert':
+                if entry['id'] in positions:
+                    records[positions[entry['id']]] = entry['model']
+                else:
+                    positions[entry['id']] = len(records)
+                    records.append(entry['model'])
+            elif op == 'update':
+                if entry['id'] in positions:
+                    records[positions[entry['id']]].update(entry['props'])
+            elif op == 'delete':
+                if entry['id'] in positions:
+                    records[positions.pop(entry['id'])] = None
+            elif op == 'clear':
+                records = []
+                positions = {}
+            elif op == 'add_column':
+                for record in records:
+                    if record is not None:
+                        record[entry['name']] = entry['value']
+            elif op == 'drop_column':
+                for record in records:
+                    if record is not None:
+                        record.pop(entry['name'], None)
+
+        return [record for record in records if record is not None]
 
     def build_index(self) -> None:
         """Builds the index for this CrudRepository to speed up access times"""
+        self._compact_deleted()
         for model in self._db:
             model_id = model['id']
             if model_id is not None and model_id not in self.__index:
                 self.__index[model_id] = model
 
+        for index in self.__indexes.values():
+            index.clear()
+            index.add_range(self._db)
+
+    def _is_index_complete(self) -> bool:
+        """Returns True if every model in the database is in the index"""
+        return len(self.__index) == len(self._db) - len(self.__deleted)
+
+    def _ensure_index_complete(self) -> None:
+        """Builds the index if some models in the database are not in it"""
+        if not self._is_index_complete():
+            self.build_index()
+
     def clear_index(self) -> None:
-        """Clears the index for this CrudRepository"""
+        """Clears the index and the secondary indexes for this CrudRepository"""
         self.__index = {}
+        for index in self.__indexes.values():
+            index.clear()
+
+    def create_index(self, field: str, kind: str='hash') -> None:
+        """
+        Creates a secondary index on the given field. Hash indexes find
+        equal values and sorted indexes also find ranges of values.
+        Indexes are kept current by insert, delete, update and update_prop.
+
+        """
+        if kind not in INDEX_KINDS:
+            raise ValueError('kind must be in [{}]'.format(', '.join(INDEX_KINDS)))
+        index = INDEX_KINDS[kind](field)
+        index.add_range(self._live())
+        self.__indexes[field] = index
+
+    def drop_index(self, field: str) -> None:
+        """Drops the secondary index on the given field"""
+        del self.__indexes[field]
 
+    def find_by(self, field: str, value: object) -> IEnumerable:
+        """
+        Returns the models whose field equals the value, using the
+        secondary index on the field if there is one
+
+        """
+        self._ensure_connected()
+
+        if field == 'id':
+            model = self.get(value)
+            return _extend([] if model is None else [model])
+
+        if field in self.__indexes:
+            return _extend(self.__indexes[field].find(value))
+
+        return self._live().where(lambda model: model.get(field) == value)
+
+    def find_range(self, field: str, low: object=None, high: object=None) -> IEnumerable:
+        """
+        Returns the models whose field is between low and high inclusive,
+        ordered by the field when it has a sorted index. None leaves that
+        side of the range open.
+
+        """
+        self._ensure_connected()
+
+        index = self.__indexes.get(field)
+        if isinstance(index, SortedIndex):
+            return _extend(index.range(low, high))
+
+        return self._live().where(lambda model: model.get(field) is not None \
+            and (low is None or model.get(field) >= low) \
+            and (high is None or model.get(field) <= high))
+
+    @_changes
     def add_column(self, name: str, default_value: object=None) -> None:
         """Adds a column with the given name and default value"""
-        for entity in self.read():
+        self._ensure_connected()
+        for entity in self._live():
             if name in entity:
                 raise RuntimeWarning('column "{}" already exists'.format(name))
             entity[name] = default_value
+        self._journal({'op': 'add_column', 'name': name, 'value': default_value})
 
     @obsolete
+    @_changes
     def drop_column(self, name: str) -> None:
         """Drops a column with the given name"""
 
@@ -221,6 +961,7 @@ class CrudRepository(ListRepository):
         for entity in self.read():
             if name in entity:
                 del entity[name]
+        self._journal({'op': 'drop_column', 'name': name})
 
     def __pk_not_found(self, pk: str) -> None:
         """Raises a RecordNotFoundError for a primary key"""
@@ -228,7 +969,8 @@ class CrudRepository(ListRepository):
 
     def _ensure_exists(self, pk: str) -> None:
         """Ensures the given primary key exists"""
-        if isinstance(self.read(), list) and self.get(pk) is None:
+        self._ensure_connected()
+        if isinstance(self._db, list) and self.get(pk) is None:
             # get new model
             model = self.model()
             # set the ID of the model
@@ -238,12 +980,19 @@ class CrudRepository(ListRepository):
 
     def get(self, pk: str) -> _abc.Hashable:
         """Gets the model with the given primary key"""
+        if self._map():
+            return self._get_mapped(pk)
+
         self._ensure_connected()
 
         if pk in self.__index:
             return self.__index[pk]
 
-        model = self.read() \
+        if self._is_index_complete():
+            # every model is indexed, so there is nothing to scan for
+            return None
+
+        model = self._live() \
             .where(lambda a: a['id'] == pk) \
             .first_or_default()
 
@@ -258,26 +1007,52 @@ class CrudRepository(ListRepository):
 
     def _insert_model(self, model: _abc.Hashable) -> None:
         """Inserts this model into the repository and the index"""
-        # insert the model
-        self._db.append(model)
-        # insert the model into the index
-        self.__index[model['id']] = model
+        # locked inline rather than with @_changes on this hot path
+        with self._change_lock:
+            if id(model) in self.__deleted:
+                # the model was deleted and is being inserted again
+                self._compact_deleted()
+
+            # insert the model
+            self._db.append(model)
+            # insert the model into the index
+            self.__index[model['id']] = model
+            for index in self.__indexes.values():
+                index.add(model)
+            self._journal_insert(model)
+
+    @_changes
+    def _insert_models(self, models: list) -> None:
+        """Inserts these models into the repository and the indexes in bulk"""
+        if any(id(model) in self.__deleted for model in models):
+            # some of the models were deleted and are being inserted again
+            self._compact_deleted()
+
+        self._db.extend(models)
+        self.__index.update((model['id'], model) for model in models)
+        for index in self.__indexes.values():
+            index.add_range(models)
+        if self.__wal:
+            for model in models:
+                self._journal_insert(model)
+        elif models:
+            self._mark_changed()
+            self.__dirty.update(model['id'] for model in models)
 
     def _remove_model(self, model: _abc.Hashable) -> None:
-        """Removes this model from the repository and the index"""
-        # remove the model
-        try:
-            # try ordinary list removal
-            self._db.remove(model)
-        except ValueError:
-            # remove the model based on ID as object equality did not work
-            for i, j in enumerate(self._db):
-                if j['id'] == model['id']:
-                    del self._db[i]
-                    break
+        """
+        Removes this model from the repository and the index. The model
+        is marked as deleted and dropped from the database at the next
+        read, write or index build, so deleting is constant time.
 
-        # remove the model from the index
-        del self.__index[model['id']]
+        """
+        with self._change_lock:
+            # remove the stored model from the index
+            model = self.__index.pop(model['id'])
+            self.__deleted[id(model)] = model
+            for index in self.__indexes.values():
+                index.remove(model)
+            self._journal({'op': 'delete', 'id': model['id']})
 
     def insert(self, model: _abc.Hashable) -> None:
         """Inserts the given model into this repository"""
@@ -292,10 +1067,32 @@ class CrudRepository(ListRepository):
         # append the model
         self._insert_model(model)
 
-    def insert_range(self, models: _abc.Iterable) -> None:
-        """Inserts the given models into this repository"""
-        for model in models:
-            self.insert(model)
+    def insert_range(self, models: _abc.Iterable, atomic: bool=False) -> None:
+        """
+        Inserts the given models into this repository. The primary keys are
+        validated in one pass before the models are appended together. If a
+        key already exists, the models before it are inserted, or none of
+        them if atomic is True, and a RuntimeError is raised.
+
+        """
+        self._ensure_connected()
+        self._ensure_index_complete()
+
+        models = list(models)
+        batch = set()
+        error = None
+        for i, model in enumerate(models):
+            pk = model['id']
+            if pk in self.__index or pk in batch:
+                error = RuntimeError('A model with primary key "{}" already exists'.format(pk))
+                models = [] if atomic else models[:i]
+                break
+            batch.add(pk)
+
+        self._insert_models(models)
+
+        if error is not None:
+            raise error
 
     def delete(self, pk: str) -> None:
         """Deletes the given primary key from this repository"""
@@ -323,10 +1120,9 @@ class CrudRepository(ListRepository):
             self.__pk_not_found(pk)
             return
 
-        props = model.props if model.is_model_based else model.keys()
+        props = model.props if self.is_model_based else model.keys()
 
-        for attr in [prop for prop in props if prop != 'id']:
-            original[attr] = getattr(model, attr)
+        self._set_props(original, {prop: model[prop] for prop in props if prop != 'id'})
 
         print('{}: pk "{}" updated'.format(self.name, pk))
 
@@ -344,7 +1140,19 @@ class CrudRepository(ListRepository):
             self.__pk_not_found(pk)
             return
 
-        model[prop] = value
+        self._set_props(model, {prop: value})
+
+    def _set_props(self, model: _abc.Hashable, changes: dict) -> None:
+        """Sets the properties of the model and keeps the secondary indexes current"""
+        with self._change_lock:
+            indexes = [self.__indexes[prop] for prop in changes if prop in self.__indexes]
+            for index in indexes:
+                index.remove(model)
+            for prop, value in changes.items():
+                model[prop] = value
+            for index in indexes:
+                index.add(model)
+            self._journal({'op': 'update', 'id': model['id'], 'props': changes})
 
     def read(self, fetch_if_read: bool=False) -> IEnumerable:
         """
@@ -353,18 +1161,55 @@ class CrudRepository(ListRepository):
 
         """
         if not self.has_read or fetch_if_read:
-            super().read()
+            self._set_read(self._load())
 
-            # convert the database to an enumerable
-            self._db = _extend(self._db)
+        # callers get the database without deleted models, so compact on
+        # demand here while internal lookups use the live view instead
+        self._compact_deleted()
+        return self._db
 
-            if self.is_model_based:
-                self._db = self._db.select(lambda x: _json2model(x, self.model))
+    def _load(self) -> tuple:
+        """
+        Loads the snapshot and the write-ahead log with the stamp of the
+        files, or returns None if the database does not exist. Only the
+        files are touched, so loading can run in an executor.
 
-            self.build_index()
-            self._update_context()
+        """
+        if not self.exists():
+            return None
+        with self._lock(exclusive=False):
+            return load_snapshot(self.name), self._read_wal(), self._stamp()
+
+    @_changes
+    def _set_read(self, loaded: tuple, write: bool=True) -> None:
+        """Sets the database to the loaded records and indexes it, or creates it if loaded is None"""
+        # keep the models already decoded by a lazy read
+        decoded = self.__index if self.__mapped is not None else {}
+        self._unmap()
+
+        if loaded is None:
+            # creates the database
+            super()._set_read(None, write)
+        else:
+            db, entries, self.__stamp = loaded
+            super()._set_read(self._replay(db, entries))
+        self.__deleted = {}
+        self.clear_index()
 
-        return self._db
+        # convert the database to an enumerable
+        self._db = _extend(self._db)
+
+        if self.is_model_based and decoded:
+            models = iter(_json2models([x for x in self._db if x.get('id') not in decoded], self.model))
+            self._db = self._db.select(lambda x: decoded.get(x.get('id')) or next(models))
+        elif self.is_model_based:
+            with _gc_paused():
+                self._db = _extend(_json2models(self._db, self.model))
+        elif decoded:
+            self._db = self._db.select(lambda x: decoded.get(x.get('id'), x))
+
+        self.build_index()
+        self._update_context()
 
     def read_queryable(self, fetch_if_read: bool=False) -> Queryable:
         """
@@ -375,29 +1220,363 @@ class CrudRepository(ListRepository):
         return _query(self.read(fetch_if_read=fetch_if_read))
 
     def write(self, name: str=None) -> None:
-        """Writes this database to the disk"""
-        # create a copy of the repo
-        models = self._db.copy()
+        """
+        Writes this database to the disk. With the write-ahead log enabled,
+        only the changes since the last write are appended to the log
+        unless it is time to compact. Writes to this repository's own file
+        are deferred inside a batch or group commit.
+
+        """
+        if name is None and self._defer_write():
+            return
+        self._write_now(name)
+
+    def _write_now(self, name: str=None, compact: bool=False) -> None:
+        """Writes this database to the disk or to the given file"""
+        capture = self._capture_write(name, compact)
+        try:
+            self._persist_write(capture, name)
+        except BaseException:
+            self._restore_write(capture)
+            raise
+        self._update_context(capture[2])
+
+    @_changes
+    def _capture_write(self, name: str=None, compact: bool=False) -> tuple:
+        """
+        Captures what a write persists, so the files can be written while
+        the database keeps changing. Returns the queued change records, the
+        encoded database if a snapshot is written, and the context and
+        dirty primary keys covered by the write.
 
+        """
+        if self.__mapped is not None:
+            # never replace the file with the models decoded so far
+            self._ensure_connected()
+
+        if name is not None:
+            return [], self._encode_db(), None, set()
+
+        data = None
+        if compact or not self.__wal or not self.exists() or \
+                self.__wal_records + len(self.__wal_pending) > self.__wal_threshold:
+            data = self._encode_db()
+        # a snapshot covers the queued records as well
+        records, self.__wal_pending = self.__wal_pending, []
+        dirty, self.__dirty = self.__dirty, set()
+        return records, data, self._capture_context(), dirty
+
+    def _persist_write(self, capture: tuple, name: str=None) -> None:
+        """
+        Writes a captured write to the disk or to the given file. Only the
+        files are touched, so persisting can run in an executor.
+
+        """
+        records, data, _, _ = capture
+        with self._lock(exclusive=True):
+            if name is not None:
+                write_atomic(data, name)
+                print('{}: database written'.format(name))
+                return
+
+            self._check_stamp()
+            if data is None:
+                self._append_wal(records)
+            else:
+                write_atomic(data, self.name)
+                print('{}: database written'.format(self.name))
+                if self.__wal and _os.path.exists(self.wal_name):
+                    # the snapshot has folded the log in
+                    _os.remove(self.wal_name)
+                self.__wal_records = 0
+
+            self._write_version()
+            self.__stamp = self._stamp()
+
+    @_changes
+    def _restore_write(self, capture: tuple) -> None:
+        """Queues the changes of a captured write again after it failed"""
+        records, _, _, dirty = capture
+        self.__wal_pending[:0] = records
+        self.__dirty |= dirty
+
+    def _encode_db(self) -> bytes:
+        """Encodes the database without the deleted models"""
+        self._compact_deleted()
+
+        models = self._db
         # check if this repo is model-based
         # only convert if this database is not being created
         if self.has_read and self.is_model_based:
             # serialize the models
-            models = models.select(lambda x: x.to_json())
+            with _gc_paused():
+                models = _models2json(models)
 
-        filename = name or self.name
+        return encode_database(models, self.binary)
 
-        with open(filename, 'w') as fd:
-            _json.dump(models, fd)
+    def _get_async_lock(self) -> _asyncio.Lock:
+        """Returns the lock that runs the async reads and writes of this repository in order"""
+        loop = _asyncio.get_running_loop()
+        # a lock only works on the event loop it was first used on
+        if self.__async_lock is None or self.__async_lock[0] is not loop:
+            self.__async_lock = (loop, _asyncio.Lock())
+        return self.__async_lock[1]
 
-        print('{}: database written'.format(filename))
+    async def aread(self, fetch_if_read: bool=False, executor: object=None) -> IEnumerable:
+        """
+        Reads data from the disk into the database after any pending awrite
+        has flushed. The files are read in the executor, or the default
+        executor if None, and the database is set on the event loop.
 
-        self._update_context()
+        """
+        if self.__flush is not None:
+            await _asyncio.shield(self.__flush)
+        async with self._get_async_lock():
+            if not self.has_read or fetch_if_read:
+                loop = _asyncio.get_running_loop()
+                loaded = await loop.run_in_executor(executor, self._load)
+                self._set_read(loaded, write=False)
+                if loaded is None:
+                    # write the created database in the executor as well
+                    await self._awrite_now(executor)
+            return self.read()
+
+    async def awrite(self, debounce: float=0.05, executor: object=None) -> None:
+        """
+        Writes this database to the disk. The changes are captured on the
+        event loop and the files are written in the executor, or the default
+        executor if None. Calls within debounce seconds of the first one
+        are coalesced into a single write, and writes run in call order.
+
+        """
+        if self.__flush is None:
+            self.__flush = _asyncio.ensure_future(self._flush(debounce, executor))
+        await _asyncio.shield(self.__flush)
+
+    async def _flush(self, debounce: float, executor: object) -> None:
+        """Writes this database once the debounce window closes"""
+        await _asyncio.sleep(debounce)
+        # calls from now on start the next write, which waits for this one
+        self.__flush = None
+        async with self._get_async_lock():
+            if not self._defer_write():
+                await self._awrite_now(executor)
+
+    async def _awrite_now(self, executor: object) -> None:
+        """Captures the changes on the event loop and writes them in the executor"""
+        capture = self._capture_write()
+        loop = _asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(executor, self._persist_write, capture)
+        except BaseException:
+            self._restore_write(capture)
+            raise
+        # changes made while the files were written stay unwritten
+        self._update_context(capture[2])
+
+    @_contextlib.contextmanager
+    def _lock(self, exclusive: bool) -> _abc.Iterator:
+        """
+        Holds an advisory lock on the database, shared for reading and
+        exclusive for writing, against the other processes using it.
+        Locking is skipped where fcntl is not available.
+
+        """
+        if _fcntl is None or self.__locked:
+            # already held by this repository
+            yield
+            return
+
+        with open(self.lock_name, 'a') as fp:
+            _fcntl.flock(fp, _fcntl.LOCK_EX if exclusive else _fcntl.LOCK_SH)
+            self.__locked = True
+            try:
+                yield
+            finally:
+                self.__locked = False
+                _fcntl.flock(fp, _fcntl.LOCK_UN)
+
+    def _read_version(self) -> int:
+        """Returns the write counter stored in the lock file, or 0 if there is none"""
+        try:
+            with open(self.lock_name) as fp:
+                return int(fp.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_version(self) -> None:
+        """Increments the write counter stored in the lock file"""
+        version = self._read_version() + 1
+        with open(self.lock_name, 'w') as fp:
+            fp.write(str(version))
+
+    def _stamp(self) -> tuple:
+        """
+        Returns a version stamp of the database made of the write counter
+        that repositories keep in the lock file, and the stats of the
+        database and write-ahead log files for other writers
+
+        """
+        stamp = [self._read_version()]
+        for filename in (self.name, self.wal_name):
+            try:
+                stat = _os.stat(filename)
+                stamp.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _check_stamp(self) -> None:
+        """Raises a ConcurrencyError if the files changed since they were last read"""
+        if self.__stamp is not None and self.__stamp != self._stamp():
+            raise ConcurrencyError('{}: database was written by another process, '.format(self.name) +
+                'read it again with fetch_if_read=True and reapply the changes')
+
+    def _append_wal(self, records: list) -> None:
+        """
+        Appends the change records to the write-ahead log and syncs it
+        to the disk, so written records survive a power failure
+
+        """
+        if not records:
+            return
+        with open(self.wal_name, 'a') as fd:
+            fd.write('\n'.join(records) + '\n')
+            fd.flush()
+            _os.fsync(fd.fileno())
+        self.__wal_records += len(records)
+
+    def compact(self) -> None:
+        """
+        Folds the write-ahead log into a new snapshot of the database
+        and empties the log
+
+        """
+        if self.exists():
+            # never replace the snapshot with a database that was not read
+            self._ensure_connected()
+        self._write_now(compact=True)
+
+    def _unread_copy(self) -> 'CrudRepository':
+        """
+        Returns a repository of the same type over the same file with the
+        same settings and secondary indexes that has not been read
+
+        """
+        repo = type(self)(self.name)
+        repo.__model = self.__model
+        repo.__lazy = self.__lazy
+        repo.__wal = self.__wal
+        repo.__wal_threshold = self.__wal_threshold
+        repo.__indexes = {field: type(index)(field) for field, index in self.__indexes.items()}
+        repo.set_binary(self.binary)
+        return repo
+
+    @_changes
+    def mark_dirty(self, pk: str) -> None:
+        """
+        Marks the model with the given primary key as changed after it was
+        edited in place, so the next write persists it to the write-ahead log
+
+        """
+        model = self.get(pk)
+
+        if model is None:
+            self.__pk_not_found(pk)
+
+        self._journal_insert(model)
+
+    @property
+    def dirty(self) -> set:
+        """
+        Returns the primary keys inserted, updated or deleted since the
+        last read/write
+
+        """
+        return self.__dirty.copy()
+
+    def _map(self) -> bool:
+        """
+        Memory-maps the database and scans it for the offsets of its records
+        if reads are lazy and it has not been read. Returns True while the
+        database is mapped
+
+        """
+        if self.__mapped is not None:
+            return True
+        if not self.__lazy or self.has_read or not self.exists() or \
+                (self.__wal and _os.path.exists(self.wal_name)) or \
+                _os.path.getsize(self.name) == 0:
+            # the log has to be replayed over the whole database
+            return False
+
+        with open(self.name, 'rb') as fp:
+            mapped = _mmap.mmap(fp.fileno(), 0, access=_mmap.ACCESS_READ)
+        if mapped[:len(_SNAPSHOT_MAGIC)] == _SNAPSHOT_MAGIC:
+            # binary snapshots are loaded whole
+            mapped.close()
+            return False
+        self.__offsets = scan_records(mapped)
+        self.__mapped = mapped
+        return True
+
+    def _unmap(self) -> None:
+        """Closes the memory map of the database if there is one"""
+        if self.__mapped is not None:
+            self.__mapped.close()
+            self.__mapped = None
+            self.__offsets = {}
+
+    def _get_mapped(self, pk: str) -> _abc.Hashable:
+        """Gets the model with the given primary key, decoding it on first access"""
+        if pk in self.__index:
+            return self.__index[pk]
+
+        if pk not in self.__offsets:
+            return None
+
+        start, end = self.__offsets[pk]
+        model = _json.loads(self.__mapped[start:end])
+        if self.is_model_based:
+            model = _json2model(model, self.model)
+
+        self.__index[pk] = model
+        return model
+
+    def set_lazy(self, enabled: bool=True) -> None:
+        """
+        Enables or disables lazy reads for this repository. While enabled,
+        get on a repository that has not been read memory-maps the database,
+        indexes the byte offsets of its records and decodes only the records
+        it returns. Any other access reads the whole database as usual,
+        keeping the models already decoded.
+
+        """
+        if not enabled:
+            self._unmap()
+        self.__lazy = enabled
+
+    def set_wal(self, enabled: bool=True, compact_threshold: int=10000) -> None:
+        """
+        Enables or disables the write-ahead log for this repository. While
+        enabled, inserts, updates and deletes are recorded as compact change
+        records and write appends them to a log next to the database.
+        Reading replays the log over the snapshot, and the log is compacted
+        into the snapshot once it holds more than compact_threshold records.
+        Changes made to models outside of this repository's methods are only
+        persisted by compact unless they are marked with mark_dirty.
+
+        """
+        if self.__wal and not enabled:
+            # fold the log in before it stops being replayed
+            self.compact()
+        self.__wal = enabled
+        self.__wal_threshold = compact_threshold
 
     def set_model(self, model: _Model) -> None:
         """Sets the model type for this repository"""
-        if not issubclass(model, _Model):
-            raise TypeError('model must of base type clay.models.Model')
+        if not issubclass(model, (_Model, _SlottedModel)):
+            raise TypeError('model must of base type clay.models.Model or clay.models.SlottedModel')
         self.__model = model
 
     @property
@@ -405,6 +1584,16 @@ class CrudRepository(ListRepository):
         """Returns the model type for this repository"""
         return self.__model
 
+    @property
+    def lock_name(self) -> str:
+        """Returns the file name of the advisory lock for this repository"""
+        return self.name + '.lock'
+
+    @property
+    def wal_name(self) -> str:
+        """Returns the file name of the write-ahead log for this repository"""
+        return self.name + '.wal'
+
     @property
     def is_model_based(self) -> bool:
         """Returns True if this repository is model-based, False otherwise"""
@@ -432,14 +1621,655 @@ class UserRepository(CrudRepository):
         if modified:
             self.write()
 
+class _ShardScan:
+
+    """Models of the shards of a ShardedCrudRepository, read one shard at a time"""
+
+    def __init__(self, shards: list) -> None:
+        """Initializes this scan of the given shards"""
+        self.shards = shards
+
+    def __iter__(self) -> _abc.Iterator:
+        """Reads each shard as it is reached and yields its models in shard order"""
+        for shard in self.shards:
+            yield from shard.read()
+
+class ShardedCrudRepository(IRepository):
+
+    """
+    CRUD repository split across shard files by a stable hash of the
+    primary key. Each shard is a repository of shard_type with its own
+    index, so lookups and changes only read the shards they touch and
+    writes only rewrite the shards that changed or handed out models.
+
+    """
+
+    def __init__(self, name: str, shards: int=16, shard_type: type=CrudRepository) -> None:
+        """
+        Initializes this sharded repository. The shards of users.json
+        are named users.000.json, users.001.json and so on
+
+        """
+        if shards < 1:
+            raise ValueError('shards must be at least 1')
+        root, ext = _os.path.splitext(name)
+        self.__name = name
+        self.__shards = [shard_type('{}.{:03d}{}'.format(root, i, ext)) for i in range(shards)]
+        # shards whose models were handed out since the last write may be edited in place
+        self.__handed_out = set()
+
+    def shard_of(self, pk: str) -> int:
+        """Returns the number of the shard that holds the given primary key"""
+        return _zlib.crc32(str(pk).encode()) % len(self.__shards)
+
+    def _shard(self, pk: str) -> CrudRepository:
+        """Returns the shard that holds the given primary key"""
+        i = self.shard_of(pk)
+        self.__handed_out.add(i)
+        return self.__shards[i]
+
+    def get(self, pk: str) -> _abc.Hashable:
+        """Gets the model with the given primary key"""
+        return self._shard(pk).get(pk)
+
+    def create_if_not_exists(self, pk: str) -> None:
+        """Creates the given primary key if it does not exist"""
+        self._shard(pk).create_if_not_exists(pk)
+
+    def insert(self, model: _abc.Hashable) -> None:
+        """Inserts the given model into this repository"""
+        self._shard(model['id']).insert(model)
+
+    def insert_range(self, models: _abc.Iterable, atomic: bool=False) -> None:
+        """
+        Inserts the given models into their shards. If a key already exists,
+        the models before it are inserted, or none of them if atomic is True,
+        and a RuntimeError is raised.
+
+        """
+        models = list(models)
+        batch = set()
+        error = None
+        for i, model in enumerate(models):
+            pk = model['id']
+            if pk in batch or self.get(pk) is not None:
+                error = RuntimeError('A model with primary key "{}" already exists'.format(pk))
+                models = [] if atomic else models[:i]
+                break
+            batch.add(pk)
+
+        groups = {}
+        for model in models:
+            groups.setdefault(self.shard_of(model['id']), []).append(model)
+        for i, group in groups.items():
+            self.__handed_out.add(i)
+            self.__shards[i].insert_range(group)
+
+        if error is not None:
+            raise error
+
+    def delete(self, pk: str) -> None:
+        """Deletes the given primary key from this repository"""
+        self._shard(pk).delete(pk)
+
+    def update(self, model: _abc.Hashable) -> None:
+        """Updates the model by inferring the primary key"""
+        self._shard(model['id']).update(model)
+
+    def update_prop(self, pk: str, prop: str, value: object) -> None:
+        """
+        Updates the value of the property for the given primary
+        key within this repository
+
+        """
+        self._shard(pk).update_prop(pk, prop, value)
+
+    def find_by(self, field: str, value: object) -> IEnumerable:
+        """Returns the models whose field equals the value from every shard"""
+        if field == 'id':
+            return self._shard(value).find_by(field, value)
+        self.__handed_out.update(range(len(self.__shards)))
+        return _extend([model for shard in self.__shards for model in shard.find_by(field, value)])
+
+    def create_index(self, field: str, kind: str='hash') -> None:
+        """Creates a secondary index on the given field in every shard"""
+        for shard in self.__shards:
+            shard.create_index(field, kind)
+
+    def read(self, fetch_if_read: bool=False) -> IEnumerable:
+        """Reads every shard and returns all of the models"""
+        self.__handed_out.update(range(len(self.__shards)))
+        return _extend([model for shard in self.__shards for model in shard.read(fetch_if_read)])
+
+    def read_queryable(self, fetch_if_read: bool=False) -> Queryable:
+        """Returns a queryable over the models that reads each shard as it is reached"""
+        if fetch_if_read:
+            for shard in self.__shards:
+                shard.read(fetch_if_read=True)
+        self.__handed_out.update(range(len(self.__shards)))
+        return _query(_ShardScan(self.__shards), type(_extend([])))
+
+    def _is_clean(self, i: int) -> bool:
+        """
+        Returns True if the shard has no unwritten changes and handed out
+        no models that could have been edited in place since the last write
+
+        """
+        shard = self.__shards[i]
+        return i not in self.__handed_out and not (shard.has_read and shard.has_context_changed)
+
+    def write(self) -> None:
+        """Writes the shards that changed or handed out models since they were read or written"""
+        for i, shard in enumerate(self.__shards):
+            if not self._is_clean(i):
+                shard.write()
+        self.__handed_out = set()
+
+    def release(self) -> None:
+        """Drops the shards without unwritten changes from memory"""
+        for i, shard in enumerate(self.__shards):
+            if shard.has_read and self._is_clean(i):
+                self.__shards[i] = shard._unread_copy()
+
+    def set_model(self, model: _Model) -> None:
+        """Sets the model type for every shard"""
+        for shard in self.__shards:
+            shard.set_model(model)
+
+    @property
+    def name(self) -> str:
+        """The name of this repository"""
+        return self.__name
+
+    @property
+    def shards(self) -> list:
+        """Returns the shards of this repository"""
+        return self.__shards.copy()
+
+_FIELD_NAME = _re.compile(r'\w+')
+_SQL_TYPES = (str, int, float, type(None))
+
+class _UnsupportedPredicate(TypeError):
+    """Raised while compiling a predicate that cannot be expressed in SQL"""
+    pass
+
+class _Condition:
+
+    """SQL condition built by comparing fields of a probe record"""
+
+    def __init__(self, sql: str, params: tuple) -> None:
+        """Initializes this condition"""
+        self.sql = sql
+        self.params = params
+
+    def __and__(self, other: '_Condition') -> '_Condition':
+        """Returns the conjunction of this condition and other"""
+        if not isinstance(other, _Condition):
+            return NotImplemented
+        return _Condition('({} AND {})'.format(self.sql, other.sql), self.params + other.params)
+
+    def __or__(self, other: '_Condition') -> '_Condition':
+        """Returns the disjunction of this condition and other"""
+        if not isinstance(other, _Condition):
+            return NotImplemented
+        return _Condition('({} OR {})'.format(self.sql, other.sql), self.params + other.params)
+
+    def __invert__(self) -> '_Condition':
+        """Returns the negation of this condition"""
+        return _Condition('(NOT {})'.format(self.sql), self.params)
+
+    def __bool__(self) -> bool:
+        """Always raises because and, or, not and chained comparisons cannot be recorded"""
+        raise _UnsupportedPredicate('condition has no truth value')
+
+class _Field:
+
+    """Field of a probe record that turns comparisons with values into SQL"""
+
+    def __init__(self, name: str) -> None:
+        """Initializes this field, which must be a plain name"""
+        if not isinstance(name, str) or not _FIELD_NAME.fullmatch(name):
+            raise _UnsupportedPredicate('field {!r} is not a plain name'.format(name))
+        self.sql = 'id' if name == 'id' else "json_extract(data, '$.{}')".format(name)
+
+    def __compare(self, operator: str, value: object) -> _Condition:
+        """Returns the condition comparing this field to the value"""
+        if not isinstance(value, _SQL_TYPES):
+            return NotImplemented
+        if value is None and operator in ('=', '<>'):
+            return _Condition('{} IS {}NULL'.format(self.sql, '' if operator == '=' else 'NOT '), ())
+        if value is None:
+            raise _UnsupportedPredicate('None is not ordered')
+        if operator == '<>':
+            # None differs from every value, as it does in Python
+            return _Condition('({0} IS NULL OR {0} <> ?)'.format(self.sql), (value,))
+        return _Condition('{} {} ?'.format(self.sql, operator), (value,))
+
+    def __eq__(self, value: object) -> _Condition:
+        return self.__compare('=', value)
+
+    def __ne__(self, value: object) -> _Condition:
+        return self.__compare('<>', value)
+
+    def __lt__(self, value: object) -> _Condition:
+        return self.__compare('<', value)
+
+    def __le__(self, value: object) -> _Condition:
+        return self.__compare('<=', value)
+
+    def __gt__(self, value: object) -> _Condition:
+        return self.__compare('>', value)
+
+    def __ge__(self, value: object) -> _Condition:
+        return self.__compare('>=', value)
+
+    __hash__ = None
+
+class _Record:
+
+    """Probe record passed to predicates to record the fields they compare"""
+
+    def __getitem__(self, name: str) -> _Field:
+        return _Field(name)
+
+    def __getattr__(self, name: str) -> _Field:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return _Field(name)
+
+    def get(self, name: str, default: object=None) -> _Field:
+        if default is not None:
+            raise _UnsupportedPredicate('get with a default')
+        return _Field(name)
+
+def compile_predicate(predicate: _abc.Callable) -> _Condition:
+    """
+    Returns the SQL condition for a predicate that compares fields to
+    values, such as lambda x: x['age'] >= 18, combined with & | ~.
+    Returns None if the predicate does anything else. The predicate
+    is called once with a probe record.
+
+    """
+    try:
+        condition = predicate(_Record())
+    except Exception:
+        return None
+    return condition if isinstance(condition, _Condition) else None
+
+class _SqliteSource:
+
+    """Models of a SqliteCrudRepository selected by SQL conditions"""
+
+    def __init__(self, repo: 'SqliteCrudRepository', conditions: tuple=()) -> None:
+        """Initializes this source"""
+        self.repo = repo
+        self.conditions = conditions
+
+    def __iter__(self) -> _abc.Iterator:
+        """Selects the models matching all of the conditions"""
+        return self.repo._select(self.conditions)
+
+    def where(self, condition: _Condition) -> '_SqliteSource':
+        """Returns a new source that also requires the condition"""
+        return _SqliteSource(self.repo, self.conditions + (condition,))
+
+class SqliteQueryable(Queryable):
+
+    """
+    Queryable over a SqliteCrudRepository that pushes where predicates
+    comparing fields to values down to SQL until another operator is added
+
+    """
+
+    def __init__(self, repo: 'SqliteCrudRepository') -> None:
+        """Initializes this queryable over all models of the repository"""
+        super().__init__(_SqliteSource(repo), type(_extend([])))
+
+    def where(self, predicate: _abc.Callable) -> Queryable:
+        """Filters items based on the given predicate, in SQL where it can"""
+        if not self._plan:
+            condition = compile_predicate(predicate)
+            if condition is not None:
+                self._source = self._source.where(condition)
+                return self
+        return super().where(predicate)
+
+    @property
+    def sql(self) -> str:
+        """Returns the SQL condition pushed down so far"""
+        return ' AND '.join(condition.sql for condition in self._source.conditions)
+
+class SqliteCrudRepository(IRepository):
+
+    """
+    CRUD repository stored in a SQLite database with the same API as
+    CrudRepository. Each model is stored as JSON by its primary key.
+    Changes are made in a transaction that write commits, and models
+    edited in place after they were handed out since the last write are
+    saved by write as well.
+
+    """
+
+    def __init__(self, name: str) -> None:
+        """Initializes this SQLite CRUD repository under the given file name"""
+        self.__name = name
+        self.__model = object
+        self.__connection = None
+        # models read and the JSON they were last saved as
+        self.__models = {}
+        # primary keys of the models handed out since the last write
+        self.__handed_out = set()
+
+    def _ensure_connected(self) -> None:
+        """Ensures the database is open and has a table for the models"""
+        if self.__connection is None:
+            self.__connection = _sqlite3.connect(self.__name)
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS models (id PRIMARY KEY NOT NULL, data TEXT NOT NULL)')
+
+    def _serialize(self, model: _abc.Hashable) -> str:
+        """Returns the JSON text of the model"""
+        return _json.dumps(model.to_json() if hasattr(model, 'to_json') else dict(model))
+
+    def _decode(self, pk: str, data: str, fetch: bool=False) -> _abc.Hashable:
+        """
+        Returns the model for the JSON text, reusing the model already read
+        unless fetch is True or another writer has changed its text
+
+        """
+        cached = self.__models.get(pk)
+        if cached is not None and cached[1] == data and not fetch:
+            model = cached[0]
+        else:
+            record = _json.loads(data)
+            model = _json2model(record, self.model) if self.is_model_based else record
+            self.__models[pk] = (model, data)
+        self.__handed_out.add(pk)
+        return model
+
+    def _select(self, conditions: tuple=(), fetch: bool=False) -> _abc.Iterator:
+        """Selects the models matching all of the conditions in insertion order"""
+        self._ensure_connected()
+        sql = 'SELECT id, data FROM models'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(condition.sql for condition in conditions)
+        params = tuple(param for condition in conditions for param in condition.params)
+        for pk, data in self.__connection.execute(sql + ' ORDER BY rowid', params).fetchall():
+            yield self._decode(pk, data, fetch)
+
+    def exists(self) -> bool:
+        """Returns True if the database exists, False otherwise"""
+        return _os.path.exists(self.__name)
+
+    def clear(self) -> None:
+        """Deletes all models from this repository"""
+        self._ensure_connected()
+        self.__connection.execute('DELETE FROM models')
+        self.__models = {}
+        self.__handed_out = set()
+
+    def close(self) -> None:
+        """Closes the database without committing changes since the last write"""
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+            self.__models = {}
+            self.__handed_out = set()
+
+    def create_index(self, field: str, kind: str='hash') -> None:
+        """
+        Creates an index on the given field. Both kinds are B-tree
+        indexes in SQLite, which find equal values and ranges of values.
+
+        """
+        if kind not in INDEX_KINDS:
+            raise ValueError('kind must be in [{}]'.format(', '.join(INDEX_KINDS)))
+        column = _Field(field).sql
+        self._ensure_connected()
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS models_{0} ON models ({1})'.format(field, column))
+
+    def drop_index(self, field: str) -> None:
+        """Drops the index on the given field"""
+        _Field(field)
+        self._ensure_connected()
+        self.__connection.execute('DROP INDEX IF EXISTS models_{}'.format(field))
+
+    def find_by(self, field: str, value: object) -> IEnumerable:
+        """Returns the models whose field equals the value"""
+        return _extend(list(self._select((_Field(field) == value,))))
+
+    def find_range(self, field: str, low: object=None, high: object=None) -> IEnumerable:
+        """
+        Returns the models whose field is between low and high inclusive.
+        None leaves that side of the range open.
+
+        """
+        conditions = (_Condition(_Field(field).sql + ' IS NOT NULL', ()),)
+        if low is not None:
+            conditions += (_Field(field) >= low,)
+        if high is not None:
+            conditions += (_Field(field) <= high,)
+        return _extend(list(self._select(conditions)))
+
+    def __pk_not_found(self, pk: str) -> None:
+        """Raises a RecordNotFoundError for a primary key"""
+        raise RecordNotFoundError('{}: pk "{}" not found'.format(self.name, pk))
+
+    def _ensure_exists(self, pk: str) -> None:
+        """Ensures the given primary key exists"""
+        if self.get(pk) is None:
+            model = self.model() if self.is_model_based else {}
+            model['id'] = pk
+            self.insert(model)
+
+    def create_if_not_exists(self, pk: str) -> None:
+        """Creates the given primary key if it does not exist"""
+        self._ensure_exists(pk)
+
+    def get(self, pk: str) -> _abc.Hashable:
+        """Gets the model with the given primary key"""
+        if pk in self.__models:
+            self.__handed_out.add(pk)
+            return self.__models[pk][0]
+
+        self._ensure_connected()
+        row = self.__connection.execute('SELECT data FROM models WHERE id = ?', (pk,)).fetchone()
+        return None if row is None else self._decode(pk, row[0])
+
+    def insert(self, model: _abc.Hashable) -> None:
+        """Inserts the given model into this repository"""
+        self.insert_range([model], atomic=True)
+
+    def insert_range(self, models: _abc.Iterable, atomic: bool=False) -> None:
+        """
+        Inserts the given models into this repository. If a key already
+        exists, the models before it are inserted, or none of them if
+        atomic is True, and a RuntimeError is raised.
+
+        """
+        self._ensure_connected()
+
+        models = list(models)
+        batch = set()
+        for model in models:
+            if model['id'] in batch:
+                break
+            batch.add(model['id'])
+
+        # look up the keys of the batch in chunks below the parameter limit
+        keys = list(batch)
+        existing = set()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            existing.update(row[0] for row in self.__connection.execute(
+                'SELECT id FROM models WHERE id IN ({})'.format(', '.join('?' * len(chunk))), chunk))
+
+        error = None
+        for i, model in enumerate(models):
+            # the batch holds the keys before the first repeated one
+            if model['id'] in existing or i == len(batch):
+                error = RuntimeError('A model with primary key "{}" already exists'.format(model['id']))
+                models = [] if atomic else models[:i]
+                break
+
+        rows = [(model['id'], self._serialize(model)) for model in models]
+        self.__connection.executemany('INSERT INTO models (id, data) VALUES (?, ?)', rows)
+        for model, (pk, data) in zip(models, rows):
+            self.__models[pk] = (model, data)
+        self.__handed_out.update(pk for pk, _ in rows)
+
+        if error is not None:
+            raise error
+
+    def delete(self, pk: str) -> None:
+        """Deletes the given primary key from this repository"""
+        self._ensure_connected()
+
+        if self.__connection.execute('DELETE FROM models WHERE id = ?', (pk,)).rowcount:
+            self.__models.pop(pk, None)
+            self.__handed_out.discard(pk)
+            print('{}: pk "{}" deleted'.format(self.name, pk))
+        else:
+            self.__pk_not_found(pk)
+
+    def update(self, model: _abc.Hashable) -> None:
+        """Updates the model by inferring the primary key"""
+        pk = model['id']
+
+        self._ensure_exists(pk)
+
+        props = model.props if self.is_model_based else model.keys()
+
+        self._set_props(self.get(pk), {prop: model[prop] for prop in props if prop != 'id'})
+
+        print('{}: pk "{}" updated'.format(self.name, pk))
+
+    def update_prop(self, pk: str, prop: str, value: object) -> None:
+        """
+        Updates the value of the property for the given primary
+        key within this repository
+
+        """
+        self._ensure_exists(pk)
+
+        self._set_props(self.get(pk), {prop: value})
+
+    def _set_props(self, model: _abc.Hashable, changes: dict) -> None:
+        """Sets the properties of the model and saves it"""
+        for prop, value in changes.items():
+            model[prop] = value
+        data = self._serialize(model)
+        self.__connection.execute('UPDATE models SET data = ? WHERE id = ?', (data, model['id']))
+        self.__models[model['id']] = (model, data)
+
+    def read(self, fetch_if_read: bool=False) -> IEnumerable:
+        """
+        Reads all models from the database. Models changed by other writers
+        are decoded again, and with fetch_if_read every model is, dropping
+        edits made in place that were not written
+
+        """
+        return _extend(list(self._select(fetch=fetch_if_read)))
+
+    def read_queryable(self, fetch_if_read: bool=False) -> Queryable:
+        """
+        Returns a queryable over the models that evaluates where predicates
+        comparing fields to values in SQL
+
+        """
+        return SqliteQueryable(self)
+
+    def write(self) -> None:
+        """
+        Saves the models handed out since the last write that were edited
+        in place and commits the changes to the disk
+
+        """
+        self._ensure_connected()
+
+        for pk in self.__handed_out:
+            model, data = self.__models[pk]
+            edited = self._serialize(model)
+            if edited != data:
+                self.__connection.execute('UPDATE models SET data = ? WHERE id = ?', (edited, pk))
+                self.__models[pk] = (model, edited)
+        self.__handed_out = set()
+
+        self.__connection.commit()
+
+        print('{}: database written'.format(self.name))
+
+    def set_model(self, model: _Model) -> None:
+        """Sets the model type for this repository"""
+        if not issubclass(model, (_Model, _SlottedModel)):
+            raise TypeError('model must of base type clay.models.Model or clay.models.SlottedModel')
+        self.__model = model
+
+    @property
+    def model(self) -> _Model:
+        """Returns the model type for this repository"""
+        return self.__model
+
+    @property
+    def name(self) -> str:
+        """The name of this repository"""
+        return self.__name
+
+    @property
+    def is_model_based(self) -> bool:
+        """Returns True if this repository is model-based, False otherwise"""
+        return self.model != object
+
+class BloomFilter(object):
+
+    """
+    Probabilistic set of hashable items with no false negatives, sized
+    for the given items and false positive rate
+
+    """
+
+    def __init__(self, items: _abc.Collection, error_rate: float=0.01) -> None:
+        """Initializes this bloom filter with the given items"""
+        count = max(len(items), 1)
+        self.__size = max(8, int(-count * _math.log(error_rate) / _math.log(2) ** 2))
+        self.__hashes = max(1, round(self.__size / count * _math.log(2)))
+        self.__bits = bytearray((self.__size + 7) // 8)
+        for item in items:
+            self.add(item)
+
+    def __positions(self, item: _abc.Hashable) -> _abc.Iterator:
+        """Returns the bit positions of the item by double hashing"""
+        first = hash(item)
+        second = hash((item, self.__size)) | 1
+        return ((first + i * second) % self.__size for i in range(self.__hashes))
+
+    def __contains__(self, item: _abc.Hashable) -> bool:
+        """Returns False if the item was not added, True if it probably was"""
+        bits = self.__bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(item))
+
+    def add(self, item: _abc.Hashable) -> None:
+        """Adds the item to this bloom filter"""
+        for position in self.__positions(item):
+            self.__bits[position >> 3] |= 1 << (position & 7)
+
 class UserWhitelist(object):
 
     """Used to whilelist users for secret access"""
 
-    def __init__(self, file: _abc.Iterable) -> None:
-        """Initializes this user whitelist"""
+    def __init__(self, file: _abc.Iterable, bloom: bool=False) -> None:
+        """
+        Initializes this user whitelist from the lines of the given file,
+        which is an iterable of lines or a path. With bloom set, lookups
+        are checked against a bloom filter before the set of users.
+
+        """
         self.__file = file
-        self.__users = []
+        self.__bloom = bloom
+        # the users in file order, the set of users and the bloom filter,
+        # replaced together so readers never see a partial reload
+        self.__state = ([], frozenset(), None)
+        self.__watch = None
 
     def get_file(self) -> _abc.Iterable:
         """Returns the file for this whitelist"""
@@ -447,7 +2277,7 @@ class UserWhitelist(object):
 
     def get_users(self) -> list:
         """Returns the users in this whitelist"""
-        return self.__users
+        return self.__state[0]
 
     def is_authorized(self, user: str) -> bool:
         """
@@ -455,15 +2285,77 @@ class UserWhitelist(object):
         by this whitelist, False otherwise
 
         """
-        return user in self.__users
+        _, lookup, bloom = self.__state
+        if bloom is not None and user not in bloom:
+            return False
+        return user in lookup
 
     def read(self) -> None:
         """Reads data from the disk into the database"""
-        users = []
-        for line in self.__file:
-            if not(line.startswith('#')):
-                users.append(line.strip())
-        self.__users = users
+        if isinstance(self.__file, str):
+            with open(self.__file) as fp:
+                users = [line.strip() for line in fp if not line.startswith('#')]
+        else:
+            users = [line.strip() for line in self.__file if not line.startswith('#')]
+        lookup = frozenset(users)
+        bloom = BloomFilter(lookup) if self.__bloom else None
+        self.__state = (users, lookup, bloom)
+
+    def watch(self, interval: float=1.0) -> None:
+        """
+        Starts a background thread that reads the file again whenever its
+        modification time changes, checking every interval seconds. Lookups
+        keep using the previous users until the new ones are swapped in.
+
+        """
+        if not isinstance(self.__file, str):
+            raise TypeError('file must be a path to be watched')
+        if self.__watch is not None:
+            raise RuntimeError('whitelist is already being watched')
+
+        # imported here because clay.files depends on clay.libr
+        from clay.files.core import ContentWatcher
+        watcher = ContentWatcher(self.__file)
+        if watcher.is_modified():
+            self.read()
+
+        stop = _threading.Event()
+        thread = _threading.Thread(target=self._watch, args=(watcher, interval, stop),
+            name='whitelist:' + self.__file, daemon=True)
+        self.__watch = (thread, stop)
+        thread.start()
+
+    def _watch(self, watcher: object, interval: float, stop: _threading.Event) -> None:
+        """
+        Reads the file whenever it is modified until stopped, keeping the
+        previous users while the file is missing or cannot be read
+
+        """
+        while not stop.wait(interval):
+            try:
+                # stat quietly, since the watcher reports missing files
+                mtime = _os.stat(watcher.filename).st_mtime
+            except OSError:
+                continue
+            if mtime == watcher.mtime:
+                continue
+            try:
+                self.read()
+            except OSError:
+                # the file is being replaced, so try again next time
+                continue
+            except Exception as ex:
+                # only try again once the file is modified again
+                print('{}: could not reload the whitelist: {!r}'.format(watcher.filename, ex))
+            watcher.mtime = mtime
+
+    def stop_watching(self) -> None:
+        """Stops watching the file for changes"""
+        if self.__watch is not None:
+            thread, stop = self.__watch
+            stop.set()
+            thread.join()
+            self.__watch = None
 
     file: _abc.Iterable = property(get_file)
     users: list = property(get_users)
@@ -538,3 +2430,740 @@ if __name__ == '__main__':
     testif('whitelist reads correct users', whitelist.users, ['abe', 'bob', 'caty'])
     testif('whitelist authorizes caty', whitelist.is_authorized('caty'), True)
     testif('whitelist rejects becky', whitelist.is_authorized('becky'), False)
+
+    bloom_filter = BloomFilter([str(i) for i in range(1000)])
+    testif('bloom filter has no false negatives',
+        all(str(i) in bloom_filter for i in range(1000)),
+        True,
+        name=qualify(BloomFilter))
+    testif('bloom filter keeps false positives near the error rate',
+        sum(str(i) in bloom_filter for i in range(1000, 11000)) < 200,
+        True,
+        name=qualify(BloomFilter))
+
+    def user_whitelist_watch_test():
+        test_whitelist_name = r'test_files\test-whitelist.txt'
+        with open(test_whitelist_name, 'w') as fp:
+            fp.write('abe\nbob\n')
+        whitelist = UserWhitelist(test_whitelist_name, bloom=True)
+        whitelist.watch(interval=0.01)
+        before = whitelist.is_authorized('caty')
+        with open(test_whitelist_name, 'w') as fp:
+            fp.write('abe\ncaty\n')
+        _os.utime(test_whitelist_name, (0, 1))
+        import time
+        deadline = time.monotonic() + 5
+        while not whitelist.is_authorized('caty') and time.monotonic() < deadline:
+            time.sleep(0.01)
+        whitelist.stop_watching()
+        _os.remove(test_whitelist_name)
+        return before, whitelist.is_authorized('caty'), whitelist.is_authorized('bob')
+
+    testif('whitelist reloads the file when it is modified',
+        user_whitelist_watch_test(),
+        (False, True, False),
+        name=qualify(UserWhitelist.watch))
+
+    def user_whitelist_watch_errors_test():
+        import io, time
+        test_whitelist_name = r'test_files\test-whitelist.txt'
+        with open(test_whitelist_name, 'w') as fp:
+            fp.write('abe\n')
+        whitelist = UserWhitelist(test_whitelist_name)
+        whitelist.watch(interval=0.01)
+        output = io.StringIO()
+        with _contextlib.redirect_stdout(output):
+            _os.remove(test_whitelist_name)
+            time.sleep(0.1)
+            def invalid():
+                whitelist.read = read
+                raise ValueError('invalid whitelist')
+            read, whitelist.read = whitelist.read, invalid
+            with open(test_whitelist_name, 'w') as fp:
+                fp.write('caty\n')
+            time.sleep(0.1)
+            missing_or_invalid = whitelist.is_authorized('abe')
+            with open(test_whitelist_name, 'w') as fp:
+                fp.write('bob\n')
+            _os.utime(test_whitelist_name, (0, 1))
+            deadline = time.monotonic() + 5
+            while not whitelist.is_authorized('bob') and time.monotonic() < deadline:
+                time.sleep(0.01)
+        whitelist.stop_watching()
+        _os.remove(test_whitelist_name)
+        return missing_or_invalid, whitelist.is_authorized('bob'), \
+            'does not exist' in output.getvalue(), output.getvalue().count('could not reload')
+
+    testif('whitelist keeps the last users while the file is missing or invalid',
+        user_whitelist_watch_errors_test(),
+        (True, True, False, 1),
+        name=qualify(UserWhitelist.watch))
+
+    test_wal_name = r'test_files\test-wal-repo.json'
+
+    def crud_repository_wal_test():
+        repo = CrudRepository(test_wal_name)
+        repo.set_wal(compact_threshold=5)
+        repo.create(force=True)
+        repo.read()
+        repo.insert({'id': 'a', 'n': 1})
+        repo.insert({'id': 'b', 'n': 2})
+        repo.write()
+        snapshot_size = _os.path.getsize(test_wal_name)
+        repo.update_prop('a', 'n', 10)
+        repo.delete('b')
+        repo.write()
+        return snapshot_size == _os.path.getsize(test_wal_name)
+
+    testif('appends changes without rewriting the snapshot',
+        crud_repository_wal_test(),
+        True,
+        name=qualify(CrudRepository.write))
+
+    def crud_repository_wal_replay_test():
+        # simulate a torn append at the end of the log
+        with open(test_wal_name + '.wal', 'a') as fp:
+            fp.write('{"op": "ins')
+        repo = CrudRepository(test_wal_name)
+        repo.set_wal()
+        return list(repo.read())
+
+    testif('replays the log over the snapshot',
+        crud_repository_wal_replay_test(),
+        [{'id': 'a', 'n': 10}],
+        name=qualify(CrudRepository.read))
+
+    def crud_repository_wal_compact_test():
+        repo = CrudRepository(test_wal_name)
+        repo.set_wal(compact_threshold=5)
+        repo.read()
+        for i in range(4):
+            repo.insert({'id': str(i)})
+        repo.write()
+        with open(test_wal_name) as fp:
+            snapshot = _json.load(fp)
+        return len(snapshot), _os.path.exists(test_wal_name + '.wal')
+
+    testif('folds the log into the snapshot past the threshold',
+        crud_repository_wal_compact_test(),
+        (5, False),
+        name=qualify(CrudRepository.compact))
+
+    def crud_repository_wal_torn_test():
+        repo = CrudRepository(test_wal_name)
+        repo.set_wal()
+        repo.create(force=True)
+        repo.insert({'id': '1'})
+        repo.write()
+        repo.insert({'id': '2'})
+        repo.write()
+        with open(repo.wal_name, 'a') as fp:
+            fp.write('{"op": "ins')
+        repo = CrudRepository(test_wal_name)
+        repo.set_wal()
+        repo.insert({'id': '3'})
+        repo.write()
+        repo = CrudRepository(test_wal_name)
+        repo.set_wal()
+        return [x['id'] for x in repo.read()]
+
+    testif('truncates a torn append so later appends are replayed',
+        crud_repository_wal_torn_test(),
+        ['1', '2', '3'],
+        name=qualify(CrudRepository.write))
+
+
+    def crud_repository_index_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        repo.create_index('team')
+        repo.create_index('age', 'sorted')
+        for pk, team, age in (('a', 'red', 30), ('b', 'blue', 25), ('c', 'red', 41)):
+            repo.insert({'id': pk, 'team': team, 'age': age})
+        repo.update_prop('a', 'team', 'blue')
+        repo.delete('b')
+        return [x['id'] for x in repo.find_by('team', 'blue')], \
+            [x['id'] for x in repo.find_by('team', 'red')], \
+            [x['id'] for x in repo.find_range('age', 26, 45)]
+
+    testif('keeps secondary indexes current',
+        crud_repository_index_test(),
+        (['a'], ['c'], ['a', 'c']),
+        name=qualify(CrudRepository.find_by))
+    def sorted_index_add_range_test():
+        index = SortedIndex('n')
+        for model in ({'id': 'a', 'n': 2}, {'id': 'b', 'n': 5}):
+            index.add(model)
+        index.add_range([{'id': 'c', 'n': 5}, {'id': 'd'}, {'id': 'e', 'n': 1}, {'id': 'f', 'n': 2}])
+        return [model['id'] for model in index.range()]
+
+    testif('merges the models after equal values in one pass',
+        sorted_index_add_range_test(),
+        ['e', 'a', 'f', 'b', 'c'],
+        name=qualify(SortedIndex.add_range))
+    testraises('invalid index kind',
+        lambda: CrudRepository(test_wal_name).create_index('team', 'btree'),
+        ValueError,
+        name=qualify(CrudRepository.create_index))
+
+    def crud_repository_delete_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        models = [{'id': str(i)} for i in range(6)]
+        for model in models:
+            repo.insert(model)
+        # delete adjacent models while iterating, as prune does
+        for model in repo.read():
+            if model['id'] in ('1', '2', '4'):
+                repo.delete(model['id'])
+        repo.insert(models[2])
+        return [x['id'] for x in repo.read()], repo.get('4')
+
+    testif('deletes models while iterating and reinserts them',
+        crud_repository_delete_test(),
+        (['0', '3', '5', '2'], None),
+        name=qualify(CrudRepository.delete))
+
+    def crud_repository_delete_update_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        repo.insert_range({'id': str(i), 'n': i} for i in range(4))
+        compactions = []
+        compact = repo._compact_deleted
+        repo._compact_deleted = lambda: compactions.append(1) or compact()
+        repo.delete('1')
+        repo.update_prop('2', 'n', 20)
+        repo.insert({'id': '1'})
+        found = [x['id'] for x in repo.find_by('n', 20)], repo.get('1')['id']
+        updated = len(compactions)
+        return updated, found, [x['id'] for x in repo.read()], len(compactions)
+
+    testif('updates after a delete without compacting the database',
+        crud_repository_delete_update_test(),
+        (0, (['2'], '1'), ['0', '2', '3', '1'], 1),
+        name=qualify(CrudRepository.delete))
+
+    def crud_repository_insert_range_test(atomic):
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        repo.insert({'id': 'c'})
+        try:
+            repo.insert_range([{'id': 'a'}, {'id': 'b'}, {'id': 'a'}, {'id': 'd'}], atomic=atomic)
+        except RuntimeError:
+            pass
+        return [x['id'] for x in repo.read()], repo.get('b') is not None
+
+    testif('inserts models before a duplicate key',
+        crud_repository_insert_range_test(False),
+        (['c', 'a', 'b'], True),
+        name=qualify(CrudRepository.insert_range))
+    testif('inserts no models from an atomic batch with a duplicate key',
+        crud_repository_insert_range_test(True),
+        (['c'], False),
+        name=qualify(CrudRepository.insert_range))
+
+    testif('scans record offsets without decoding',
+        scan_records(b'[{"n": "\\"id\\": 1", "id": "a"}, {"m": {"id": 0}, "id": 2}, {"n": 1}]'),
+        {'a': (1, 30), 2: (32, 57)})
+    testif('scans records nested more than two levels deep',
+        scan_records(b'[{"m": {"n": {"id": 0}}, "id": 3}, {"id": 4} ]'),
+        {3: (1, 33), 4: (35, 44)})
+    testif('scans an empty array', scan_records(b' [ ] '), {})
+    testif('scans ids that are numbers or null',
+        scan_records(b'[{"id": -1.5e3, "n": 2}, {"id" : null}, {"n": "id", "id": "b"}]'),
+        {-1500.0: (1, 23), 'b': (40, 62)})
+    testif('patterns avoid syntax that needs Python 3.11',
+        any(token in pattern.pattern for pattern in (_ENTRY, _SPACE, _TOKEN)
+            for token in (b'++', b'*+', b'?+', b'(?>')),
+        False,
+        name=qualify(scan_records))
+    testraises('not an array of records',
+        lambda: scan_records(b'{"id": 1}'),
+        ValueError,
+        name=qualify(scan_records))
+
+    def crud_repository_lazy_test():
+        with open(test_wal_name, 'w') as fp:
+            _json.dump([{'id': 'a', 'n': 1}, {'id': 'b', 'tags': ['x', '}']}], fp)
+        repo = CrudRepository(test_wal_name)
+        repo.set_lazy()
+        model = repo.get('b')
+        missing = repo.get('c')
+        has_read = repo.has_read
+        return model, missing, has_read, repo.read()[1] is model
+
+    testif('decodes only the accessed record',
+        crud_repository_lazy_test(),
+        ({'id': 'b', 'tags': ['x', '}']}, None, False, True),
+        name=qualify(CrudRepository.set_lazy))
+
+    def list_repository_context_test(repo_type):
+        repo = repo_type(test_wal_name)
+        repo.create(force=True)
+        repo.read()
+        unchanged = repo.has_context_changed
+        repo.db.append({'id': 'a'})
+        appended = repo.has_context_changed
+        repo.write()
+        return unchanged, appended, repo.has_context_changed
+
+    testif('catches changes made to the database directly',
+        list_repository_context_test(ListRepository),
+        (False, True, False),
+        name='BaseRepository.has_context_changed')
+
+    def list_repository_in_place_test():
+        repo = ListRepository(test_wal_name)
+        repo.create(force=True)
+        repo.db.append(0)
+        repo.write()
+        repo.db[0] = 1
+        edited = repo.has_context_changed
+        repo.db = repo.db
+        return edited, repo.has_context_changed
+
+    testif('catches items edited in place once db is set again',
+        list_repository_in_place_test(),
+        (False, True),
+        name='BaseRepository.has_context_changed')
+    testif('catches models appended to the database directly',
+        list_repository_context_test(CrudRepository),
+        (False, True, False),
+        name='BaseRepository.has_context_changed')
+
+    def crud_repository_dirty_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        repo.insert_range([{'id': 'a', 'n': 1}, {'id': 'b', 'n': 2}])
+        repo.write()
+        unchanged = repo.has_context_changed, repo.dirty
+        repo.update_prop('a', 'n', 3)
+        repo.delete('b')
+        return unchanged, (repo.has_context_changed, repo.dirty)
+
+    testif('tracks the primary keys changed since the last write',
+        crud_repository_dirty_test(),
+        ((False, set()), (True, {'a', 'b'})),
+        name='CrudRepository.dirty')
+
+    def crud_repository_insert_serialize_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        serialized = []
+        repo._serialize = lambda model: serialized.append(model['id']) or dict(model)
+        repo.insert({'id': 'a'})
+        repo.set_wal()
+        repo.insert({'id': 'b'})
+        return serialized
+
+    testif('serializes inserted models only for the write-ahead log',
+        crud_repository_insert_serialize_test(),
+        ['b'],
+        name=qualify(CrudRepository.insert))
+
+    def crud_repository_mark_dirty_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        repo.set_wal()
+        repo.insert({'id': 'a', 'n': 1})
+        repo.write()
+        repo.get('a')['n'] = 2
+        repo.mark_dirty('a')
+        repo.write()
+        repo = CrudRepository(test_wal_name)
+        repo.set_wal()
+        return repo.get('a')['n']
+
+    testif('persists models marked dirty to the log',
+        crud_repository_mark_dirty_test(),
+        2,
+        name=qualify(CrudRepository.mark_dirty))
+
+    def crud_repository_concurrency_test():
+        first = CrudRepository(test_wal_name)
+        first.create(force=True)
+        first.insert({'id': 'a', 'n': 1})
+        first.write()
+        second = CrudRepository(test_wal_name)
+        second.update_prop('a', 'n', 2)
+        second.write()
+        first.update_prop('a', 'n', 3)
+        first.write()
+
+    testraises('lost update from another writer',
+        crud_repository_concurrency_test,
+        ConcurrencyError,
+        name=qualify(CrudRepository.write))
+
+    def crud_repository_version_test():
+        first = CrudRepository(test_wal_name)
+        first.create(force=True)
+        first.write()
+        second = CrudRepository(test_wal_name)
+        second.read()
+        # the stats of the file match, as on a file system with coarse times
+        first._stamp = lambda: second._stamp()[:1] + first._CrudRepository__stamp[1:]
+        second.write()
+        first.write()
+
+    testraises('another writer leaves the file stats unchanged',
+        crud_repository_version_test,
+        ConcurrencyError,
+        name=qualify(CrudRepository.write))
+
+    def dump_atomic_mode_test():
+        _os.chmod(test_wal_name, 0o640)
+        dump_atomic([], test_wal_name)
+        kept = _stat.S_IMODE(_os.stat(test_wal_name).st_mode)
+        _os.remove(test_wal_name)
+        dump_atomic([], test_wal_name)
+        return kept, _stat.S_IMODE(_os.stat(test_wal_name).st_mode)
+
+    testif('keeps the mode of the file or uses the default mode',
+        dump_atomic_mode_test(),
+        (0o640, 0o666 & ~_UMASK),
+        name=qualify(dump_atomic))
+
+    testif('leaves no temporary files',
+        [x for x in _os.listdir('.') if x.endswith('.tmp')],
+        [])
+
+    testif('round-trips records through a binary snapshot',
+        decode_snapshot(encode_snapshot([{'id': 'a', 'n': 1}, {'id': 'b', 'n': None}, {'id': 'c'}, [1]])),
+        [{'id': 'a', 'n': 1}, {'id': 'b', 'n': None}, {'id': 'c'}, [1]],
+        name=qualify(encode_snapshot))
+
+    testraises('values that are not JSON types',
+        lambda: encode_snapshot([{'id': 'a', 'tags': {'x': ('y',)}}]),
+        ValueError,
+        name=qualify(encode_snapshot))
+    testraises('dict keys that are not strings',
+        lambda: encode_snapshot([{'id': 'a', 'n': {1: 'one'}}]),
+        ValueError,
+        name=qualify(encode_snapshot))
+    testif('reads snapshots of older marshal versions',
+        decode_snapshot(_SNAPSHOT_FORMAT + bytes([2]) + _marshal.dumps((None, [1], None), 2)),
+        [1],
+        name=qualify(decode_snapshot))
+
+    def crud_repository_binary_fallback_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        repo.set_binary()
+        repo.insert({'id': 'a', 'tags': ('x',), 'n': {1: 'one'}})
+        repo.write()
+        return CrudRepository(test_wal_name).read()
+
+    testif('falls back to JSON for values that are not JSON types',
+        crud_repository_binary_fallback_test(),
+        [{'id': 'a', 'tags': ['x'], 'n': {'1': 'one'}}],
+        name=qualify(CrudRepository.set_binary))
+
+    def crud_repository_binary_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        repo.insert_range([{'id': 'a', 'n': 1.5}, {'id': 'b', 'n': 2}])
+        repo.insert_range([{'id': str(i), 'n': i} for i in range(20)])
+        repo.write()
+        json_size = _os.path.getsize(test_wal_name)
+        repo.set_binary()
+        repo.write()
+        with open(test_wal_name, 'rb') as fp:
+            magic = fp.read(8)
+        return magic, list(CrudRepository(test_wal_name).read())[:2], json_size > _os.path.getsize(test_wal_name)
+
+    testif('writes and reads binary snapshots',
+        crud_repository_binary_test(),
+        (b'CLAYSNAP', [{'id': 'a', 'n': 1.5}, {'id': 'b', 'n': 2}], True),
+        name=qualify(CrudRepository.set_binary))
+
+    def crud_repository_async_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        writes = []
+
+        def persist(capture, name=None):
+            writes.append(len(_json.loads(capture[1])))
+            CrudRepository._persist_write(repo, capture, name)
+
+        repo._persist_write = persist
+
+        async def run():
+            for i in range(5):
+                repo.insert({'id': str(i)})
+            await _asyncio.gather(*(repo.awrite() for _ in range(10)))
+            repo.insert({'id': '5'})
+            await repo.awrite(debounce=0)
+            return [x['id'] for x in await repo.aread(fetch_if_read=True)]
+
+        return _asyncio.run(run()), writes
+
+    testif('coalesces async writes and keeps them in order',
+        crud_repository_async_test(),
+        (['0', '1', '2', '3', '4', '5'], [5, 6]),
+        name=qualify(CrudRepository.awrite))
+
+    def crud_repository_async_capture_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        started = _threading.Event()
+        resume = _threading.Event()
+        threads = []
+
+        def persist(capture, name=None):
+            started.set()
+            resume.wait()
+            CrudRepository._persist_write(repo, capture, name)
+
+        def set_read(loaded, write=True):
+            threads.append(_threading.current_thread() is _threading.main_thread())
+            CrudRepository._set_read(repo, loaded, write)
+
+        repo._persist_write = persist
+        repo._set_read = set_read
+
+        async def run():
+            repo.insert({'id': '0'})
+            write = _asyncio.ensure_future(repo.awrite(debounce=0))
+            await _asyncio.get_running_loop().run_in_executor(None, started.wait)
+            # changed while the captured write is in the executor
+            repo.insert({'id': '1'})
+            resume.set()
+            await write
+            written = [x['id'] for x in load_snapshot(repo.name)]
+            changed = (repo.has_context_changed, repo.dirty)
+            await repo.awrite(debounce=0)
+            await repo.aread(fetch_if_read=True)
+            return written, changed, [x['id'] for x in load_snapshot(repo.name)], threads
+
+        return _asyncio.run(run())
+
+    testif('writes the changes captured on the event loop and keeps later changes dirty',
+        crud_repository_async_capture_test(),
+        (['0'], (True, {'1'}), ['0', '1'], [True, True]),
+        name=qualify(CrudRepository.awrite))
+
+    def crud_repository_batch_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        writes = []
+        repo._write_now = lambda name=None: writes.append(len(repo.read()))
+        with repo.batch():
+            for i in range(3):
+                repo.insert({'id': str(i)})
+                repo.write()
+            with repo.batch():
+                repo.delete('0')
+                repo.write()
+        try:
+            with repo.batch():
+                repo.write()
+                raise KeyError
+        except KeyError:
+            pass
+        # the write requested before the error is made by the next flush
+        repo.flush()
+        return writes
+
+    testif('writes once per batch',
+        crud_repository_batch_test(),
+        [2, 2],
+        name=qualify(BaseRepository.batch))
+
+    def crud_repository_group_commit_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        writes = []
+        repo._write_now = lambda name=None: writes.append(len(repo.read()))
+        repo.start_group_commit(interval=10)
+        for i in range(100):
+            repo.insert({'id': str(i)})
+            repo.write()
+        repo.stop_group_commit()
+        repo.write()
+        return writes
+
+    testif('defers writes to the group commit',
+        crud_repository_group_commit_test(),
+        [100, 100],
+        name=qualify(BaseRepository.start_group_commit))
+
+    def crud_repository_group_commit_changes_test():
+        repo = CrudRepository(test_wal_name)
+        repo.create(force=True)
+        repo.start_group_commit(interval=0)
+        for i in range(3000):
+            repo.insert({'id': str(i)})
+            repo.write()
+            if i % 2:
+                # compacted by the background writes while inserting
+                repo._remove_model(repo.get(str(i)))
+        repo.stop_group_commit()
+        return sorted(int(x['id']) for x in load_snapshot(repo.name))
+
+    testif('never loses changes made while the group commit writes',
+        crud_repository_group_commit_changes_test(),
+        list(range(0, 3000, 2)),
+        name=qualify(BaseRepository.start_group_commit))
+
+    def crud_repository_slotted_model_test():
+        from clay.models import compile_model
+        Team = compile_model('Team', {'name': str})
+        repo = CrudRepository(test_wal_name)
+        repo.set_model(Team)
+        repo.create(force=True)
+        repo.insert(Team(id='a', name='docs'))
+        repo.write()
+        repo = CrudRepository(test_wal_name)
+        repo.set_model(Team)
+        model = repo.get('a')
+        return type(model).__name__, model.to_json()
+
+    testif('reads and writes slotted models',
+        crud_repository_slotted_model_test(),
+        ('Team', {'id': 'a', 'name': 'docs'}),
+        name=qualify(CrudRepository.set_model))
+
+    def crud_repository_lazy_slotted_model_test():
+        import io
+        from clay.models import compile_model
+        Team = compile_model('Team', {'name': str})
+        with open(test_wal_name, 'w') as fp:
+            _json.dump([{'id': 'a', 'name': 'docs', 'size': 3}], fp)
+        repo = CrudRepository(test_wal_name)
+        repo.set_model(Team)
+        repo.set_lazy()
+        with _contextlib.redirect_stdout(io.StringIO()):
+            model = repo.get('a')
+        return repo.has_read, model.to_json()
+
+    testif('skips unknown keys of lazily read slotted models',
+        crud_repository_lazy_slotted_model_test(),
+        (False, {'id': 'a', 'name': 'docs'}),
+        name=qualify(CrudRepository.set_lazy))
+
+    test_sharded_name = r'test_files\test-sharded-repo.json'
+
+    def sharded_crud_repository_test():
+        repo = ShardedCrudRepository(test_sharded_name, shards=4)
+        for shard in repo.shards:
+            shard.create(force=True)
+        repo.insert_range([{'id': str(i), 'n': i} for i in range(20)])
+        repo.write()
+        inodes = [_os.stat(shard.name).st_ino for shard in repo.shards]
+
+        repo = ShardedCrudRepository(test_sharded_name, shards=4)
+        repo.update_prop('7', 'n', 70)
+        loaded = [shard.has_read for shard in repo.shards]
+        repo.write()
+        rewritten = [_os.stat(shard.name).st_ino != inode for shard, inode in zip(repo.shards, inodes)]
+        total = repo.read_queryable().select(lambda x: x['n']).sum()
+        return loaded == rewritten, sum(loaded), total
+
+    testif('reads and rewrites only the touched shard',
+        sharded_crud_repository_test(),
+        (True, 1, sum(range(20)) + 63),
+        name=qualify(ShardedCrudRepository.write))
+
+    def sharded_crud_repository_in_place_test():
+        repo = ShardedCrudRepository(test_sharded_name, shards=4)
+        repo.get('7')['n'] = 700
+        repo.release()
+        kept = repo.get('7')['n']
+        repo.write()
+        repo.release()
+        released = [shard.has_read for shard in repo.shards]
+        return kept, released, ShardedCrudRepository(test_sharded_name, shards=4).get('7')['n']
+
+    testif('writes models edited in place and keeps their shard on release',
+        sharded_crud_repository_in_place_test(),
+        (700, [False] * 4, 700),
+        name=qualify(ShardedCrudRepository.write))
+
+    def sharded_crud_repository_release_test():
+        repo = ShardedCrudRepository(test_sharded_name, shards=4)
+        for shard in repo.shards:
+            shard.set_wal()
+            shard.set_binary()
+            shard.create(force=True)
+        repo.create_index('name', 'sorted')
+        repo.insert_range([{'id': str(i), 'name': str(i)} for i in range(4)])
+        repo.write()
+        repo.release()
+        settings = [(type(shard._CrudRepository__indexes['name']).__name__, shard.binary)
+            for shard in repo.shards]
+        return [repo.get(str(i))['name'] for i in range(4)], len(repo.find_by('name', '2')), settings
+
+    testif('keeps the settings and indexes of released shards',
+        sharded_crud_repository_release_test(),
+        (['0', '1', '2', '3'], 1, [('SortedIndex', True)] * 4),
+        name=qualify(ShardedCrudRepository.release))
+
+    for shard in ShardedCrudRepository(test_sharded_name, shards=4).shards:
+        for filename in (shard.name, shard.lock_name, shard.wal_name):
+            if _os.path.exists(filename):
+                _os.remove(filename)
+
+    test_sqlite_name = r'test_files\test-repo.sqlite'
+
+    def sqlite_crud_repository_test():
+        repo = SqliteCrudRepository(test_sqlite_name)
+        repo.clear()
+        repo.create_index('age', 'sorted')
+        repo.insert_range([{'id': 'a', 'age': 30}, {'id': 'b', 'age': 17}, {'id': 'c', 'age': None}])
+        repo.update_prop('b', 'age', 18)
+        repo.get('c')['age'] = 41
+        repo.delete('a')
+        repo.write()
+        repo.close()
+
+        repo = SqliteCrudRepository(test_sqlite_name)
+        queryable = repo.read_queryable() \
+            .where(lambda x: (x['age'] >= 18) & (x['age'] != 30)) \
+            .where(lambda x: x['age'] > 10 and x['id'] != 'z') \
+            .select(lambda x: x['id'])
+        return queryable.to_list(), queryable.sql, [x['id'] for x in repo.find_range('age', 20)]
+
+    testif('stores, updates and queries models in SQLite',
+        sqlite_crud_repository_test(),
+        (['b', 'c'],
+            "(json_extract(data, '$.age') >= ? AND (json_extract(data, '$.age') IS NULL OR json_extract(data, '$.age') <> ?))",
+            ['c']),
+        name=qualify(SqliteQueryable.where))
+
+    def sqlite_crud_repository_fetch_test():
+        a = SqliteCrudRepository(test_sqlite_name)
+        a.clear()
+        a.insert({'id': 'v', 'v': 1})
+        a.write()
+        b = SqliteCrudRepository(test_sqlite_name)
+        b.update_prop('v', 'v', 2)
+        b.write()
+        changed = a.read()[0]['v']
+        a.get('v')['v'] = 3
+        fetched = a.read(fetch_if_read=True)[0]['v']
+        a.close()
+        b.close()
+        return changed, fetched
+
+    testif('decodes models changed by other writers again',
+        sqlite_crud_repository_fetch_test(),
+        (2, 2),
+        name=qualify(SqliteCrudRepository.read))
+
+    testraises('atomic batch with a duplicate key',
+        lambda: SqliteCrudRepository(test_sqlite_name).insert_range([{'id': 'x'}, {'id': 'x'}], atomic=True),
+        RuntimeError,
+        name=qualify(SqliteCrudRepository.insert_range))
+
+    testif('compiles only comparisons of fields to values',
+        [compile_predicate(predicate) is None for predicate in (
+            lambda x: x.age < 3,
+            lambda x: x['name'].startswith('a'),
+            lambda x: not x['a'] == 1,
+            lambda x: x['a'] == [1])],
+        [False, True, True, True])
+
+    for filename in (test_sqlite_name, test_wal_name, test_wal_name + '.wal', test_wal_name + '.lock', test_repo_name + '.lock'):
+        if _os.path.exists(filename):
+            _os.remove(filename)